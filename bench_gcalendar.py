@@ -0,0 +1,123 @@
+import datetime
+import json
+import os
+import statistics
+import timeit
+
+import click
+
+import gcalendar
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_baseline.json')
+
+#A helper counts as slower once it takes this many times its baseline, and
+#at least NOISE_FLOOR microseconds more than it. Most helpers take around a
+#microsecond, where the difference between two runs is mostly noise.
+DEFAULT_THRESHOLD = 1.25
+NOISE_FLOOR       = 2.0
+
+#How many rounds each helper is timed for, the median one is kept
+REPEAT = 15
+
+DT    = datetime.datetime(2020, 1, 2, 13, 45, 30)
+LATER = datetime.datetime(2020, 12, 31)
+EVENT = {
+    'start': {'dateTime': '2020-01-02T09:00:00-05:00'},
+    'end':   {'dateTime': '2020-01-02T10:30:00-05:00'},
+}
+
+BENCHMARKS = {
+    'RFC_from_UTC':       lambda: gcalendar.RFC_from_UTC(DT),
+    'get_utc_offset':     lambda: gcalendar.get_utc_offset(),
+    'get_min_time':       lambda: gcalendar.get_min_time(DT),
+    'get_max_time':       lambda: gcalendar.get_max_time(DT),
+    'gmt':                lambda: gcalendar.gmt(DT),
+    'from_gmt':           lambda: gcalendar.from_gmt(DT),
+    'utctimestamp_to_dt': lambda: gcalendar.utctimestamp_to_dt('2020-01-02T09:00:00-05:00'),
+    'date_from_dt':       lambda: gcalendar.date_from_dt(DT),
+    'dateobj_from_dt':    lambda: gcalendar.dateobj_from_dt(DT),
+    'dt_to_POSIX':        lambda: gcalendar.dt_to_POSIX(DT),
+    'get_start_and_end':  lambda: gcalendar.get_start_and_end(EVENT),
+    'get_min_and_max':    lambda: gcalendar.get_min_and_max(DT),
+    'get_event_time':     lambda: gcalendar.get_event_time(EVENT),
+    'get_days_of_week':   lambda: gcalendar.get_days_of_week(DT),
+    'get_current_week':   lambda: gcalendar.get_current_week(),
+    'get_day_range':      lambda: gcalendar.get_day_range(DT, LATER),
+    'dt_from_date':       lambda: gcalendar.dt_from_date('2020-01-02'),
+    'is_reldate':         lambda: gcalendar.is_reldate('next friday'),
+    'dt_from_reldate':    lambda: gcalendar.dt_from_reldate('next friday'),
+    'dt_from_day':        lambda: gcalendar.dt_from_day('friday'),
+}
+
+def measure(function, repeat=REPEAT, number=None):
+    '''Returns the median time of one call to a function in microseconds
+
+    Parameters:
+        function (callable): the function to time
+        repeat (int): how many rounds to time, the median one is kept
+        number (int): how many calls make up a round, picked automatically
+            so a round takes at least 0.2 seconds if not given
+
+    Returns:
+        float: the time of one call in microseconds
+    '''
+    timer = timeit.Timer(function)
+    if not number:
+        number, _ = timer.autorange()
+    return statistics.median(timer.repeat(repeat, number)) / number * 1e6
+
+def load_baseline(filename=BASELINE_FILE):
+    '''Returns the stored baseline, or an empty dict if there is none'''
+    if not os.path.isfile(filename):
+        return {}
+    with open(filename, 'r') as f:
+        return json.load(f)
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD, noise_floor=NOISE_FLOOR):
+    '''Returns the helpers that got slower than their baseline
+
+    Parameters:
+        results (dict): microseconds per call, keyed by helper name
+        baseline (dict): the stored microseconds per call
+        threshold (float): how many times its baseline a helper may take
+        noise_floor (float): how many microseconds more than its baseline a
+            helper may always take
+
+    Returns:
+        list: the names of the helpers that got slower
+    '''
+    return [name for name, us in results.items()
+            if name in baseline and us > baseline[name] * threshold and us - baseline[name] > noise_floor]
+
+@click.command()
+@click.option('--save', is_flag=True, help='stores the results as the new baseline')
+@click.option('--threshold', default=DEFAULT_THRESHOLD, show_default=True,
+        help='how many times its baseline a helper may take before it counts as a regression')
+@click.option('--noise-floor', default=NOISE_FLOOR, show_default=True,
+        help='how many microseconds more than its baseline a helper may always take')
+@click.option('-k', 'names', multiple=True, help='only runs the benchmarks with these names')
+def main(save, threshold, noise_floor, names):
+    '''Times the library helpers and compares them with the stored baseline'''
+    baseline = load_baseline()
+    results = {}
+    for name, function in BENCHMARKS.items():
+        if names and name not in names:
+            continue
+        results[name] = measure(function)
+        line = f'{name:<20} {results[name]:9.3f} us'
+        if name in baseline:
+            line += f'   {results[name] / baseline[name]:6.2f}x baseline'
+        click.echo(line)
+
+    slower = compare(results, baseline, threshold, noise_floor)
+    if save:
+        baseline.update(results)
+        with open(BASELINE_FILE, 'w') as f:
+            json.dump(baseline, f, indent=4, sort_keys=True)
+        click.echo(f'Saved the baseline to {BASELINE_FILE}')
+    elif slower:
+        click.echo(f'Slower than {threshold}x baseline (and by more than {noise_floor:g} us): {", ".join(slower)}')
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
@@ -1,31 +1,71 @@
+import base64
+import builtins
 import calendar
+import csv
 import datetime
+import hashlib
+import heapq
+import http.server
+import io
+import itertools
 import json
+import math
 import pathlib
 import os
 import pprint
+import queue
 import time
 import re
+import shlex
+import socket
+import socketserver
+import sqlite3
+import stat
 import sys
+import tempfile
+import threading
 import webbrowser
 
+from contextlib import contextmanager
 from copy import deepcopy
 
-import argparse
 import click
 
+try:
+    import readline
+except ImportError: #not available on Windows
+    readline = None
+
+try:
+    import fcntl
+except ImportError: #not available on Windows
+    fcntl = None
+    import msvcrt
+
+from gcalendar_client import DEFAULT_PROFILE, SOCKET_FILE, can_forward, connect_to_daemon, forward_to_daemon
+
+from google.oauth2.credentials import Credentials
+from google_auth_httplib2 import AuthorizedHttp, Request
+from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 from httplib2 import Http
-from oauth2client import file, client, tools
 
-SCOPES = 'https://www.googleapis.com/auth/calendar'
+SCOPES = ['https://www.googleapis.com/auth/calendar']
 FILE_DIRECTORY = str(pathlib.Path(__file__).parent)
+TOKEN_FILE = FILE_DIRECTORY + '\\token.json'
+HISTORY_FILE = os.path.join(FILE_DIRECTORY, '.gcalendar_history')
+JOURNAL_DIRECTORY = os.path.join(FILE_DIRECTORY, 'journals')
+STORE_FILE = os.path.join(FILE_DIRECTORY, 'events.db')
+PROFILE_DIRECTORY = os.path.join(FILE_DIRECTORY, 'profiles')
 
 #Start library
 
 DATE_PATTERN          = re.compile(r'(\d{4})[:/.-](\d{1,2})[:/.-](\d{1,2})')
 TIMESTAMP_PATTERN     = re.compile(r'(\d{4})-(\d{2})-(\d{2})T(\d{2}):(\d{2}):(\d{2})([+-]\d{2}:\d{2})?')
 RELATIVE_DATE_PATTERN = re.compile('(last|next)\s(\w+)', re.IGNORECASE)
+HOURS_PATTERN         = re.compile(r'(\d{1,2})(?::(\d{2}))?\s*-\s*(\d{1,2})(?::(\d{2}))?')
+PROFILE_PATTERN       = re.compile(r'[A-Za-z0-9_-]+')
 
 WEEKDAYS = {
     'sunday':    0, 
@@ -37,6 +77,72 @@ WEEKDAYS = {
     'saturday':  6,
 }
 
+ONE_DAY = datetime.timedelta(days=1)
+WEEK_OFFSETS = [datetime.timedelta(days=i) for i in range(7)]
+
+#The current week, worked out once a day (see get_current_week)
+CURRENT_WEEK = (None, [])
+
+#Number of keep-alive connections shared by all of the API calls of one run
+DEFAULT_POOL_SIZE = 20
+
+#Access tokens are refreshed this long before they expire
+REFRESH_MARGIN = datetime.timedelta(minutes=5)
+
+#Requests per batch request (the API allows up to 50) and how many batch
+#requests are sent at once
+BATCH_SIZE    = 50
+BATCH_WORKERS = 4
+
+#How many times a failed request is sent again, waiting 1, 2, 4... seconds
+MAX_RETRIES = 3
+RATE_LIMIT_REASONS = ['rateLimitExceeded', 'userRateLimitExceeded']
+
+#Used by --plan to estimate how long a job takes: the time (in seconds) of
+#one request and of one batch request, and the number of requests the API
+#allows per second (GCALENDAR_QUOTA overrides it, see quota_per_second)
+API_LATENCY      = 0.25
+BATCH_LATENCY    = 2.0
+QUOTA_PER_SECOND = 10
+
+#How long (in seconds) a process waits for another one to finish writing to
+#the local store before giving up
+STORE_TIMEOUT = 60
+
+#How long (in seconds) a cached day of events stays valid
+CACHE_TTL = 60
+
+#Cached days of events, keyed by (service, calendar id, date). None means
+#caching is turned off, see enable_event_cache. Guarded by EVENT_CACHE_LOCK
+#since days are read and cached from worker threads
+EVENT_CACHE = None
+EVENT_CACHE_LOCK = threading.Lock()
+
+#The real id of the primary calendar of each service, learned from
+#get_calendar_list so that the primary calendar is cached under one key
+PRIMARY_IDS = {}
+
+#The free/busy endpoint only accepts so many calendars and days per query
+FREEBUSY_MAX_CALENDARS = 50
+FREEBUSY_MAX_DAYS      = 60
+
+#Push notifications are received on this port by default, and channels are
+#reopened this long (in seconds) before they expire
+WATCH_PORT   = 8080
+WATCH_TTL    = 7 * 24 * 3600
+WATCH_MARGIN = 3600
+
+#The longest wait (in seconds) before a calendar that could not be synced is
+#tried again
+WATCH_RETRY_MAX = 300
+
+#The fields of an event that an upload or copy sets, see changed_fields
+EVENT_FIELDS = ['summary', 'description', 'location', 'colorId', 'start', 'end', 'transparency',
+                'visibility', 'recurrence']
+
+#Columns of the CSV files written by export
+CSV_FIELDS = ['calendar', 'id', 'summary', 'start', 'end', 'all_day', 'color', 'location', 'description']
+
 COLOR_MAP = {
     'orange': '6',
     'blue': '7',
@@ -97,10 +203,7 @@ def get_max_time(dt):
         datetime.datetime: a datetime.datetime object with its hours,
             minutes, and seconds set to their maximum value
     '''
-    date = dateobj_from_dt(dt)
-    date = date + datetime.timedelta(days=1)
-
-    return datetime.datetime(date.year, date.month, date.day, 0, 0, 0)
+    return datetime.datetime(dt.year, dt.month, dt.day) + ONE_DAY
     #return datetime.datetime(dt.year, dt.month, dt.day, 23, 59, 59)
 
 def gmt(dt):
@@ -123,6 +226,36 @@ def gmt(dt):
     else:
         return dt
 
+def from_gmt(dt):
+    '''Returns a datetime in GMT converted back to the current timezone
+
+    This is the inverse of gmt.
+
+    Parameters:
+        dt (datetime.datetime): a datetime.datetime object in GMT
+
+    Returns:
+        datetime.datetime: a datetime.datetime object in the current timezone
+    '''
+    return dt + datetime.timedelta(hours=get_utc_offset())
+
+def to_local(timestamp):
+    '''Returns a timestamp converted to the current timezone
+
+    Unlike from_gmt, the offset of the current timezone on the day of the
+    timestamp is used, so times on the other side of a daylight saving
+    change come out right.
+
+    Parameters:
+        timestamp (str): an RFC 3339 timestamp, with or without an offset
+
+    Returns:
+        datetime.datetime: a naive datetime.datetime object in the current
+            timezone
+    '''
+    dt = datetime.datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+    return dt.astimezone().replace(tzinfo=None)
+
 def utctimestamp_to_dt(timestamp):
     '''Returns a datetime.datetime object from a UTC timestamp
 
@@ -133,14 +266,7 @@ def utctimestamp_to_dt(timestamp):
         datetime.datetime: a datetime.datetime object with the same time
             as the given timestamp
     '''
-    date = re.match(TIMESTAMP_PATTERN, timestamp)
-    return datetime.datetime(
-            int(date.group(1)),
-            int(date.group(2)),
-            int(date.group(3)),
-       hour=int(date.group(4)),
-     minute=int(date.group(5)),
-     second=int(date.group(6)))
+    return datetime.datetime.fromisoformat(timestamp[:19])
 
 def date_from_dt(dt):
     '''Returns a date of the form YYYY-MM-DD from a datetime.datetime object
@@ -154,30 +280,313 @@ def date_from_dt(dt):
     return f'{dt.year}-{dt.month:02}-{dt.day:02}'
 
 def dateobj_from_dt(dt):
-    return datetime.date.fromisoformat(date_from_dt(dt))
+    return datetime.date(dt.year, dt.month, dt.day)
 
-def get_events(service, dt):
+def get_events(service, dt, calendar_id='primary', cached=True):
     '''Returns a list of events from a given date   
 
     Parameters:
         service (googleapiclient.discovery.Resource): A Resource object that
             uses the Google Calendar v3 API
         dt (datetime.datetime): a datetime.datetime object
+        calendar_id (str): the id of the calendar to pull events from
+        cached (bool): whether or not a cached day may be returned (see
+            enable_event_cache). Reads that decide what gets changed should
+            not use one, since it can miss events made elsewhere.
 
     Returns:
         list: a list of all event (JSON) objects from a given date
     '''
+    key = event_cache_key(service, calendar_id, date_from_dt(dt))
+    if EVENT_CACHE is not None and cached:
+        with EVENT_CACHE_LOCK:
+            cached = EVENT_CACHE.get(key)
+        if cached and time.monotonic() - cached[0] < CACHE_TTL:
+            return cached[1]
+
     mn, mx = get_min_and_max(dt)
     mintime = RFC_from_UTC(gmt(mn))
     maxtime = RFC_from_UTC(gmt(mx))
-    result = service.events().list(calendarId='primary', timeMin=mintime, timeMax=maxtime,
+    result = service.events().list(calendarId=calendar_id, timeMin=mintime, timeMax=maxtime,
                                     singleEvents=True, orderBy='startTime').execute()
     items = result.get('items', [])
     if not items:
-        return None
+        items = None
+
+    if EVENT_CACHE is not None:
+        with EVENT_CACHE_LOCK:
+            EVENT_CACHE[key] = (time.monotonic(), items)
     return items
 
+def event_cache_key(service, calendar_id, date):
+    '''Returns the key a day of a calendar is cached under
+
+    The primary calendar is cached under "primary" whether it is asked for
+    by that name or by its real id.
+
+    Parameters:
+        service (googleapiclient.discovery.Resource): A Resource object that
+            uses the Google Calendar v3 API
+        calendar_id (str): the id of the calendar
+        date (str): a date of the form YYYY-MM-DD, or None
+
+    Returns:
+        tuple: the key of the day
+    '''
+    if calendar_id == PRIMARY_IDS.get(service):
+        calendar_id = 'primary'
+    return (service, calendar_id, date)
+
+def enable_event_cache():
+    '''Turns on caching for get_events
+
+    Meant for long running sessions where the same days are listed again 
+    and again. Cached days expire after CACHE_TTL seconds and a calendar's
+    days are dropped whenever events are uploaded to or deleted from it.
+    '''
+    global EVENT_CACHE
+    with EVENT_CACHE_LOCK:
+        if EVENT_CACHE is None:
+            EVENT_CACHE = {}
+
+def invalidate_event_cache(service, calendar_id):
+    '''Drops every cached day of a calendar
+
+    Parameters:
+        service (googleapiclient.discovery.Resource): A Resource object that
+            uses the Google Calendar v3 API
+        calendar_id (str): the id of the calendar
+    '''
+    if EVENT_CACHE is None:
+        return
+    calendar = event_cache_key(service, calendar_id, None)[:2]
+    with EVENT_CACHE_LOCK:
+        for key in [k for k in EVENT_CACHE if k[:2] == calendar]:
+            del EVENT_CACHE[key]
+
 from concurrent.futures import ThreadPoolExecutor, wait
+
+def get_calendar_list(service):
+    '''Returns every calendar on the user's calendar list
+
+    Parameters:
+        service (googleapiclient.discovery.Resource): A Resource object that
+            uses the Google Calendar v3 API
+
+    Returns:
+        list: a list of calendarList entry (JSON) objects
+    '''
+    calendars = []
+    page_token = None
+    while True:
+        result = service.calendarList().list(pageToken=page_token).execute()
+        calendars.extend(result.get('items', []))
+        page_token = result.get('nextPageToken')
+        if not page_token:
+            break
+
+    for c in calendars:
+        if c.get('primary'):
+            PRIMARY_IDS[service] = c['id']
+    return calendars
+
+def resolve_calendars(service, names, all_calendars=False):
+    '''Returns a list of calendar ids from calendar names or ids
+
+    A name can either be the id of a calendar or its summary (case is 
+    ignored). "primary" is always accepted. If no names are given and
+    all_calendars is False, only the primary calendar is used.
+
+    Parameters:
+        service (googleapiclient.discovery.Resource): A Resource object that
+            uses the Google Calendar v3 API
+        names (tuple): calendar ids or summaries
+        all_calendars (bool): whether or not to use every calendar on the
+            user's calendar list
+
+    Returns:
+        list: a list of calendar ids, or None if a name could not be resolved
+    '''
+    if not names and not all_calendars:
+        return ['primary']
+
+    calendars = get_calendar_list(service)
+    if all_calendars:
+        return [c['id'] for c in calendars]
+
+    ids = []
+    for name in names:
+        if name == 'primary':
+            ids.append(name)
+            continue
+        for c in calendars:
+            if name == c['id'] or name.lower() == c.get('summary', '').lower():
+                ids.append(c['id'])
+                break
+        else:
+            return None
+    return ids
+
+def event_start_key(event):
+    '''Returns a key that orders events by their start
+
+    Timed events are compared as instants, so events written with different
+    UTC offsets still come out in order. All day events start at midnight
+    in the current timezone and sort before any timed event starting at the
+    same moment.
+
+    Parameters:
+        event (dict): a dict representing an event object
+
+    Returns:
+        tuple: the start of the event as an aware datetime.datetime object,
+            and 0 for all day events or 1 for timed events
+    '''
+    start = event['start']
+    if 'dateTime' in start:
+        return (datetime.datetime.fromisoformat(start['dateTime'].replace('Z', '+00:00')).astimezone(), 1)
+    return (datetime.datetime.fromisoformat(start['date']).astimezone(), 0)
+
+def get_events_by_calendar(service, dt, calendar_ids, cached=True):
+    '''Returns the events of a given date for each calendar
+
+    Calendars are queried concurrently.
+
+    Parameters:
+        service (googleapiclient.discovery.Resource): A Resource object that
+            uses the Google Calendar v3 API
+        dt (datetime.datetime): a datetime.datetime object
+        calendar_ids (list): a list of calendar ids
+        cached (bool): whether or not cached days may be returned (see
+            get_events)
+
+    Returns:
+        dict: a dict mapping each calendar id to its list of events (or None)
+    '''
+    if len(calendar_ids) == 1:
+        return {calendar_ids[0]: get_events(service, dt, calendar_ids[0], cached)}
+
+    with ThreadPoolExecutor(max_workers=min(len(calendar_ids), 20)) as executor:
+        futures = {c: executor.submit(get_events, service, dt, c, cached) for c in calendar_ids}
+        return {c: f.result() for c, f in futures.items()}
+
+def get_events_from_calendars(service, dt, calendar_ids):
+    '''Returns the events of a given date from several calendars
+
+    Each calendar's events are already ordered by their start, so they are
+    combined with a k-way merge into one ordered list.
+
+    Parameters:
+        service (googleapiclient.discovery.Resource): A Resource object that
+            uses the Google Calendar v3 API
+        dt (datetime.datetime): a datetime.datetime object
+        calendar_ids (list): a list of calendar ids
+
+    Returns:
+        list: a list of event objects ordered by their start
+    '''
+    results = get_events_by_calendar(service, dt, calendar_ids)
+    streams = [events for events in results.values() if events]
+    items = [e for e in heapq.merge(*streams, key=event_start_key)]
+    if not items:
+        return None
+    return items
+
+def iter_events(service, start, end, calendar_id='primary'):
+    '''Yields every event of a calendar from start to end, one page at a time
+
+    Parameters:
+        service (googleapiclient.discovery.Resource): A Resource object that
+            uses the Google Calendar v3 API
+        start (datetime.datetime): the start of the window
+        end (datetime.datetime): the end of the window
+        calendar_id (str): the id of the calendar to pull events from
+
+    Yields:
+        dict: event (JSON) objects ordered by their start
+    '''
+    page_token = None
+    while True:
+        result = service.events().list(calendarId=calendar_id, timeMin=RFC_from_UTC(gmt(start)),
+                                        timeMax=RFC_from_UTC(gmt(end)), singleEvents=True,
+                                        orderBy='startTime', maxResults=2500,
+                                        pageToken=page_token).execute()
+        yield from result.get('items', [])
+        page_token = result.get('nextPageToken')
+        if not page_token:
+            return
+
+def iter_events_from_calendars(service, start, end, calendar_ids=('primary',)):
+    '''Yields the events of several calendars from start to end in order
+
+    Pages are only fetched when they are needed, so memory use does not
+    grow with the size of the window.
+
+    Parameters:
+        service (googleapiclient.discovery.Resource): A Resource object that
+            uses the Google Calendar v3 API
+        start (datetime.datetime): the start of the window
+        end (datetime.datetime): the end of the window
+        calendar_ids (list): a list of calendar ids
+
+    Yields:
+        tuple: (calendar id, event) tuples ordered by the start of the event
+    '''
+    def tagged(calendar_id):
+        for event in iter_events(service, start, end, calendar_id):
+            yield (calendar_id, event)
+
+    streams = [tagged(c) for c in calendar_ids]
+    yield from heapq.merge(*streams, key=lambda item: event_start_key(item[1]))
+
+def get_range_by_calendar(service, dt1, dt2, calendar_ids=('primary',)):
+    '''Returns the events of each calendar from dt1 to dt2 (inclusive)
+
+    The whole range is fetched with one query per calendar (plus paging)
+    instead of one query per day. Calendars are queried concurrently.
+
+    Parameters:
+        service (googleapiclient.discovery.Resource): A Resource object that
+            uses the Google Calendar v3 API
+        dt1 (datetime.datetime): The starting datetime
+        dt2 (datetime.datetime): The ending datetime
+        calendar_ids (list): a list of calendar ids
+
+    Returns:
+        dict: a dict mapping each calendar id to its events ordered by start
+    '''
+    start = get_min_time(dt1)
+    end = get_max_time(dt2)
+
+    def fetch(calendar_id):
+        return [e for e in iter_events(service, start, end, calendar_id)]
+
+    with ThreadPoolExecutor(max_workers=min(len(calendar_ids), 20)) as executor:
+        futures = {c: executor.submit(fetch, c) for c in calendar_ids}
+        return {c: f.result() for c, f in futures.items()}
+
+def get_events_in_range(service, dt1, dt2, calendar_ids=('primary',)):
+    '''Returns the events of several calendars from dt1 to dt2 (inclusive)
+
+    See get_range_by_calendar. The events of every calendar are merged 
+    into one list ordered by start.
+
+    Parameters:
+        service (googleapiclient.discovery.Resource): A Resource object that
+            uses the Google Calendar v3 API
+        dt1 (datetime.datetime): The starting datetime
+        dt2 (datetime.datetime): The ending datetime
+        calendar_ids (list): a list of calendar ids
+
+    Returns:
+        list: a list of event objects ordered by their start
+    '''
+    streams = get_range_by_calendar(service, dt1, dt2, calendar_ids).values()
+    items = [e for e in heapq.merge(*streams, key=event_start_key)]
+    if not items:
+        return None
+    return items
+
 def get_multiple_events(service, day_range):
     threads = []
     with ThreadPoolExecutor(max_workers=20) as executor:
@@ -190,6 +599,147 @@ def get_multiple_events(service, day_range):
         return [x.result() for x in done]
 
 
+def merge_intervals(intervals):
+    '''Merges overlapping intervals into a sorted list of disjoint intervals
+
+    Parameters:
+        intervals (iterable): (start, end) tuples
+
+    Returns:
+        list: a list of (start, end) tuples ordered by start with no overlaps
+    '''
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+def get_busy_intervals(service, dt1, dt2, calendar_ids=('primary',)):
+    '''Returns the busy intervals of several calendars from dt1 to dt2 (inclusive)
+
+    Uses the free/busy endpoint so that only the intervals are sent back
+    instead of whole events. The whole range is covered with as few queries
+    as the endpoint allows, and the queries are sent concurrently.
+
+    Parameters:
+        service (googleapiclient.discovery.Resource): A Resource object that
+            uses the Google Calendar v3 API
+        dt1 (datetime.datetime): The starting datetime
+        dt2 (datetime.datetime): The ending datetime
+        calendar_ids (list): a list of calendar ids
+
+    Returns:
+        list: merged (start, end) tuples in the current timezone, or None if
+            any calendar could not be queried
+    '''
+    bodies = []
+    start = get_min_time(dt1)
+    end = get_max_time(dt2)
+    while start < end:
+        chunk_end = min(start + datetime.timedelta(days=FREEBUSY_MAX_DAYS), end)
+        for i in range(0, len(calendar_ids), FREEBUSY_MAX_CALENDARS):
+            bodies.append({
+                'timeMin': RFC_from_UTC(gmt(start)),
+                'timeMax': RFC_from_UTC(gmt(chunk_end)),
+                'items': [{'id': c} for c in calendar_ids[i:i+FREEBUSY_MAX_CALENDARS]],
+            })
+        start = chunk_end
+
+    def query(body):
+        return service.freebusy().query(body=body).execute()
+
+    with ThreadPoolExecutor(max_workers=max(min(len(bodies), 20), 1)) as executor:
+        results = [*executor.map(query, bodies)]
+
+    intervals = []
+    for result in results:
+        for cal in result.get('calendars', {}).values():
+            if cal.get('errors'):
+                return None
+            for period in cal.get('busy', []):
+                intervals.append((to_local(period['start']), to_local(period['end'])))
+    return merge_intervals(intervals)
+
+def parse_hours(value):
+    '''Returns the start and end of working hours from a string
+
+    Parameters:
+        value (str): a string in the form 9:00-17:30 (minutes are optional)
+
+    Returns:
+        tuple: the start and end as datetime.timedelta objects from
+            midnight, or None if value is not valid
+    '''
+    match = HOURS_PATTERN.fullmatch(value.strip())
+    if not match:
+        return None
+    h1, m1, h2, m2 = (int(group or 0) for group in match.groups())
+    start = datetime.timedelta(hours=h1, minutes=m1)
+    end = datetime.timedelta(hours=h2, minutes=m2)
+    if m1 > 59 or m2 > 59 or not start < end <= ONE_DAY:
+        return None
+    return (start, end)
+
+def free_slots(busy, dt1, dt2, min_length=datetime.timedelta(), hours=None, weekdays=False):
+    '''Returns the free slots from dt1 to dt2 (inclusive)
+
+    The days are turned into windows of time (the working hours of each
+    day, or the whole range at once) and swept together with the busy
+    intervals. Both are ordered, so each busy interval is only looked at
+    for the windows it overlaps.
+
+    Parameters:
+        busy (list): merged (start, end) tuples from merge_intervals
+        dt1 (datetime.datetime): The starting datetime
+        dt2 (datetime.datetime): The ending datetime
+        min_length (datetime.timedelta): the shortest slot to return
+        hours (tuple): the start and end of working hours from parse_hours,
+            or None to use the whole day
+        weekdays (bool): whether or not to leave out Saturdays and Sundays
+
+    Returns:
+        list: (start, end) tuples ordered by start
+    '''
+    day_start, day_end = hours or (datetime.timedelta(), ONE_DAY)
+    days = iter_day_range(get_min_time(dt1), get_min_time(dt2))
+    windows = merge_intervals((day + day_start, day + day_end) for day in days if not weekdays or day.weekday() < 5)
+
+    slots = []
+    i = 0
+    for start, end in windows:
+        while i < len(busy) and busy[i][1] <= start:
+            i += 1
+        j = i
+        while j < len(busy) and busy[j][0] < end:
+            if busy[j][0] - start >= min_length and busy[j][0] > start:
+                slots.append((start, busy[j][0]))
+            start = max(start, busy[j][1])
+            j += 1
+        if end - start >= min_length and end > start:
+            slots.append((start, end))
+    return slots
+
+def print_free_slots(slots):
+    '''Prints free slots under a heading for each day they start on
+
+    Parameters:
+        slots (list): (start, end) tuples from free_slots
+    '''
+    lines = []
+    for day, group in itertools.groupby(slots, key=lambda slot: date_from_dt(slot[0])):
+        if lines:
+            lines.append('')
+        lines.append(f'{dt_from_date(day):%A}, {day}')
+        for start, end in group:
+            until = format_time(end)
+            if get_min_time(end) > get_min_time(start) and end != get_min_time(start) + ONE_DAY:
+                until = f'{end:%A}, {date_from_dt(end)} {until}'
+            lines.append(f'  {format_time(start)} - {until}  ({format_duration(end - start)})')
+    sys.stdout.write(''.join(line + '\n' for line in lines))
+
 def dt_to_POSIX(dt):
     '''Returns a POSIX timestamp from a datetime.datetime object
 
@@ -204,6 +754,9 @@ def dt_to_POSIX(dt):
 def get_start_and_end(event):
     '''Returns a tuple of the start and end of an event
 
+    All day events start at the beginning of their first day and end at
+    the beginning of the day after their last day.
+
     Parameters:
         event (dict): a dict representing an event object
 
@@ -211,6 +764,9 @@ def get_start_and_end(event):
         tuple: a tuple with the first index as the start 
             of an event and the second index as the end of an event
     '''
+    if 'dateTime' not in event['start']:
+        return (dt_from_date(event['start']['date']), dt_from_date(event['end']['date']))
+
     s_timestamp = event['start']['dateTime']
     e_timestamp = event['end']['dateTime']
 
@@ -218,6 +774,23 @@ def get_start_and_end(event):
     end   = utctimestamp_to_dt(e_timestamp)
     return (start, end)
 
+def get_local_start_and_end(event):
+    '''Returns a tuple of the start and end of an event in the current timezone
+
+    Works like get_start_and_end, but timed events are converted to the
+    current timezone instead of keeping their own wall clock time.
+
+    Parameters:
+        event (dict): a dict representing an event object
+
+    Returns:
+        tuple: a tuple with the first index as the start 
+            of an event and the second index as the end of an event
+    '''
+    if 'dateTime' not in event['start']:
+        return get_start_and_end(event)
+    return (to_local(event['start']['dateTime']), to_local(event['end']['dateTime']))
+
 def get_min_and_max(dt):
     '''Returns a tuple of the minimum and maximum of a date
 
@@ -247,6 +820,141 @@ def get_event_time(event):
     s, e = get_start_and_end(event)
     return e - s
 
+def event_intervals(events):
+    '''Returns (start, end, event) tuples for a list of events
+
+    All day events are left out since they don't take up any time.
+
+    Parameters:
+        events (list): a list of Google Calendar event objects
+
+    Returns:
+        list: a list of (start, end, event) tuples
+    '''
+    intervals = []
+    for event in events:
+        if 'dateTime' not in event['start']:
+            continue
+        start, end = get_start_and_end(event)
+        intervals.append((start, end, event))
+    return intervals
+
+class IntervalTree:
+    '''A static centered interval tree
+
+    Intervals are half open, so an interval that ends when another begins
+    does not overlap it. Both overlap queries and clipped time queries take
+    O(log n + k) where k is the number of overlapping intervals.
+
+    Parameters:
+        intervals (list): a list of (start, end, value) tuples
+    '''
+
+    def __init__(self, intervals):
+        intervals = [i for i in intervals if i[0] < i[1]]
+        self.size = len(intervals)
+        self.root = self._build(sorted(intervals, key=lambda i: i[0]))
+
+    def __len__(self):
+        return self.size
+
+    def _build(self, intervals):
+        '''Builds a node from intervals sorted by their start'''
+        if not intervals:
+            return None
+
+        #the median start always lies inside its own interval, so every node
+        #keeps at least one interval and the tree always gets smaller
+        center = intervals[len(intervals) // 2][0]
+        left, here, right = [], [], []
+        for i in intervals:
+            if i[1] <= center:
+                left.append(i)
+            elif i[0] > center:
+                right.append(i)
+            else:
+                here.append(i)
+
+        by_end = sorted(here, key=lambda i: i[1], reverse=True)
+        return (center, here, by_end, self._build(left), self._build(right))
+
+    def overlapping(self, start, end):
+        '''Returns every interval that overlaps a window
+
+        Parameters:
+            start: the start of the window
+            end: the end of the window
+
+        Returns:
+            list: (start, end, value) tuples that overlap the window
+        '''
+        found = []
+        nodes = [self.root]
+        while nodes:
+            node = nodes.pop()
+            if node is None:
+                continue
+            center, by_start, by_end, left, right = node
+            if end <= center:
+                for i in by_start:
+                    if i[0] >= end:
+                        break
+                    found.append(i)
+                nodes.append(left)
+            elif start > center:
+                for i in by_end:
+                    if i[1] <= start:
+                        break
+                    found.append(i)
+                nodes.append(right)
+            else:
+                found.extend(by_start)
+                nodes.append(left)
+                nodes.append(right)
+        return found
+
+    def clipped_time(self, start, end, predicate=None):
+        '''Returns the total time of the intervals clipped to a window
+
+        Only the part of an interval that lies inside of the window is
+        counted, so an interval spanning several windows is split between them.
+
+        Parameters:
+            start (datetime.datetime): the start of the window
+            end (datetime.datetime): the end of the window
+            predicate (function): if given, only intervals whose value it
+                returns True for are counted
+
+        Returns:
+            datetime.timedelta: the total clipped time
+        '''
+        td = datetime.timedelta()
+        for s, e, value in self.overlapping(start, end):
+            if predicate is None or predicate(value):
+                td += min(e, end) - max(s, start)
+        return td
+
+def group_by_day(events, day_range):
+    '''Groups events by the days they take place on
+
+    An event that spans several days is put in the group of each day, just
+    like get_events would return it for each of those days.
+
+    Parameters:
+        events (list): a list of Google Calendar event objects
+        day_range (list): a list of datetime.datetime objects
+
+    Returns:
+        dict: a dict mapping each date (see date_from_dt) to a list of 
+            events ordered by their start
+    '''
+    tree = IntervalTree([(*get_start_and_end(event), event) for event in events])
+    days = {}
+    for d in day_range:
+        found = sorted(tree.overlapping(*get_min_and_max(d)), key=lambda i: i[0])
+        days[date_from_dt(d)] = [i[2] for i in found]
+    return days
+
 def get_days_of_week(dt):
     '''Returns a list of days corresponding to a week in time
 
@@ -260,30 +968,23 @@ def get_days_of_week(dt):
         list: a list of datetime.datetime objects corresponding to the days
             of a week from a given datetime.datetime object
     '''
-    date = calendar.weekday(dt.year, dt.month, dt.day)
-    if date == 6:
-        days = []
-        for i in range(7):
-            days.append(datetime.datetime(dt.year, dt.month, dt.day) + datetime.timedelta(days=i))
-        return days
-
-    offset = 0
-    while date != 6:
-        offset -= 1 
-        dt2 = dt + datetime.timedelta(days=offset)
-        date = calendar.weekday(dt2.year, dt2.month, dt2.day)
-    days = []
-    for i in range(7):
-        days.append(datetime.datetime(dt.year, dt.month, dt.day) + datetime.timedelta(days=(offset+i)))
-    return days
+    #weekday() counts from Monday, so Sunday is 6 days back on Saturday
+    sunday = datetime.datetime(dt.year, dt.month, dt.day) - ONE_DAY * ((dt.weekday() + 1) % 7)
+    return [sunday + WEEK_OFFSETS[i] for i in range(7)]
 
 def get_current_week():
     '''Returns a list of days representing the current week
 
     Order of days: Sunday, Monday, Tuesday, Wednesday, Thursday, Friday,
         Saturday
+
+    The week is only worked out again once the day changes.
     '''
-    return get_days_of_week(datetime.datetime.today())
+    global CURRENT_WEEK
+    today = datetime.date.today()
+    if CURRENT_WEEK[0] != today:
+        CURRENT_WEEK = (today, get_days_of_week(today))
+    return CURRENT_WEEK[1][:]
 
 def get_day_range(dt1, dt2):
     '''Returns a list of datetime.datetime objects from dt1 to dt2 (inclusive)
@@ -296,24 +997,31 @@ def get_day_range(dt1, dt2):
             between dt1 and dt2
     '''
 
-    dt1 = datetime.datetime(dt1.year, dt1.month, dt1.day)
-    dt2 = datetime.datetime(dt2.year, dt2.month, dt2.day)
-    
-    td = datetime.timedelta(days=1)
-    dt_range = []
-    current_dt = dt1
-    while current_dt < dt2+td:
-        dt_range.append(current_dt)
-        current_dt += td
-    return dt_range
-
-def dt_from_date(date):
-    '''Returns a datetime.datetime object from a date of the form YYYY-MM-DD 
+    return [*iter_day_range(dt1, dt2)]
 
-    Parameters: 
-        date (str): a date of the form YYYY-MM-DD
+def iter_day_range(dt1, dt2):
+    '''Yields the days from dt1 to dt2 (inclusive) one at a time
 
-    Returns:
+    Parameters:
+        dt1 (datetime.datetime): The starting datetime
+        dt2 (datetime.datetime): The ending datetime
+
+    Yields:
+        datetime.datetime: the start of each day in the range
+    '''
+    current = datetime.datetime(dt1.year, dt1.month, dt1.day)
+    end = datetime.datetime(dt2.year, dt2.month, dt2.day)
+    while current <= end:
+        yield current
+        current += ONE_DAY
+
+def dt_from_date(date):
+    '''Returns a datetime.datetime object from a date of the form YYYY-MM-DD 
+
+    Parameters: 
+        date (str): a date of the form YYYY-MM-DD
+
+    Returns:
         datetime.datetime: a datetime.datetime object corresponding to the
             given date
     '''
@@ -409,24 +1117,147 @@ def clone_events(events):
 
     return new_events
 
-def save_events(events, filename):
+@contextmanager
+def atomic_write(filename, mode='w', **kwargs):
+    '''Opens a file that replaces filename in one step once it is written
+
+    The file is written next to filename under a temporary name and only
+    renamed over it once it was written in full, so other processes either
+    see the old file or the new one, never half of one. Nothing is replaced
+    if writing fails.
+
+    Parameters:
+        filename (str): the path of the file to write
+        mode (str): the mode to open the file in, see open
+        **kwargs: passed on to open
+
+    Returns:
+        file: the temporary file to write to
+    '''
+    directory, name = os.path.split(os.path.abspath(filename))
+    fd, temp = tempfile.mkstemp(prefix=f'.{name}.', suffix='.tmp', dir=directory)
+    try:
+        with open(fd, mode, **kwargs) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(filename):
+            os.chmod(temp, stat.S_IMODE(os.stat(filename).st_mode))
+        os.replace(temp, filename)
+    except BaseException:
+        os.remove(temp)
+        raise
+
+class FileLock:
+    '''A lock on a file that is shared by every gcalendar process
+
+    The lock is taken on a separate lock file next to the guarded file
+    (path + '.lock'), with flock on Unix and msvcrt.locking on Windows. It
+    is released when the process exits, even if it crashes.
+
+    Parameters:
+        path (str): the path of the file to guard
+    '''
+
+    def __init__(self, path):
+        self.path = path + '.lock'
+        self._fd = None
+
+    @property
+    def held(self):
+        '''Whether or not this process holds the lock'''
+        return self._fd is not None
+
+    def acquire(self, blocking=True):
+        '''Takes the lock
+
+        Parameters:
+            blocking (bool): whether or not to wait while another process
+                holds the lock
+
+        Returns:
+            bool: whether or not the lock was taken
+        '''
+        if self.held:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if fcntl:
+                fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            else:
+                while True:
+                    try:
+                        msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+                        break
+                    except OSError:
+                        if not blocking:
+                            raise
+                        time.sleep(0.05)
+        except OSError:
+            os.close(fd)
+            if blocking:
+                raise
+            return False
+        self._fd = fd
+        return True
+
+    def release(self, remove=False):
+        '''Releases the lock
+
+        Parameters:
+            remove (bool): also remove the lock file, once the guarded file
+                is gone for good
+        '''
+        if not self.held:
+            return
+        if not fcntl:
+            os.lseek(self._fd, 0, os.SEEK_SET)
+            msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+        os.close(self._fd)
+        self._fd = None
+        if remove:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+def save_events(events, filename, start=None, days=1):
     '''Saves Google Calendar events to a JSON file
 
     Each Google Calendar object is cloned and saved to the specified JSON
     file
 
+    A schedule that spans several days is saved along with the day it
+    starts on and how many days it covers, so every event keeps its offset
+    from the first day when it is uploaded (see load_template).
+
+    The file is replaced in one step, so a schedule that is being loaded
+    by another process is never seen half written.
+
     Parameters:
         events (list): a list of Google Calendar event objects
         filename (str): a filename pointing to a JSON file
+        start (datetime.datetime): the first day of a multi-day schedule
+        days (int): the number of days a multi-day schedule covers
     '''
     new_events = []
     for event in events:
         new_events.append(clone_event(event))
 
-    with open(filename, 'w') as f:
-        json.dump(events, f)
+    with atomic_write(filename) as f:
+        if start:
+            json.dump({'start': date_from_dt(start), 'days': days, 'events': events}, f)
+        else:
+            json.dump(events, f)
 
-def upload_events(service, events, dt):
+def upload_events(service, events, dt, calendar_id='primary', template=None):
     '''Uploads events to a given day on Google Calendar
 
     This function takes the difference between an event's starting time and
@@ -437,26 +1268,86 @@ def upload_events(service, events, dt):
     Each Google Calendar event object is cloned before it is sent off so
     there are no conflicts with already existing events.
 
+    If a template name is given, every event gets an id made from the
+    template name, its index and the date (see event_id), so uploading the
+    same template to the same day twice never creates duplicates.
+
     Parameters:
         service (googleapiclient.discovery.Resource): A Resource object that
             uses the Google Calendar v3 API
         events (list): a list of Google Calendar event objects
         dt (datetime.datetime): the date to upload the events to
+        calendar_id (str): the id of the calendar to upload the events to
+        template (str): the name of the template the events come from
+
+    Returns:
+        list: a list of (mutation, exception) tuples for the events that
+            could not be uploaded (see run_mutations)
     '''
-    cal = service.events()
+    return run_mutations(service, plan_upload(events, dt, calendar_id, template))
+
+def event_id(template, index, dt, calendar_id='primary'):
+    '''Returns a deterministic event id
+
+    The id only depends on its arguments, so sending the same insert again
+    runs into a conflict instead of creating a second event. Ids use the
+    base32hex alphabet required by the API.
+
+    Parameters:
+        template (str): the name of the template the event comes from
+        index (int): the index of the event in the template
+        dt (datetime.datetime): the date the event is uploaded to
+        calendar_id (str): the id of the calendar the event is uploaded to
+
+    Returns:
+        str: an event id
+    '''
+    key = f'{calendar_id}\0{template}\0{index}\0{date_from_dt(dt)}'
+    digest = hashlib.sha1(key.encode()).digest()
+    return base64.b32hexencode(digest).decode().rstrip('=').lower()
+
+def plan_upload(events, dt, calendar_id='primary', template=None, origin=None):
+    '''Returns the mutations that upload events to a given day
+
+    See upload_events for how the events are moved to the given day. If
+    origin is given, every event is moved by the days between origin and dt
+    instead, so the events of a multi-day schedule keep their offsets from
+    its first day.
+
+    Parameters:
+        events (list): a list of Google Calendar event objects
+        dt (datetime.datetime): the date to upload the events to
+        calendar_id (str): the id of the calendar to upload the events to
+        template (str): if given, the events get deterministic ids made from
+            this name (see event_id)
+        origin (datetime.datetime): the first day of a multi-day schedule
+
+    Returns:
+        list: a list of insert mutations (see run_mutations)
+    '''
+    mutations = []
     events = clone_events(events)
-    for event in events:
+    for index, event in enumerate(events):
+        if template:
+            event['id'] = event_id(template, index, dt, calendar_id)
+
         start, end = get_start_and_end(event)
-        min_start = get_min_time(start) #minimize start for easy comparison
+        min_start = get_min_time(origin or start) #minimize start for easy comparison
         diff = dt - min_start
 
+        if 'dateTime' not in event['start']:
+            event.update(shift_event(event, diff.days))
+            mutations.append({'action': 'insert', 'calendarId': calendar_id, 'body': event})
+            continue
+
         newstart = gmt(start) + datetime.timedelta(days=diff.days)
         newend   = gmt(end)   + datetime.timedelta(days=diff.days)
 
         event['start']['dateTime'] = RFC_from_UTC(newstart)
         event['end']['dateTime']   = RFC_from_UTC(newend)
 
-        cal.insert(calendarId='primary', body=event).execute()
+        mutations.append({'action': 'insert', 'calendarId': calendar_id, 'body': event})
+    return mutations
 
 def load_events(filename):
     '''Loads events from a given filename
@@ -469,11 +1360,42 @@ def load_events(filename):
     Returns:
         list: a list of Google Calendar event objects 
     '''
+    return load_template(filename)['events']
+
+def load_template(filename):
+    '''Loads a schedule along with the days it covers
+
+    Schedules of a single day are saved as a plain list of events, while
+    multi-day schedules are saved with their first day and length (see
+    save_events). Both are returned in the same shape.
+
+    Parameters:
+        filename (str): The filename of which to pull events from
+
+    Returns:
+        dict: the events of the schedule under "events", its first day under
+            "start" (None for a single day) and the number of days it covers
+            under "days"
+    '''
     with open(filename, 'r') as f:
         items = json.load(f)
-        return items
+    if isinstance(items, dict):
+        return {'start': dt_from_date(items['start']), 'days': items['days'], 'events': items['events']}
+    return {'start': None, 'days': 1, 'events': items}
+
+def format_time(dt):
+    '''Returns the time of day the way print_events shows it
 
-def print_events(events):
+    Parameters:
+        dt (datetime.datetime): a datetime.datetime object
+
+    Returns:
+        str: the time in the form 9:30am
+    '''
+    hour = dt.hour % 12 or 12
+    return f'{hour}:{dt.minute:02d}{"pm" if dt.hour >= 12 else "am"}'
+
+def print_events(events, labels=None):
     '''Takes a list of events and prints it to the console
 
     prints in the form: dateTime, summary
@@ -483,116 +1405,2202 @@ def print_events(events):
 
     Parameters:
         events (list): a list of Google Calendar event objects (or clones)
+        labels (dict): text to show after events, keyed by id(event)
+    '''
+    sys.stdout.write(''.join(line + '\n' for line in render_events(events, labels)))
+
+def render_events(events, labels=None):
+    '''Returns the lines print_events prints for a list of events
+
+    Parameters:
+        events (list): a list of Google Calendar event objects (or clones)
+        labels (dict): text to show after events, keyed by id(event)
+
+    Returns:
+        list: one line for each event
     '''
+    lines = []
     for event in events:
-        try:
-            start = event['start']['dateTime']
-        except KeyError:
-            start = event['start']['date']
-        try:
-            summary = event['summary']
-        except KeyError:
-            summary = '(No title)'
-
-        start_dt = utctimestamp_to_dt(start)
-        if start_dt.hour > 12:
-            print(f'{start_dt.hour-12}:{start_dt.minute:02d}pm', summary)
-        elif start_dt.hour == 0:
-            print(f'12:{start_dt.minute:02d}am', summary)
+        summary = event.get('summary', '(No title)')
+        if 'dateTime' in event['start']:
+            line = f'{format_time(get_start_and_end(event)[0])} {summary}'
+        else:
+            line = f'all day {summary}'
+        if labels and id(event) in labels:
+            line += f'  ({labels[id(event)]})'
+        lines.append(line)
+    return lines
+
+def print_agenda(days, labels=None):
+    '''Prints the events of several days under a heading for each day
+
+    Days without events are left out. Everything is written at once.
+
+    Parameters:
+        days (dict): a dict mapping dates to lists of events, see
+            group_by_day
+        labels (dict): text to show after events, keyed by id(event)
+    '''
+    lines = []
+    for date, events in days.items():
+        if not events:
+            continue
+        if lines:
+            lines.append('')
+        lines.append(f'{dt_from_date(date):%A}, {date}')
+        lines.extend('  ' + line for line in render_events(events, labels))
+    sys.stdout.write(''.join(line + '\n' for line in lines))
+
+def ics_escape(text):
+    '''Escapes text for an iCalendar property value
+
+    Parameters:
+        text (str): the text to escape
+
+    Returns:
+        str: the escaped text
+    '''
+    return (text.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+                .replace('\r\n', '\\n').replace('\n', '\\n'))
+
+def ics_fold(line):
+    '''Folds an iCalendar content line into lines of at most 75 octets
+
+    Parameters:
+        line (str): an unfolded content line
+
+    Returns:
+        str: the folded line, ending with CRLF
+    '''
+    folded = []
+    current = ''
+    size = 0
+    for char in line:
+        width = len(char.encode())
+        if size + width > 75:
+            folded.append(current)
+            current = ' '
+            size = 1
+        current += char
+        size += width
+    folded.append(current)
+    return '\r\n'.join(folded) + '\r\n'
+
+def ics_time(when):
+    '''Returns an iCalendar DTSTART or DTEND value from an event's start or end
+
+    Parameters:
+        when (dict): the start or end of an event
+
+    Returns:
+        tuple: the property parameters and the value
+    '''
+    if 'dateTime' not in when:
+        return (';VALUE=DATE', when['date'].replace('-', ''))
+    dt = datetime.datetime.fromisoformat(when['dateTime'].replace('Z', '+00:00'))
+    if dt.tzinfo:
+        return ('', dt.astimezone(datetime.timezone.utc).strftime('%Y%m%dT%H%M%SZ'))
+    return ('', dt.strftime('%Y%m%dT%H%M%S'))
+
+def write_ics_event(f, event, stamp=None):
+    '''Writes an event as an iCalendar VEVENT
+
+    DTSTAMP is required, so events that were never updated are stamped with
+    the time of the export.
+
+    Parameters:
+        f (file): a file opened for writing text
+        event (dict): a Google Calendar event object
+        stamp (str): the DTSTAMP of events without an "updated" time, the
+            current time if not given
+    '''
+    if not stamp:
+        stamp = datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
+    lines = ['BEGIN:VEVENT', 'UID:' + ics_escape(event.get('iCalUID', event.get('id', '')))]
+    if event.get('updated'):
+        lines.append('DTSTAMP:' + ics_time({'dateTime': event['updated']})[1])
+    else:
+        lines.append('DTSTAMP:' + stamp)
+    for name, key in [('DTSTART', 'start'), ('DTEND', 'end')]:
+        params, value = ics_time(event[key])
+        lines.append(f'{name}{params}:{value}')
+    for name, key in [('SUMMARY', 'summary'), ('DESCRIPTION', 'description'), ('LOCATION', 'location')]:
+        if event.get(key):
+            lines.append(f'{name}:{ics_escape(event[key])}')
+    if event.get('colorId'):
+        lines.append('X-GCALENDAR-COLOR:' + event['colorId'])
+    lines.append('END:VEVENT')
+    f.write(''.join(ics_fold(line) for line in lines))
+
+def export_events(items, f, fmt):
+    '''Writes events to a file one at a time as they come in
+
+    Parameters:
+        items (iterable): (calendar id, event) tuples, see
+            iter_events_from_calendars
+        f (file): a file opened for writing text (with newline='')
+        fmt (str): "jsonl", "csv" or "ics"
+
+    Returns:
+        int: the number of events written
+    '''
+    count = 0
+    if fmt == 'csv':
+        writer = csv.writer(f)
+        writer.writerow(CSV_FIELDS)
+    elif fmt == 'ics':
+        f.write('BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//gcalendar//EN\r\n')
+        stamp = datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
+
+    for calendar_id, event in items:
+        if fmt == 'jsonl':
+            f.write(json.dumps(dict(event, calendarId=calendar_id)) + '\n')
+        elif fmt == 'csv':
+            all_day = 'dateTime' not in event['start']
+            key = 'date' if all_day else 'dateTime'
+            writer.writerow([calendar_id, event.get('id', ''), event.get('summary', ''), 
+                             event['start'][key], event['end'][key], 'yes' if all_day else 'no',
+                             event.get('colorId', ''), event.get('location', ''), event.get('description', '')])
         else:
-            print(f'{start_dt.hour}:{start_dt.minute:02d}am', summary)
+            write_ics_event(f, event, stamp)
+        count += 1
+
+    if fmt == 'ics':
+        f.write('END:VCALENDAR\r\n')
+    return count
+
+def ics_unescape(text):
+    '''Reverses ics_escape
+
+    Parameters:
+        text (str): an escaped iCalendar property value
+
+    Returns:
+        str: the unescaped text
+    '''
+    return re.sub(r'\\([\\;,nN])', lambda m: '\n' if m.group(1) in 'nN' else m.group(1), text)
+
+def local_offset():
+    '''Returns the UTC offset of the current timezone as +HH:MM or -HH:MM'''
+    offset = time.localtime().tm_gmtoff
+    sign = '-' if offset < 0 else '+'
+    return f'{sign}{abs(offset) // 3600:02d}:{abs(offset) % 3600 // 60:02d}'
+
+def event_time(value, all_day=False, timezone=None):
+    '''Returns an event's start or end from a date or timestamp
+
+    Accepts iCalendar values (20200102, 20200102T090000Z) as well as ISO
+    dates and timestamps. Timestamps without an offset or timezone are
+    taken to be in the current timezone.
+
+    Parameters:
+        value (str): a date or timestamp
+        all_day (bool): whether or not the value is a date
+        timezone (str): the timezone of a timestamp without an offset
+
+    Returns:
+        dict: the start or end of an event
+    '''
+    value = value.strip()
+    if re.fullmatch(r'\d{8}(T\d{6}Z?)?', value):
+        value = f'{value[:4]}-{value[4:6]}-{value[6:8]}' + (
+                f'T{value[9:11]}:{value[11:13]}:{value[13:15]}{value[15:]}' if len(value) > 8 else '')
+    if all_day or len(value) == 10:
+        return {'date': value[:10]}
+
+    dt = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if dt.tzinfo:
+        return {'dateTime': dt.isoformat()}
+    if timezone:
+        return {'dateTime': dt.isoformat(), 'timeZone': timezone}
+    return {'dateTime': dt.isoformat() + local_offset()}
+
+def iter_ics_lines(f):
+    '''Yields the unfolded content lines of an iCalendar file
+
+    Parameters:
+        f (file): an iCalendar file opened for reading text
+
+    Yields:
+        str: unfolded content lines
+    '''
+    current = None
+    for line in f:
+        line = line.rstrip('\r\n')
+        if line[:1] in [' ', '\t'] and current is not None:
+            current += line[1:]
+            continue
+        if current:
+            yield current
+        current = line
+    if current:
+        yield current
+
+def iter_ics_events(f):
+    '''Yields events from an iCalendar file one at a time
+
+    Only VEVENT components are read, and anything nested inside of them
+    (like alarms) is skipped. RRULE, EXRULE, RDATE and EXDATE lines are
+    kept as the recurrence of the event.
+
+    Parameters:
+        f (file): an iCalendar file opened for reading text
+
+    Yields:
+        dict: event bodies, ready to be inserted or imported
+    '''
+    event = None
+    depth = 0
+    for line in iter_ics_lines(f):
+        name, _, value = line.partition(':')
+        name, *params = name.split(';')
+        name = name.upper()
+        params = dict(p.partition('=')[::2] for p in params)
+
+        if name == 'BEGIN':
+            if event is not None:
+                depth += 1
+            elif value.upper() == 'VEVENT':
+                event = {}
+            continue
+        if name == 'END':
+            if depth:
+                depth -= 1
+            elif event is not None and value.upper() == 'VEVENT':
+                if 'start' in event:
+                    if 'end' not in event:
+                        event['end'] = dict(event['start'])
+                        if 'date' in event['start']:
+                            end = datetime.date.fromisoformat(event['start']['date']) + datetime.timedelta(days=1)
+                            event['end']['date'] = end.isoformat()
+                    if 'recurrence' in event:
+                        #the API needs a timezone to repeat an event in
+                        for key in ['start', 'end']:
+                            if 'dateTime' in event[key]:
+                                event[key].setdefault('timeZone', 'UTC')
+                    yield event
+                event = None
+            continue
+        if event is None or depth:
+            continue
+
+        if name in ['DTSTART', 'DTEND']:
+            key = 'start' if name == 'DTSTART' else 'end'
+            event[key] = event_time(value, params.get('VALUE') == 'DATE', params.get('TZID'))
+        elif name == 'SUMMARY':
+            event['summary'] = ics_unescape(value)
+        elif name == 'DESCRIPTION':
+            event['description'] = ics_unescape(value)
+        elif name == 'LOCATION':
+            event['location'] = ics_unescape(value)
+        elif name == 'UID':
+            event['iCalUID'] = ics_unescape(value)
+        elif name == 'X-GCALENDAR-COLOR':
+            event['colorId'] = value
+        elif name in ['RRULE', 'EXRULE', 'RDATE', 'EXDATE']:
+            event.setdefault('recurrence', []).append(line)
+
+def iter_csv_events(f):
+    '''Yields events from a CSV file one at a time
+
+    The file needs a header with the columns summary, start and end. The
+    columns all_day (yes or no), color, location and description are
+    optional (see CSV_FIELDS).
+
+    Parameters:
+        f (file): a CSV file opened for reading text (with newline='')
+
+    Yields:
+        dict: event bodies, ready to be inserted
+    '''
+    for row in csv.DictReader(f):
+        all_day = row.get('all_day', '').strip().lower() in ['yes', 'true', '1']
+        event = {
+            'start': event_time(row['start'], all_day),
+            'end': event_time(row['end'], all_day),
+        }
+        for field, key in [('summary', 'summary'), ('location', 'location'), 
+                           ('description', 'description'), ('color', 'colorId')]:
+            if row.get(field):
+                event[key] = row[field]
+        yield event
+
+def plan_import(events, template, calendar_id='primary', offset=0):
+    '''Returns the mutations that import events from another system
+
+    Events with an iCalUID go through events().import, which never creates
+    duplicates of the same iCalUID. Every other event is inserted with an
+    id made from the template name, its position and its date, so importing
+    the same file twice is safe as well.
+
+    Parameters:
+        events (list): event bodies
+        template (str): the name of the file the events come from
+        calendar_id (str): the id of the calendar to import the events to
+        offset (int): the position of the first event in the file
+
+    Returns:
+        list: a list of import and insert mutations (see run_mutations)
+    '''
+    mutations = []
+    for index, event in enumerate(events, offset):
+        if event.get('iCalUID'):
+            mutations.append({'action': 'import', 'calendarId': calendar_id, 'body': event})
+            continue
+        start = event['start'].get('dateTime', event['start'].get('date'))
+        body = dict(event, id=event_id(template, index, dt_from_date(start), calendar_id))
+        mutations.append({'action': 'insert', 'calendarId': calendar_id, 'body': body})
+    return mutations
 
-def delete_events(service, events):
+def delete_events(service, events, calendar_id='primary'):
     '''Deletes a list of events from Google Calendar
 
     Parameters:
         service (googleapiclient.discovery.Resource): A Resource object that
             uses the Google Calendar v3 API
         events (list): a list of Google Calendar event objects
+        calendar_id (str): the id of the calendar the events belong to
+
+    Returns:
+        list: a list of (mutation, exception) tuples for the events that
+            could not be deleted (see run_mutations)
+    '''
+    return run_mutations(service, plan_delete(events, calendar_id))
+
+def plan_delete(events, calendar_id='primary'):
+    '''Returns the mutations that delete a list of events
+
+    Parameters:
+        events (list): a list of Google Calendar event objects
+        calendar_id (str): the id of the calendar the events belong to
+
+    Returns:
+        list: a list of delete mutations (see run_mutations)
+    '''
+    return [{'action': 'delete', 'calendarId': calendar_id, 'eventId': event['id']} for event in events]
+
+def mutation_request(service, mutation):
+    '''Returns the API request that carries out a mutation
+
+    Parameters:
+        service (googleapiclient.discovery.Resource): A Resource object that
+            uses the Google Calendar v3 API
+        mutation (dict): a mutation (see run_mutations)
+
+    Returns:
+        googleapiclient.http.HttpRequest: the request for the mutation
     '''
     cal = service.events()
-    for event in events:
-        cal.delete(calendarId='primary', eventId=event['id']).execute()
+    action = mutation['action']
+    if action == 'insert':
+        return cal.insert(calendarId=mutation['calendarId'], body=mutation['body'])
+    elif action == 'delete':
+        return cal.delete(calendarId=mutation['calendarId'], eventId=mutation['eventId'])
+    elif action == 'patch':
+        return cal.patch(calendarId=mutation['calendarId'], eventId=mutation['eventId'],
+                         body=mutation['body'])
+    elif action == 'import':
+        return cal.import_(calendarId=mutation['calendarId'], body=mutation['body'])
+    raise ValueError(f'Unknown action {action}')
+
+def is_applied(mutation, exception):
+    '''Returns whether or not a mutation took effect, given its API error
+
+    Deleting an event that is already gone counts as done, so deletes can 
+    safely be sent again.
 
-def dt_from_day(day):
-    '''Returns a datetime.datetime object from a given string
+    Parameters:
+        mutation (dict): a mutation (see run_mutations)
+        exception (Exception): the error of the request, or None
 
-    day can be of the following formats:
-        today
-        tomorrow
-        yesterday
-        relative date (see RELATIVE_DATE_PATTERN)
-        YYYY-MM-DD    (see DATE_PATTERN)
-        or from a day of the week (Monday, Tuesday, Wednesday, etc.)
+    Returns:
+        bool: whether or not the mutation took effect
+    '''
+    if exception is None:
+        return True
+    if mutation['action'] == 'delete' and isinstance(exception, HttpError):
+        return exception.resp.status in [404, 410]
+    return False
+
+def is_duplicate(mutation, exception):
+    '''Returns whether or not an insert failed because its id is taken
 
     Parameters:
-        day (str): a string representing a day
+        mutation (dict): a mutation (see run_mutations)
+        exception (Exception): the error of the request
 
     Returns:
-        datetime.datetime: a datetime object representing the given day
+        bool: whether or not the event was already inserted before
     '''
-    if day == 'today':
-        return datetime.datetime.today()
-    elif day == 'tomorrow':
-        return datetime.datetime.today() + datetime.timedelta(days=1)
-    elif day == 'yesterday':
-        return datetime.datetime.today() - datetime.timedelta(days=1)
-    elif is_reldate(day):
-        return dt_from_reldate(day)
-    elif day in WEEKDAYS.keys():
-        week = get_days_of_week(datetime.datetime.today()) 
-        return week[WEEKDAYS[day]]
-    elif re.match(DATE_PATTERN, day):
-        return dt_from_date(day) 
-    else:
-        return None
+    return (mutation['action'] == 'insert' and 'id' in mutation['body']
+            and isinstance(exception, HttpError) and exception.resp.status == 409)
 
-def ask_for_confirmation(message):
-    '''Asks for confirmation of something
+def is_retriable(mutation, exception):
+    '''Returns whether or not a failed mutation can safely be sent again
 
-    This function asks for the confirmation of something. A message
-    is given to specify what to confirm. message will have a "[Y/N]"
-    appended onto it.
+    Only errors that are worth retrying (rate limits and server errors)
+    count. Inserts without an id are never retried since the first attempt
+    may have gone through.
 
-    Valid answers are: yes, no, y, n (case is ignored)
-    
-    If a valid answer is not given, this will try again until a valid one
-    is given.
-    
     Parameters:
-        message (str): a message specifying what to confirm
+        mutation (dict): a mutation (see run_mutations)
+        exception (Exception): the error of the request
+
     Returns:
-        bool: whether or not confirmation was given 
+        bool: whether or not the mutation should be retried
     '''
-    answer = input(message + " [Y/N]")
-    while answer.lower() not in ['y', 'yes', 'n', 'no']:
-        answer = input('Please enter a valid answer.').lower()
-    if answer == 'yes' or answer == 'y':
-        return True
-    else:
+    if mutation['action'] == 'insert' and 'id' not in mutation['body']:
         return False
+    if not isinstance(exception, HttpError):
+        return False
+    if exception.resp.status in [429, 500, 502, 503, 504]:
+        return True
+    if exception.resp.status == 403:
+        details = exception.error_details
+        if details and not isinstance(details, str):
+            return any(isinstance(d, dict) and d.get('reason') in RATE_LIMIT_REASONS for d in details)
+    return False
+
+def changed_fields(event, body):
+    '''Returns the fields of an event that differ from an insert body
+
+    Only the fields in EVENT_FIELDS are compared, and times are compared as
+    instants so that the same time written with another offset does not
+    count as a change.
+
+    Parameters:
+        event (dict): the event as it is in Google Calendar
+        body (dict): the body of the insert
+
+    Returns:
+        dict: the patch that brings the event in line with the body
+    '''
+    changes = {}
+    for field in EVENT_FIELDS:
+        current, wanted = event.get(field), body.get(field)
+        if field in ['start', 'end'] and current and wanted and 'dateTime' in current and 'dateTime' in wanted:
+            if to_local(current['dateTime']) == to_local(wanted['dateTime']):
+                continue
+        if current != wanted:
+            changes[field] = wanted
+    return changes
+
+def restore_events(service, mutations):
+    '''Settles inserts whose ids were already taken
+
+    If the event with that id still exists, the insert already went through
+    earlier, possibly from an older version of the same template or day. It
+    is patched wherever it differs from the body of the insert (see
+    changed_fields). If it was deleted since, it is restored with the body
+    of the insert.
+
+    Parameters:
+        service (googleapiclient.discovery.Resource): A Resource object that
+            uses the Google Calendar v3 API
+        mutations (list): a list of insert mutations with ids
+
+    Returns:
+        list: the error for each mutation, or None if it was settled
+    '''
+    cal = service.events()
+    requests = [cal.get(calendarId=m['calendarId'], eventId=m['body']['id']) for m in mutations]
+    results = execute_batch(service, requests)
+    errors = [exception for response, exception in results]
+
+    indexes = []
+    requests = []
+    for i, (response, exception) in enumerate(results):
+        if exception is not None:
+            continue
+        mutation = mutations[i]
+        if response.get('status') == 'cancelled':
+            body = dict(mutation['body'], status='confirmed')
+            requests.append(cal.update(calendarId=mutation['calendarId'], eventId=body['id'], body=body))
+            indexes.append(i)
+        else:
+            changes = changed_fields(response, mutation['body'])
+            if changes:
+                requests.append(cal.patch(calendarId=mutation['calendarId'], eventId=response['id'], body=changes))
+                indexes.append(i)
+    for i, (response, exception) in zip(indexes, execute_batch(service, requests)):
+        errors[i] = exception
+    return errors
+
+def run_mutations(service, mutations, journal=None):
+    '''Carries out mutations through batch requests
+
+    A mutation is a dict describing one change to Google Calendar:
+        action (str): "insert", "delete", "patch" or "import"
+        calendarId (str): the id of the calendar to change
+        eventId (str): the id of the event (delete and patch only)
+        body (dict): the event or the fields to change (insert, patch and
+            import only)
+
+    If a journal is given, only its unfinished mutations are carried out
+    and every finished one is recorded as soon as its batch returns.
+
+    Rate limited and failed requests are retried up to MAX_RETRIES times
+    (see is_retriable). Inserts with an id that is already taken are 
+    settled with restore_events instead of failing.
+
+    Parameters:
+        service (googleapiclient.discovery.Resource): A Resource object that
+            uses the Google Calendar v3 API
+        mutations (list): a list of mutations
+        journal (Journal): the journal of the job the mutations belong to
+
+    Returns:
+        list: a list of (mutation, exception) tuples for the mutations that
+            failed
+    '''
+    pending = [*enumerate(mutations)]
+    if journal:
+        pending = [(i, m) for i, m in pending if i not in journal.done]
+
+    failed = []
+    chunk = BATCH_SIZE * BATCH_WORKERS
+    try:
+        for offset in range(0, len(pending), chunk):
+            part = pending[offset:offset+chunk]
+            attempt = 0
+            while part:
+                results = execute_batch(service, [mutation_request(service, m) for i, m in part])
+
+                done, duplicates, retries = [], [], []
+                for (i, mutation), (response, exception) in zip(part, results):
+                    if is_applied(mutation, exception):
+                        done.append(i)
+                    elif is_duplicate(mutation, exception):
+                        duplicates.append((i, mutation))
+                    elif attempt < MAX_RETRIES and is_retriable(mutation, exception):
+                        retries.append((i, mutation))
+                    else:
+                        failed.append((mutation, exception))
+
+                errors = restore_events(service, [m for i, m in duplicates])
+                for (i, mutation), exception in zip(duplicates, errors):
+                    if exception is None:
+                        done.append(i)
+                    else:
+                        failed.append((mutation, exception))
+
+                if journal:
+                    journal.mark_done(done)
+                if retries:
+                    time.sleep(2 ** attempt)
+                part = retries
+                attempt += 1
+    finally:
+        for calendar_id in set(m['calendarId'] for m in mutations):
+            invalidate_event_cache(service, calendar_id)
+    return failed
+
+def quota_per_second():
+    '''Returns how many requests the API allows per second
+
+    The GCALENDAR_QUOTA environment variable overrides QUOTA_PER_SECOND.
+
+    Returns:
+        float: the number of requests per second
+
+    Raises:
+        click.ClickException: if GCALENDAR_QUOTA is not a positive number
+    '''
+    value = os.environ.get('GCALENDAR_QUOTA')
+    if value is None:
+        return QUOTA_PER_SECOND
+    try:
+        quota = float(value)
+    except ValueError:
+        quota = 0
+    if not 0 < quota < math.inf:
+        raise click.ClickException(f'GCALENDAR_QUOTA must be a positive number, not "{value}".')
+    return quota
+
+def estimate_job(reads, mutations, read_workers=1):
+    '''Estimates the API calls and time a job takes
+
+    Parameters:
+        reads (dict): the number of each kind of read request, for example
+            {'list': 7, 'freebusy': 1}
+        mutations (list): the mutations of the job (see run_mutations)
+        read_workers (int): how many read requests are sent at once
+
+    Returns:
+        dict: the number of each kind of request, the number of batch
+            requests ("batch") and the estimated time in seconds ("seconds")
+    '''
+    calls = dict(reads)
+    for mutation in mutations:
+        calls[mutation['action']] = calls.get(mutation['action'], 0) + 1
+
+    #sum is also the name of a command
+    total = builtins.sum(calls.values())
+    read_total = builtins.sum(reads.values())
+
+    batches = math.ceil(len(mutations) / BATCH_SIZE)
+    seconds = (math.ceil(read_total / read_workers) * API_LATENCY
+               + math.ceil(batches / BATCH_WORKERS) * BATCH_LATENCY)
+    calls['batch'] = batches
+    calls['seconds'] = max(seconds, total / quota_per_second())
+    return calls
+
+def print_plan(days, reads, read_workers=1, events=()):
+    '''Prints the changes a job would make without making them
+
+    Parameters:
+        days (list): (datetime.datetime, mutations) tuples, one for each day
+        reads (dict): the number of each kind of read request (see
+            estimate_job)
+        read_workers (int): how many read requests are sent at once
+        events (list): the events that were read, so deleted events can be
+            shown with their title
+    '''
+    def describe(event, start):
+        return f'{start:%H:%M} {event.get("summary", "(No title)")}'
+
+    titles = {}
+    for e in events:
+        if 'dateTime' in e['start']:
+            titles[e['id']] = describe(e, utctimestamp_to_dt(e['start']['dateTime']))
+        else:
+            titles[e['id']] = f'all day {e.get("summary", "(No title)")}'
+
+    lines = []
+    mutations = []
+    for d, day_mutations in days:
+        if not day_mutations:
+            continue
+        mutations.extend(day_mutations)
+        lines.append(f'{date_from_dt(d)}:')
+        for m in day_mutations:
+            if m['action'] in ['insert', 'import'] and 'date' in m['body']['start']:
+                lines.append(f'  + all day {m["body"].get("summary", "(No title)")}')
+            elif m['action'] in ['insert', 'import']:
+                start = to_local(m['body']['start']['dateTime'])
+                lines.append(f'  + {describe(m["body"], start)}')
+            elif m['action'] == 'delete':
+                lines.append(f'  - {titles.get(m["eventId"], m["eventId"])}')
+            else:
+                lines.append(f'  ~ {titles.get(m["eventId"], m["eventId"])}')
+    if not lines:
+        lines.append('No changes.')
+
+    calls = estimate_job(reads, mutations, read_workers)
+    seconds = calls.pop('seconds')
+    lines.append('')
+    lines.append('API calls: ' + ', '.join(f'{count} {name}' for name, count in calls.items()))
+    lines.append(f'Estimated time: {seconds:.1f} seconds '
+                 f'({BATCH_WORKERS} batch request(s) of {BATCH_SIZE} at once, {quota_per_second():g} requests per second)')
+    print('\n'.join(lines))
+
+class Journal:
+    '''A write-ahead journal for a bulk job
+
+    The journal is a JSON Lines file in JOURNAL_DIRECTORY. The first line
+    holds the description of the job and every mutation it plans to make.
+    Each following line records mutations that were carried out. A job
+    that was cut short can then be resumed without repeating any of its
+    finished mutations.
+
+    A job is locked by the process that runs it (see FileLock), so two
+    processes never run the same job at once.
+
+    Parameters:
+        path (str): the path of the journal file
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = FileLock(path)
+        self.job_id = os.path.basename(path)[:-len('.jsonl')]
+        self.description = ''
+        self.mutations = []
+        self.done = set()
+
+        with open(path, 'r') as f:
+            for n, line in enumerate(f):
+                try:
+                    record = json.loads(line)
+                except ValueError: #the last line may have been cut off
+                    break
+                if n == 0:
+                    self.description = record['description']
+                    self.mutations = record['mutations']
+                else:
+                    self.done.update(record['done'])
+
+    @classmethod
+    def create(cls, description, mutations):
+        '''Creates the journal of a new job
+
+        Parameters:
+            description (str): a description of the job
+            mutations (list): every mutation the job plans to make
+
+        Returns:
+            Journal: the journal of the new job
+        '''
+        os.makedirs(JOURNAL_DIRECTORY, exist_ok=True)
+        job_id = f'{datetime.datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}'
+        path = os.path.join(JOURNAL_DIRECTORY, job_id + '.jsonl')
+
+        #lock the job before other processes can see it
+        lock = FileLock(path)
+        lock.acquire()
+        with atomic_write(path) as f:
+            f.write(json.dumps({'description': description, 'mutations': mutations}) + '\n')
+        journal = cls(path)
+        journal.lock = lock
+        return journal
+
+    @classmethod
+    def unfinished(cls):
+        '''Returns the journals of every job that has not finished
+
+        Returns:
+            list: a list of Journal objects, oldest first
+        '''
+        if not os.path.isdir(JOURNAL_DIRECTORY):
+            return []
+        names = sorted(f for f in os.listdir(JOURNAL_DIRECTORY) if f.endswith('.jsonl'))
+        return [cls(os.path.join(JOURNAL_DIRECTORY, name)) for name in names]
+
+    def pending(self):
+        '''Returns the mutations that have not been carried out yet'''
+        return [m for i, m in enumerate(self.mutations) if i not in self.done]
+
+    def mark_done(self, indexes):
+        '''Records that mutations were carried out
+
+        Parameters:
+            indexes (list): the indexes of the finished mutations
+        '''
+        if not indexes:
+            return
+        with open(self.path, 'a') as f:
+            f.write(json.dumps({'done': indexes}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.done.update(indexes)
+
+    def is_running(self):
+        '''Returns whether or not another process is running the job'''
+        if self.lock.held:
+            return False
+        if not self.lock.acquire(blocking=False):
+            return True
+        self.lock.release()
+        return False
+
+    def finish(self):
+        '''Removes the journal once its job has finished'''
+        os.remove(self.path)
+        self.lock.release(remove=True)
+
+def run_job(service, journal):
+    '''Runs the unfinished mutations of a journaled job
+
+    The journal is removed once every mutation was carried out. Otherwise
+    it is kept so that the job can be resumed.
+
+    Parameters:
+        service (googleapiclient.discovery.Resource): A Resource object that
+            uses the Google Calendar v3 API
+        journal (Journal): the journal of the job
+
+    Returns:
+        bool: whether or not the job finished
+    '''
+    if not journal.lock.acquire(blocking=False):
+        print(f'{journal.job_id} is being run by another process.')
+        return False
+
+    try:
+        if not os.path.isfile(journal.path):
+            #another process finished the job since the journal was read
+            return True
+        journal.done = Journal(journal.path).done
+
+        try:
+            failed = run_mutations(service, journal.mutations, journal)
+        except KeyboardInterrupt:
+            print(f'Interrupted. Do "gcalendar resume {journal.job_id}" to finish the job.')
+            return False
+        except Exception as e:
+            print(f'{e}\nDo "gcalendar resume {journal.job_id}" to finish the job.')
+            return False
+
+        if failed:
+            print_failed(failed)
+            print(f'Do "gcalendar resume {journal.job_id}" to retry them.')
+            return False
+
+        journal.finish()
+        return True
+    finally:
+        journal.lock.release()
+
+def print_failed(failed):
+    '''Prints the first few mutations that failed and how many did
+
+    Parameters:
+        failed (list): a list of (mutation, exception) tuples (see
+            run_mutations)
+    '''
+    for mutation, exception in failed[:5]:
+        print(f'Could not {mutation["action"]} event: {exception}')
+    print(f'{len(failed)} change(s) failed.')
+
+def execute_batch(service, requests):
+    '''Executes API requests through batch requests
+
+    Requests are grouped into batches of BATCH_SIZE, and up to BATCH_WORKERS
+    batches are sent at once.
+
+    Parameters:
+        service (googleapiclient.discovery.Resource): A Resource object that
+            uses the Google Calendar v3 API
+        requests (list): a list of googleapiclient.http.HttpRequest objects
+
+    Returns:
+        list: a (response, exception) tuple for each request, in order
+    '''
+    results = [None] * len(requests)
+
+    def send(offset):
+        def callback(request_id, response, exception):
+            results[int(request_id)] = (response, exception)
+
+        batch = service.new_batch_http_request(callback=callback)
+        for i, request in enumerate(requests[offset:offset+BATCH_SIZE]):
+            batch.add(request, request_id=str(offset + i))
+        batch.execute()
+
+    offsets = range(0, len(requests), BATCH_SIZE)
+    with ThreadPoolExecutor(max_workers=BATCH_WORKERS) as executor:
+        for future in [executor.submit(send, offset) for offset in offsets]:
+            future.result()
+    return results
+
+def shift_event(event, days):
+    '''Returns the start and end of an event moved by a number of days
+
+    The wall clock time of the event is kept. When the event has a time
+    zone, the offset is left out so that the time zone decides it on the new
+    day, which may be on the other side of a daylight saving change. Without
+    one, the event keeps its UTC offset.
+
+    Parameters:
+        event (dict): a dict representing an event object
+        days (int): the number of days to move the event by
+
+    Returns:
+        dict: a dict with the new start and end, ready to be patched onto
+            the event
+    '''
+    td = datetime.timedelta(days=days)
+    body = {}
+    for key in ['start', 'end']:
+        when = dict(event[key])
+        if 'dateTime' in when:
+            timestamp = when['dateTime']
+            offset = re.match(TIMESTAMP_PATTERN, timestamp).group(7)
+            if when.get('timeZone'):
+                offset = ''
+            elif not offset:
+                offset = 'Z' if timestamp.endswith('Z') else ''
+            when['dateTime'] = (utctimestamp_to_dt(timestamp) + td).isoformat() + offset
+        else:
+            when['date'] = (datetime.date.fromisoformat(when['date']) + td).isoformat()
+        body[key] = when
+    return body
+
+def move_events(service, events, days, calendar_id='primary'):
+    '''Moves events by a number of days in place
+
+    Events are patched instead of being inserted again and deleted, so they
+    keep their ids, attendees and history. Patches are sent in batches.
+
+    Parameters:
+        service (googleapiclient.discovery.Resource): A Resource object that
+            uses the Google Calendar v3 API
+        events (list): a list of Google Calendar event objects
+        days (int): the number of days to move the events by
+        calendar_id (str): the id of the calendar the events belong to
+
+    Returns:
+        list: a list of the events that could not be moved
+    '''
+    cal = service.events()
+    requests = [cal.patch(calendarId=calendar_id, eventId=event['id'], body=shift_event(event, days))
+                for event in events]
+    results = execute_batch(service, requests)
+    invalidate_event_cache(service, calendar_id)
+    return [event for event, (response, exception) in zip(events, results) if exception]
+
+def dt_from_day(day):
+    '''Returns a datetime.datetime object from a given string
+
+    day can be of the following formats:
+        today
+        tomorrow
+        yesterday
+        relative date (see RELATIVE_DATE_PATTERN)
+        YYYY-MM-DD    (see DATE_PATTERN)
+        or from a day of the week (Monday, Tuesday, Wednesday, etc.)
+
+    Parameters:
+        day (str): a string representing a day
+
+    Returns:
+        datetime.datetime: a datetime object representing the given day
+    '''
+    if day == 'today':
+        return datetime.datetime.today()
+    elif day == 'tomorrow':
+        return datetime.datetime.today() + datetime.timedelta(days=1)
+    elif day == 'yesterday':
+        return datetime.datetime.today() - datetime.timedelta(days=1)
+    elif is_reldate(day):
+        return dt_from_reldate(day)
+    elif day in WEEKDAYS.keys():
+        return get_current_week()[WEEKDAYS[day]]
+    elif re.match(DATE_PATTERN, day):
+        return dt_from_date(day) 
+    else:
+        return None
+
+def ask_for_confirmation(message):
+    '''Asks for confirmation of something
+
+    This function asks for the confirmation of something. A message
+    is given to specify what to confirm. message will have a "[Y/N]"
+    appended onto it.
+
+    Valid answers are: yes, no, y, n (case is ignored)
+    
+    If a valid answer is not given, this will try again until a valid one
+    is given.
+    
+    Parameters:
+        message (str): a message specifying what to confirm
+    Returns:
+        bool: whether or not confirmation was given 
+    '''
+    answer = input(message + " [Y/N]")
+    while answer.lower() not in ['y', 'yes', 'n', 'no']:
+        answer = input('Please enter a valid answer.').lower()
+    if answer == 'yes' or answer == 'y':
+        return True
+    else:
+        return False
+
+class CredentialManager:
+    '''Keeps the credentials from a token file in memory and fresh
+
+    The token file is only read once, when the manager is created, and is
+    only written to after the access token was refreshed. Refreshes are
+    serialized so concurrent callers never refresh twice, and the token
+    file is locked while refreshing (see FileLock) so that processes
+    sharing it use the token another one just refreshed instead of
+    refreshing it again. Calling start
+    refreshes the access token in the background shortly before it expires
+    so that long running jobs never stall on an expired token.
+
+    Token files written by oauth2client are still understood.
+
+    Parameters:
+        filename (str): the path to the token file
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.credentials = Credentials.from_authorized_user_info(self._load(), SCOPES)
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _load(self):
+        with open(self.filename, 'r') as f:
+            info = json.load(f)
+
+        #oauth2client's token files use different names for the same fields
+        if 'token' not in info and 'access_token' in info:
+            info['token'] = info['access_token']
+        if 'expiry' not in info and info.get('token_expiry'):
+            info['expiry'] = info['token_expiry']
+        return info
+
+    def save(self):
+        '''Writes the credentials back to the token file'''
+        with atomic_write(self.filename) as f:
+            f.write(self.credentials.to_json())
+
+    def reload(self):
+        '''Takes the access token from the token file
+
+        The credentials are updated in place, since every connection of a
+        session shares them.
+        '''
+        stored = Credentials.from_authorized_user_info(self._load(), SCOPES)
+        self.credentials.token = stored.token
+        self.credentials.expiry = stored.expiry
+
+    def needs_refresh(self):
+        '''Returns whether or not the access token expires within REFRESH_MARGIN'''
+        expiry = self.credentials.expiry
+        if not self.credentials.token or not expiry:
+            return True
+        return expiry - REFRESH_MARGIN <= datetime.datetime.utcnow()
+
+    def refresh(self):
+        '''Refreshes the access token if it is about to expire'''
+        with self._lock:
+            if not self.needs_refresh():
+                return
+            with FileLock(self.filename):
+                self.reload()
+                if self.needs_refresh():
+                    self.credentials.refresh(Request(Http()))
+                    self.save()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            wait = REFRESH_MARGIN.total_seconds()
+            if self.credentials.expiry:
+                until = self.credentials.expiry - REFRESH_MARGIN - datetime.datetime.utcnow()
+                wait = max(until.total_seconds(), 0)
+            if self._stopped.wait(wait):
+                return
+            try:
+                self.refresh()
+            except Exception:
+                #try again later, requests will still refresh on a 401
+                self._stopped.wait(30)
+
+    def start(self):
+        '''Starts refreshing the access token in the background'''
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        '''Stops refreshing the access token in the background'''
+        self._stopped.set()
+
+class PooledHttp:
+    '''A thread safe HTTP transport backed by a pool of authorized connections
+
+    Every request checks out its own httplib2.Http object, so concurrent API
+    calls never share a connection. Connections are only created when none
+    are idle (up to size) and the most recently used one is handed out
+    first, so keep-alive connections and their TLS sessions get reused
+    instead of being opened again for each worker.
+
+    Pass an instance as the http argument of googleapiclient's build.
+
+    Parameters:
+        credentials (google.auth.credentials.Credentials): the credentials
+            used to authorize each connection
+        size (int): the maximum number of open connections
+    '''
+
+    def __init__(self, credentials, size=DEFAULT_POOL_SIZE):
+        self.credentials = credentials
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _checkout(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                return AuthorizedHttp(self.credentials, http=Http())
+        return self._idle.get()
+
+    def request(self, *args, **kwargs):
+        '''Sends a request over an idle connection (see httplib2.Http.request)'''
+        http = self._checkout()
+        try:
+            return http.request(*args, **kwargs)
+        finally:
+            self._idle.put(http)
+
+    def close(self):
+        '''Closes every idle connection'''
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+def profile_files(profile=None):
+    '''Returns the token file and local store of a profile
+
+    The default profile keeps using TOKEN_FILE and STORE_FILE. Every other
+    profile is kept in PROFILE_DIRECTORY under its name.
+
+    Parameters:
+        profile (str): the name of the profile
+
+    Returns:
+        tuple: the path of the token file and the path of the local store
+
+    Raises:
+        ValueError: if the name is not a valid profile name (see
+            is_profile_name)
+    '''
+    if not profile or profile == DEFAULT_PROFILE:
+        return (TOKEN_FILE, STORE_FILE)
+    if not is_profile_name(profile):
+        raise ValueError(f'Invalid profile name {profile!r}')
+    return (os.path.join(PROFILE_DIRECTORY, profile + '.json'), os.path.join(PROFILE_DIRECTORY, profile + '.db'))
+
+def get_profiles():
+    '''Returns the names of every authorized profile
+
+    Returns:
+        list: a list of profile names
+    '''
+    profiles = [DEFAULT_PROFILE] if os.path.isfile(TOKEN_FILE) else []
+    if os.path.isdir(PROFILE_DIRECTORY):
+        profiles.extend(sorted(f[:-5] for f in os.listdir(PROFILE_DIRECTORY) if f.endswith('.json')))
+    return profiles
+
+def connect(token_file, pool_size=DEFAULT_POOL_SIZE):
+    '''Starts a session with the credentials of a token file
+
+    The access token is refreshed once and then kept fresh in the
+    background.
+
+    Parameters:
+        token_file (str): the path to the token file
+        pool_size (int): the maximum number of connections of the session
+
+    Returns:
+        tuple: a Resource object that uses the Google Calendar v3 API and
+            the CredentialManager behind it
+    '''
+    manager = CredentialManager(token_file)
+    manager.refresh()
+    manager.start()
+    return (build('calendar', 'v3', http=PooledHttp(manager.credentials, pool_size)), manager)
+
+def is_profile_name(name):
+    '''Returns whether or not a string can be used as a profile name
+
+    Profile names become file names, so only letters, digits, "-" and "_"
+    are allowed.
+
+    Parameters:
+        name (str): the name to check
+
+    Returns:
+        bool: True if the name is a valid profile name
+    '''
+    return bool(PROFILE_PATTERN.fullmatch(name))
+
+def print_invalid_profile(name):
+    '''Prints why a profile name can't be used
+
+    Parameters:
+        name (str): the invalid profile name
+    '''
+    print(f'"{name}" is not a valid profile name. Only letters, digits, "-" and "_" are allowed.')
+
+def parse_accounts(value):
+    '''Returns the profile names given to --accounts
+
+    Parameters:
+        value (str): profile names separated by commas
+
+    Returns:
+        list: a list of profile names without repeats, or None (after
+            printing what is wrong) if a profile is invalid or has not been
+            authorized
+    '''
+    accounts = []
+    for name in value.split(','):
+        name = name.strip()
+        if name and name not in accounts:
+            accounts.append(name)
+    for name in accounts:
+        if not is_profile_name(name):
+            print_invalid_profile(name)
+            return None
+        if not os.path.isfile(profile_files(name)[0]):
+            print(f'There is no profile named {name}. Do "gcalendar authorize --profile {name}" first.')
+            return None
+    return accounts
+
+def run_for_accounts(obj, accounts, function):
+    '''Runs a function for several accounts at once
+
+    Each account gets its own session with its own credentials and
+    connections. Sessions are kept in obj so the daemon and the shell only
+    connect to each account once, and the CredentialManager of each one is
+    kept so that close_sessions can stop it.
+
+    Parameters:
+        obj (dict): the context object holding the session (see cli)
+        accounts (list): a list of profile names
+        function (callable): called with the service of each account
+
+    Returns:
+        dict: the result of function for each account, in the order given,
+            or None (after printing which ones) if some accounts could not
+            be connected to
+    '''
+    sessions = obj.setdefault('accounts', {obj.get('profile', DEFAULT_PROFILE): obj['service']})
+    managers = obj.setdefault('account_credentials', {})
+    lock = obj.setdefault('accounts_lock', threading.Lock())
+    failed = {}
+
+    def run(account):
+        with lock:
+            service = sessions.get(account)
+        if service is None:
+            try:
+                service, manager = connect(profile_files(account)[0], obj.get('pool_size', DEFAULT_POOL_SIZE))
+            except ValueError:
+                failed[account] = 'its token is invalid. Please authorize it again.'
+                return None
+            except Exception:
+                failed[account] = 'make sure you\'re connected to the internet.'
+                return None
+            with lock:
+                #another command may have connected to it in the meantime
+                if account in sessions:
+                    manager.stop()
+                else:
+                    sessions[account] = service
+                    managers[account] = manager
+                service = sessions[account]
+        return function(service)
+
+    with ThreadPoolExecutor(max_workers=len(accounts)) as executor:
+        results = dict(zip(accounts, executor.map(run, accounts)))
+    if failed:
+        for account in accounts:
+            if account in failed:
+                print(f'Unable to connect to {account}: {failed[account]}')
+        return None
+    return results
+
+def close_sessions(obj):
+    '''Stops refreshing the credentials of a session and its accounts
+
+    Parameters:
+        obj (dict): the context object holding the session (see cli)
+    '''
+    managers = [obj.get('credentials'), *obj.get('account_credentials', {}).values()]
+    for manager in managers:
+        if manager:
+            manager.stop()
+
+def get_schedule_names():
+    '''Returns the names of every saved schedule, without ".json"
+
+    Returns:
+        list: a list of schedule names
+    '''
+    if not os.path.isdir(FILE_DIRECTORY + '\\schedules'):
+        return []
+    return [f[:-5] for f in os.listdir(FILE_DIRECTORY + '\\schedules') if f.endswith('.json')]
+
+def complete_shell(text, state):
+    '''Tab completion for the shell
+
+    The first word completes to a command and every other word completes
+    to the name of a saved schedule.
+
+    Parameters:
+        text (str): the word being completed
+        state (int): the index of the match to return
+
+    Returns:
+        str: the match at index state, or None if there are no more matches
+    '''
+    if readline.get_line_buffer()[:readline.get_begidx()].strip():
+        options = get_schedule_names()
+    else:
+        options = cli.commands.keys()
+    matches = sorted(o for o in options if o.startswith(text))
+    if state < len(matches):
+        return matches[state] + ' '
+    return None
+
+def run_command(args, obj):
+    '''Runs a gcalendar command in this process with an existing session
+
+    Parameters:
+        args (list): the command line arguments, without the program name
+        obj (dict): the context object holding the session (see cli)
+
+    Returns:
+        int: the exit code of the command
+    '''
+    try:
+        code = cli.main(args=args, prog_name='gcalendar', standalone_mode=False, obj=obj)
+    except click.exceptions.Exit as e:
+        code = e.exit_code
+    except click.ClickException as e:
+        e.show()
+        code = e.exit_code
+    except click.Abort:
+        print('Aborted!')
+        code = 1
+    except SystemExit as e:
+        code = e.code
+    except EOFError:
+        code = 1
+    if not isinstance(code, int):
+        return 0
+    return code
+
+class _ThreadStream:
+    '''Stands in for stdin, stdout or stderr while the daemon is running
+
+    Each thread of the daemon can set its own stream, so commands for
+    different clients don't write into each other's output. Threads that
+    haven't set one use the stream the daemon was started with.
+    '''
+
+    def __init__(self, default):
+        self.default = default
+        self.local = threading.local()
+
+    def set(self, stream):
+        self.local.stream = stream
+
+    def __getattr__(self, name):
+        return getattr(getattr(self.local, 'stream', None) or self.default, name)
+
+class _PromptReader:
+    '''Stands in for stdin while the daemon runs a command
+
+    Reading a line sends everything printed so far to the client, asks it
+    for a line of input and hands back the client's answer. Other clients
+    can run their commands while this one waits for the answer.
+    '''
+
+    def __init__(self, handler, output, cwd):
+        self.handler = handler
+        self.output = output
+        self.cwd = cwd
+
+    def readline(self):
+        self.handler.send(output=self.output.getvalue(), prompt=True)
+        self.output.seek(0)
+        self.output.truncate()
+        self.handler.server.lock.release()
+        try:
+            line = self.handler.rfile.readline()
+        finally:
+            self.handler.server.lock.acquire()
+            os.chdir(self.cwd)
+        if not line:
+            return ''
+        return json.loads(line).get('answer', '')
+
+class DaemonHandler(socketserver.StreamRequestHandler):
+    '''Runs one forwarded command for the daemon
+
+    Messages are JSON objects, one per line. The client sends the arguments
+    and working directory of a command. The daemon answers with the output
+    of the command and its exit code, and asks the client for input whenever
+    the command asks for confirmation.
+
+    Every client gets its own thread. The working directory is shared by the
+    whole process, so commands take turns through the server's lock, and a
+    command waiting for an answer lets the others run.
+    '''
+
+    def send(self, **message):
+        self.wfile.write((json.dumps(message) + '\n').encode())
+        self.wfile.flush()
+
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        request = json.loads(line)
+
+        output = io.StringIO()
+        cwd = os.getcwd()
+        request_cwd = request.get('cwd', cwd)
+        streams = (sys.stdin, sys.stdout, sys.stderr)
+        sys.stdin.set(_PromptReader(self, output, request_cwd))
+        sys.stdout.set(output)
+        sys.stderr.set(output)
+        with self.server.lock:
+            try:
+                os.chdir(request_cwd)
+                code = run_command(request['args'], self.server.obj)
+            except Exception as e:
+                output.write(f'{type(e).__name__}: {e}\n')
+                code = 1
+            finally:
+                for stream in streams:
+                    stream.set(None)
+                os.chdir(cwd)
+        self.send(output=output.getvalue(), code=code)
+
+def make_daemon_server(socket_path, obj):
+    '''Creates the daemon's server, which handles every client in its own thread
+
+    Parameters:
+        socket_path (str): the path of the daemon's socket
+        obj (dict): the context object holding the session (see cli)
+
+    Returns:
+        socketserver.ThreadingUnixStreamServer: the server, not yet serving
+    '''
+    server = socketserver.ThreadingUnixStreamServer(socket_path, DaemonHandler)
+    server.daemon_threads = True
+    server.obj = obj
+    server.lock = threading.Lock()
+    return server
+
+def format_duration(td):
+    '''Returns a duration the way sum prints it
+
+    Parameters:
+        td (datetime.timedelta): a duration
+
+    Returns:
+        str: the duration in hours and minutes
+    '''
+    seconds = td.total_seconds()
+    return f'{int(seconds // 3600)} hour(s) and {int((seconds - (seconds//3600)*3600) / 60)} minutes'
+
+def event_days(start, end):
+    '''Returns every date an event takes place on
+
+    Parameters:
+        start (datetime.datetime): the start of the event
+        end (datetime.datetime): the end of the event (exclusive)
+
+    Returns:
+        list: dates of the form YYYY-MM-DD
+    '''
+    last = max(start, end - datetime.timedelta(microseconds=1))
+    return [date_from_dt(d) for d in get_day_range(start, last)]
+
+def sync_calendars(service, store, calendar_ids):
+    '''Brings the local copy of several calendars up to date
+
+    Parameters:
+        service (googleapiclient.discovery.Resource): A Resource object that
+            uses the Google Calendar v3 API
+        store (EventStore): the local copy
+        calendar_ids (list): a list of calendar ids, see resolve_calendars
+
+    Returns:
+        dict: the number of events that changed, keyed by calendar summary
+    '''
+    changed = {}
+    for c in get_calendar_entries(service, calendar_ids):
+        changed[c.get('summary', c['id'])] = store.sync(service, c)
+    return changed
+
+def get_calendar_entries(service, calendar_ids):
+    '''Returns the calendarList entries of several calendars
+
+    Parameters:
+        service (googleapiclient.discovery.Resource): A Resource object that
+            uses the Google Calendar v3 API
+        calendar_ids (list): a list of calendar ids, see resolve_calendars
+
+    Returns:
+        list: a list of calendarList entry (JSON) objects
+    '''
+    calendars = get_calendar_list(service)
+    entries = []
+    for calendar_id in calendar_ids:
+        for c in calendars:
+            if c['id'] == calendar_id or (calendar_id == 'primary' and c.get('primary')):
+                entries.append(c)
+                break
+    return entries
+
+class EventStore:
+    '''A local copy of synced calendars with daily rollups
+
+    Events are kept in a SQLite database (STORE_FILE) that is brought up to
+    date with incremental syncs (see sync). Whenever an event changes, the
+    total time spent in each color on each day it touches is recomputed and
+    kept in the rollups table, so sums over any range are answered without
+    going through the events again. The summary, description and location
+    of every event are also kept in a full-text index (see search).
+
+    Calendars are always stored under their real id. "primary" is looked up
+    through the calendar that was synced as the primary calendar.
+
+    Several processes can use the same store at once. Readers never wait
+    on writers (the database is in WAL mode), and every write takes the
+    write lock up front (see transaction), waiting up to STORE_TIMEOUT
+    seconds for other writers to finish.
+
+    Parameters:
+        path (str): the path of the database
+    '''
+
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS calendars (
+            calendar_id TEXT PRIMARY KEY,
+            summary     TEXT,
+            is_primary  INTEGER NOT NULL DEFAULT 0,
+            sync_token  TEXT,
+            synced_at   TEXT
+        );
+        CREATE TABLE IF NOT EXISTS events (
+            id          INTEGER PRIMARY KEY,
+            calendar_id TEXT NOT NULL,
+            event_id    TEXT NOT NULL,
+            summary     TEXT,
+            description TEXT,
+            location    TEXT,
+            color_id    TEXT NOT NULL,
+            start       TEXT NOT NULL,
+            end         TEXT NOT NULL,
+            all_day     INTEGER NOT NULL,
+            body        TEXT NOT NULL,
+            UNIQUE (calendar_id, event_id)
+        );
+        CREATE INDEX IF NOT EXISTS events_start ON events (start);
+        CREATE INDEX IF NOT EXISTS events_color ON events (color_id, start);
+        CREATE TABLE IF NOT EXISTS event_days (
+            calendar_id TEXT NOT NULL,
+            day         TEXT NOT NULL,
+            event_id    TEXT NOT NULL,
+            PRIMARY KEY (calendar_id, day, event_id)
+        );
+        CREATE TABLE IF NOT EXISTS rollups (
+            calendar_id TEXT NOT NULL,
+            color_id    TEXT NOT NULL,
+            day         TEXT NOT NULL,
+            seconds     INTEGER NOT NULL,
+            PRIMARY KEY (calendar_id, color_id, day)
+        );
+        CREATE VIRTUAL TABLE IF NOT EXISTS events_fts USING fts5 (
+            summary, description, location, content='events', content_rowid='id'
+        );
+        CREATE TRIGGER IF NOT EXISTS events_fts_insert AFTER INSERT ON events BEGIN
+            INSERT INTO events_fts (rowid, summary, description, location)
+            VALUES (new.id, new.summary, new.description, new.location);
+        END;
+        CREATE TRIGGER IF NOT EXISTS events_fts_delete AFTER DELETE ON events BEGIN
+            INSERT INTO events_fts (events_fts, rowid, summary, description, location)
+            VALUES ('delete', old.id, old.summary, old.description, old.location);
+        END;
+        CREATE TRIGGER IF NOT EXISTS events_fts_update AFTER UPDATE ON events BEGIN
+            INSERT INTO events_fts (events_fts, rowid, summary, description, location)
+            VALUES ('delete', old.id, old.summary, old.description, old.location);
+            INSERT INTO events_fts (rowid, summary, description, location)
+            VALUES (new.id, new.summary, new.description, new.location);
+        END;
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=STORE_TIMEOUT, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(self.SCHEMA)
+
+    def close(self):
+        '''Closes the database'''
+        self.db.close()
+
+    @contextmanager
+    def transaction(self):
+        '''Runs the statements of a with block as one write transaction
+
+        The write lock is taken when the transaction begins rather than on
+        its first write, so what is read inside the block cannot be changed
+        by another process before it is written.
+        '''
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            self.db.execute('ROLLBACK')
+            raise
+        self.db.execute('COMMIT')
+
+    def calendar_ids(self, names=(), all_calendars=False):
+        '''Returns the ids of synced calendars from calendar names or ids
+
+        Works like resolve_calendars, but only knows about calendars that
+        have been synced.
+
+        Parameters:
+            names (tuple): calendar ids or summaries
+            all_calendars (bool): whether or not to use every synced calendar
+
+        Returns:
+            list: a list of calendar ids, or None if a name has not been synced
+        '''
+        rows = self.db.execute('SELECT calendar_id, summary, is_primary FROM calendars').fetchall()
+        if all_calendars:
+            return [row[0] for row in rows] or None
+
+        ids = []
+        for name in names or ('primary',):
+            for calendar_id, summary, is_primary in rows:
+                if (name == 'primary' and is_primary) or name == calendar_id or name.lower() == (summary or '').lower():
+                    ids.append(calendar_id)
+                    break
+            else:
+                return None
+        return ids
+
+    def sync(self, service, calendar):
+        '''Brings the copy of a calendar up to date
+
+        The first sync of a calendar lists every event. After that, only
+        the events that changed since the last sync are sent. If the API
+        forgets the sync token, the calendar is synced from scratch.
+
+        Parameters:
+            service (googleapiclient.discovery.Resource): A Resource object that
+                uses the Google Calendar v3 API
+            calendar (dict): the calendarList entry of the calendar
+
+        Returns:
+            int: the number of events that changed
+        '''
+        calendar_id = calendar['id']
+        row = self.db.execute('SELECT sync_token FROM calendars WHERE calendar_id = ?', (calendar_id,)).fetchone()
+        sync_token = row[0] if row else None
+
+        changed = 0
+        page_token = None
+        while True:
+            try:
+                result = service.events().list(calendarId=calendar_id, singleEvents=True, showDeleted=True,
+                                                maxResults=2500, pageToken=page_token,
+                                                syncToken=sync_token).execute()
+            except HttpError as e:
+                if e.resp.status != 410 or not sync_token:
+                    raise
+                #the sync token expired, so start over
+                self.forget(calendar_id)
+                sync_token = None
+                page_token = None
+                continue
+
+            with self.transaction():
+                for event in result.get('items', []):
+                    self.apply(calendar_id, event)
+                    changed += 1
+            page_token = result.get('nextPageToken')
+            if not page_token:
+                break
+
+        with self.transaction():
+            if calendar.get('primary'):
+                self.db.execute('UPDATE calendars SET is_primary = 0')
+            self.db.execute('INSERT OR REPLACE INTO calendars VALUES (?, ?, ?, ?, ?)',
+                    (calendar_id, calendar.get('summary'), int(bool(calendar.get('primary'))),
+                     result.get('nextSyncToken'), datetime.datetime.now().isoformat(timespec='seconds')))
+        return changed
+
+    def forget(self, calendar_id):
+        '''Removes every stored event of a calendar
+
+        Parameters:
+            calendar_id (str): the id of the calendar
+        '''
+        with self.transaction():
+            for table in ['events', 'event_days', 'rollups']:
+                self.db.execute(f'DELETE FROM {table} WHERE calendar_id = ?', (calendar_id,))
+            self.db.execute('UPDATE calendars SET sync_token = NULL WHERE calendar_id = ?', (calendar_id,))
+
+    def apply(self, calendar_id, event):
+        '''Stores a new, changed or cancelled event and updates its rollups
+
+        Parameters:
+            calendar_id (str): the id of the calendar of the event
+            event (dict): a Google Calendar event object
+        '''
+        days = {row[0] for row in self.db.execute(
+                'SELECT day FROM event_days WHERE calendar_id = ? AND event_id = ?', (calendar_id, event['id']))}
+        self.db.execute('DELETE FROM events WHERE calendar_id = ? AND event_id = ?', (calendar_id, event['id']))
+        self.db.execute('DELETE FROM event_days WHERE calendar_id = ? AND event_id = ?', (calendar_id, event['id']))
+
+        if event.get('status') != 'cancelled' and 'start' in event:
+            all_day = 'dateTime' not in event['start']
+            start, end = get_start_and_end(event)
+            new_days = event_days(start, end)
+            if all_day:
+                start, end = event['start']['date'], event['end']['date']
+            else:
+                start, end = start.isoformat(), end.isoformat()
+            self.db.execute('''
+                INSERT INTO events (calendar_id, event_id, summary, description, location,
+                                    color_id, start, end, all_day, body)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''',
+                    (calendar_id, event['id'], event.get('summary'), event.get('description'), 
+                     event.get('location'), event.get('colorId', ''), start, end, int(all_day), 
+                     json.dumps(event)))
+            self.db.executemany('INSERT INTO event_days VALUES (?, ?, ?)',
+                    [(calendar_id, day, event['id']) for day in new_days])
+            days.update(new_days)
+
+        for day in days:
+            self.update_rollups(calendar_id, day)
+
+    def update_rollups(self, calendar_id, day):
+        '''Recomputes the time spent in each color on a day of a calendar
+
+        Like sum, every event counts in full even if it overlaps another
+        one, and events that run past midnight only count towards the part
+        that falls on the day.
+
+        Parameters:
+            calendar_id (str): the id of the calendar
+            day (str): a date of the form YYYY-MM-DD
+        '''
+        day_start = dt_from_date(day)
+        day_end = day_start + datetime.timedelta(days=1)
+        colors = {}
+        rows = self.db.execute('''
+            SELECT e.color_id, e.start, e.end FROM event_days d
+            JOIN events e ON e.calendar_id = d.calendar_id AND e.event_id = d.event_id
+            WHERE d.calendar_id = ? AND d.day = ? AND NOT e.all_day''', (calendar_id, day))
+        for color_id, start, end in rows:
+            start = max(datetime.datetime.fromisoformat(start), day_start)
+            end = min(datetime.datetime.fromisoformat(end), day_end)
+            colors[color_id] = colors.get(color_id, 0) + max((end - start).total_seconds(), 0)
+
+        self.db.execute('DELETE FROM rollups WHERE calendar_id = ? AND day = ?', (calendar_id, day))
+        for color_id, seconds in colors.items():
+            if seconds > 0:
+                self.db.execute('INSERT INTO rollups VALUES (?, ?, ?, ?)', (calendar_id, color_id, day, int(seconds)))
+
+    def total(self, color_id, dt1, dt2, calendar_ids):
+        '''Returns the time spent in a color from dt1 to dt2 (inclusive)
+
+        Parameters:
+            color_id (str): the color id of the events to count
+            dt1 (datetime.datetime): The starting datetime
+            dt2 (datetime.datetime): The ending datetime
+            calendar_ids (list): the ids of synced calendars
+
+        Returns:
+            datetime.timedelta: the total time
+        '''
+        seconds = 0
+        for calendar_id in calendar_ids:
+            seconds += self.db.execute('''
+                SELECT COALESCE(SUM(seconds), 0) FROM rollups
+                WHERE calendar_id = ? AND color_id = ? AND day BETWEEN ? AND ?''',
+                (calendar_id, color_id, date_from_dt(dt1), date_from_dt(dt2))).fetchone()[0]
+        return datetime.timedelta(seconds=seconds)
+
+    def search(self, text=None, color_id=None, calendar_ids=None, dt1=None, dt2=None):
+        '''Returns the stored events that match a search
+
+        Every word of text has to appear in the summary, description or
+        location of an event, either whole or as the start of a word.
+
+        Parameters:
+            text (str): the words to search for
+            color_id (str): the color id of the events to return
+            calendar_ids (list): the ids of the calendars to search
+            dt1 (datetime.datetime): the first day to search
+            dt2 (datetime.datetime): the last day to search
+
+        Returns:
+            list: (calendar id, event) tuples ordered by the start of the event
+        '''
+        query = 'SELECT e.calendar_id, e.body FROM events e'
+        conditions = []
+        params = []
+        if text and text.split():
+            query += ' JOIN events_fts f ON f.rowid = e.id'
+            conditions.append('events_fts MATCH ?')
+            params.append(' '.join('"' + word.replace('"', '""') + '"*' for word in text.split()))
+        if color_id is not None:
+            conditions.append('e.color_id = ?')
+            params.append(color_id)
+        if calendar_ids:
+            conditions.append(f'e.calendar_id IN ({", ".join("?" * len(calendar_ids))})')
+            params.extend(calendar_ids)
+        if dt1:
+            conditions.append('e.start >= ?')
+            params.append(date_from_dt(dt1))
+        if dt2:
+            conditions.append('e.start < ?')
+            params.append(date_from_dt(dt2 + datetime.timedelta(days=1)))
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY e.start'
+        return [(calendar_id, json.loads(body)) for calendar_id, body in self.db.execute(query, params)]
+
+    def busy_intervals(self, dt1, dt2, calendar_ids):
+        '''Returns the busy intervals of stored calendars from dt1 to dt2 (inclusive)
+
+        Works like get_busy_intervals: events that are marked as free
+        (transparent) do not count as busy, and intervals are in the
+        current timezone whatever the timezone of each event.
+
+        Parameters:
+            dt1 (datetime.datetime): The starting datetime
+            dt2 (datetime.datetime): The ending datetime
+            calendar_ids (list): the ids of synced calendars
+
+        Returns:
+            list: merged (start, end) tuples
+        '''
+        #start and end are stored in each event's own wall clock time, which
+        #can be up to a day away from the current timezone
+        rows = self.db.execute(f'''
+            SELECT body FROM events
+            WHERE calendar_id IN ({", ".join("?" * len(calendar_ids))}) AND start < ? AND end > ?
+        ''', (*calendar_ids, date_from_dt(dt2 + 2 * ONE_DAY), date_from_dt(dt1 - ONE_DAY)))
+        events = [json.loads(body) for body, in rows]
+        return merge_intervals(get_local_start_and_end(e) for e in events if e.get('transparency') != 'transparent')
+
+    def report(self, dt1, dt2, calendar_ids, period='day'):
+        '''Returns the time spent in each color from dt1 to dt2 (inclusive)
+
+        Parameters:
+            dt1 (datetime.datetime): The starting datetime
+            dt2 (datetime.datetime): The ending datetime
+            calendar_ids (list): the ids of synced calendars
+            period (str): "day", "week" or "month"
+
+        Returns:
+            list: (period, color id, datetime.timedelta) tuples ordered by
+                period, where a week is named after its first day (Sunday)
+        '''
+        group = {
+            'day': 'day',
+            'week': "date(day, '-' || strftime('%w', day) || ' days')",
+            'month': "substr(day, 1, 7)",
+        }[period]
+        marks = ', '.join('?' * len(calendar_ids))
+        rows = self.db.execute(f'''
+            SELECT {group} AS period, color_id, SUM(seconds) FROM rollups
+            WHERE calendar_id IN ({marks}) AND day BETWEEN ? AND ?
+            GROUP BY period, color_id ORDER BY period, color_id''',
+            (*calendar_ids, date_from_dt(dt1), date_from_dt(dt2)))
+        return [(p, color_id, datetime.timedelta(seconds=seconds)) for p, color_id, seconds in rows]
+
+def stored_calendars(calendars, all_calendars, profile=None):
+    '''Opens the local copy and returns it along with the synced calendars
+
+    Prints what to do if any of the calendars have not been synced yet.
+
+    Parameters:
+        calendars (tuple): calendar ids or summaries
+        all_calendars (bool): whether or not to use every synced calendar
+        profile (str): the profile whose local copy to open
+
+    Returns:
+        tuple: an EventStore and a list of calendar ids, or (None, None)
+    '''
+    store = EventStore(profile_files(profile)[1])
+    calendar_ids = store.calendar_ids(calendars, all_calendars)
+    if not calendar_ids:
+        store.close()
+        if profile and profile != DEFAULT_PROFILE:
+            print(f'Those calendars have not been synced yet. Do "gcalendar --profile {profile} sync" first.')
+        else:
+            print('Those calendars have not been synced yet. Do "gcalendar sync" first.')
+        return (None, None)
+    return (store, calendar_ids)
+
+def color_time(service, color_id, dt1, dt2, calendar_ids=('primary',)):
+    '''Returns the time spent in a color from dt1 to dt2 (inclusive)
+
+    The whole range is fetched at once. Like sum, every event counts in
+    full even if it overlaps another one, and events that run past midnight
+    only count towards each day for the part that falls on it.
+
+    Parameters:
+        service (googleapiclient.discovery.Resource): A Resource object that
+            uses the Google Calendar v3 API
+        color_id (str): the color id of the events to count
+        dt1 (datetime.datetime): The starting datetime
+        dt2 (datetime.datetime): The ending datetime
+        calendar_ids (list): a list of calendar ids
+
+    Returns:
+        datetime.timedelta: the total time
+    '''
+    events = get_events_in_range(service, dt1, dt2, calendar_ids) or []
+    tree = IntervalTree(event_intervals(events))
+    td = datetime.timedelta()
+    for dt in iter_day_range(dt1, dt2):
+        day = get_min_time(dt)
+        td += tree.clipped_time(day, day + ONE_DAY, lambda event: event.get('colorId', '') == color_id)
+    return td
+
+def print_account_totals(obj, accounts, color_id, dt1, dt2, rollups, calendars, all_calendars):
+    '''Prints the time spent in a color for several accounts and in total
+
+    Accounts are queried at once, or read from their local copies if
+    rollups is set.
+
+    Parameters:
+        obj (dict): the context object holding the session (see cli)
+        accounts (list): a list of profile names
+        color_id (str): the color id of the events to count
+        dt1 (datetime.datetime): The starting datetime
+        dt2 (datetime.datetime): The ending datetime
+        rollups (bool): whether or not to use the local copies
+        calendars (tuple): calendar ids or summaries
+        all_calendars (bool): whether or not to use every calendar
+
+    Returns:
+        int: the exit code for the command
+    '''
+    if rollups:
+        totals = {}
+        for account in accounts:
+            store, calendar_ids = stored_calendars(calendars, all_calendars, account)
+            if not store:
+                return 6
+            totals[account] = store.total(color_id, dt1, dt2, calendar_ids)
+            store.close()
+    else:
+        def total(service):
+            calendar_ids = resolve_calendars(service, calendars, all_calendars)
+            if not calendar_ids:
+                return None
+            return color_time(service, color_id, dt1, dt2, calendar_ids)
+
+        totals = run_for_accounts(obj, accounts, total)
+        if totals is None:
+            return 1
+        if None in totals.values():
+            print('Unknown calendar. Must either be the id or the name of a calendar in every account.')
+            return 1
+
+    width = max(len(account) for account in totals) + 1
+    lines = []
+    overall = datetime.timedelta()
+    for account, td in totals.items():
+        lines.append(f'{account + ":":<{width}} {format_duration(td)}')
+        overall += td
+    lines.append(f'{"total:":<{width}} {format_duration(overall)}')
+    print('\n'.join(lines))
+    return 0
+
+class NotificationHandler(http.server.BaseHTTPRequestHandler):
+    '''Receives push notifications for the receiver of watch
+
+    Google Calendar posts to the address of a channel whenever an event of
+    the watched calendar changes. Only the headers matter: they name the
+    channel, and with it the calendar that changed.
+    '''
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+
+        accepted = self.server.receiver.notify(self.headers.get('X-Goog-Channel-ID'),
+                                               self.headers.get('X-Goog-Channel-Token'),
+                                               self.headers.get('X-Goog-Resource-State'))
+        self.send_response(200 if accepted else 403)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+class NotificationReceiver:
+    '''A small HTTP server that collects push notifications
+
+    Each notification marks the calendar of its channel as dirty. The
+    dirty calendars are picked up with changed, so a sync only runs when
+    something actually changed.
+
+    Parameters:
+        host (str): the host to listen on
+        port (int): the port to listen on, 0 picks a free one
+        token (str): the token every notification must carry
+    '''
+
+    def __init__(self, host='', port=WATCH_PORT, token=None):
+        self.token = token
+        self.channels = {}
+        self.dirty = set()
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+        self.server = http.server.ThreadingHTTPServer((host, port), NotificationHandler)
+        self.server.receiver = self
+        self.port = self.server.server_address[1]
+        self.thread = None
+
+    def add_channel(self, channel_id, calendar_id):
+        '''Starts accepting notifications of a channel
+
+        Parameters:
+            channel_id (str): the id of the channel
+            calendar_id (str): the id of the calendar the channel watches
+        '''
+        with self.lock:
+            self.channels[channel_id] = calendar_id
+
+    def remove_channel(self, channel_id):
+        '''Stops accepting notifications of a channel
+
+        Parameters:
+            channel_id (str): the id of the channel
+        '''
+        with self.lock:
+            self.channels.pop(channel_id, None)
+
+    def notify(self, channel_id, token, state):
+        '''Marks the calendar of a channel as dirty
+
+        The "sync" message that is sent when a channel is opened does not
+        mean anything changed, so it is accepted but ignored.
+
+        Parameters:
+            channel_id (str): the id of the channel
+            token (str): the token of the notification
+            state (str): the resource state of the notification
+
+        Returns:
+            bool: whether or not the notification came from a known channel
+        '''
+        with self.lock:
+            if channel_id not in self.channels or token != self.token:
+                return False
+            if state != 'sync':
+                self.dirty.add(self.channels[channel_id])
+                self.ready.set()
+        return True
+
+    def changed(self, timeout=None):
+        '''Waits for notifications and returns the calendars that changed
+
+        Parameters:
+            timeout (float): the most seconds to wait for
+
+        Returns:
+            set: the ids of the dirty calendars, which are no longer dirty
+                afterwards (empty if the timeout ran out)
+        '''
+        self.ready.wait(timeout)
+        with self.lock:
+            dirty = self.dirty
+            self.dirty = set()
+            self.ready.clear()
+        return dirty
+
+    def start(self):
+        '''Starts serving in the background'''
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        '''Stops serving'''
+        self.server.shutdown()
+        self.server.server_close()
+
+def watch_calendar(service, calendar_id, address, token, ttl=WATCH_TTL):
+    '''Opens a channel that sends notifications when a calendar changes
+
+    Parameters:
+        service (googleapiclient.discovery.Resource): A Resource object that
+            uses the Google Calendar v3 API
+        calendar_id (str): the id of the calendar to watch
+        address (str): the HTTPS address notifications are sent to
+        token (str): a token that is sent with every notification
+        ttl (int): how many seconds the channel stays open
+
+    Returns:
+        dict: the channel, with its id, resourceId and expiration
+    '''
+    body = {
+        'id': base64.b32hexencode(os.urandom(20)).decode().lower(),
+        'type': 'web_hook',
+        'address': address,
+        'token': token,
+        'params': {'ttl': str(ttl)},
+    }
+    return service.events().watch(calendarId=calendar_id, body=body).execute()
+
+def stop_channel(service, channel):
+    '''Closes a channel opened by watch_calendar
+
+    Parameters:
+        service (googleapiclient.discovery.Resource): A Resource object that
+            uses the Google Calendar v3 API
+        channel (dict): the channel
+    '''
+    service.channels().stop(body={'id': channel['id'], 'resourceId': channel['resourceId']}).execute()
+
+# End library
+
+def calendar_options(f):
+    '''Adds the --calendar and --all-calendars options to a command'''
+    f = click.option('--all-calendars', 'all_calendars', is_flag=True,
+            help='use every calendar on your calendar list')(f)
+    f = click.option('--calendar', 'calendars', multiple=True,
+            help='the id or name of a calendar to use (can be repeated)')(f)
+    return f
 
-# End library
+def account_options(f):
+    '''Adds the --accounts option to a command'''
+    return click.option('--accounts', type=str,
+            help='profiles to run for at the same time, separated by commas (see authorize --profile)')(f)
 
+#Commands that never get forwarded to the daemon
 @click.group()
+@click.option('--pool-size', default=DEFAULT_POOL_SIZE, envvar='GCALENDAR_POOL_SIZE', show_default=True,
+        help='the maximum number of connections to Google Calendar')
+@click.option('--profile', default=DEFAULT_PROFILE, envvar='GCALENDAR_PROFILE', show_default=True,
+        help='the authorized account to use (see authorize --profile)')
 @click.pass_context
-def cli(ctx):
+def cli(ctx, pool_size, profile):
     '''A command line tool for Google Calendar'''
-
-    if os.path.isfile(FILE_DIRECTORY + '\\token.json'):
-        store = file.Storage(FILE_DIRECTORY + '\\token.json')
-        creds = store.get()
-        if not creds or creds.invalid:
-            flow = client.flow_from_clientsecrets('credentials.json', SCOPES)
-            creds = tools.run_flow(flow, store)
+    if not is_profile_name(profile):
+        print_invalid_profile(profile)
+        ctx.exit(1)
+
+    #already running inside of a session (see run_command)
+    if ctx.obj and 'service' in ctx.obj:
+        if profile != ctx.obj.get('profile', DEFAULT_PROFILE):
+            print('The profile can\'t be changed inside of a session. Use --accounts instead.')
+            ctx.exit(1)
+        return
+
+    token_file = profile_files(profile)[0]
+    if os.path.isfile(token_file):
         try:
-            service = build('calendar', 'v3', http=creds.authorize(Http()))
+            #refresh once per process, then keep it fresh in the background
+            service, manager = connect(token_file, pool_size)
+        except ValueError:
+            print('Your token is invalid. Please authorize again.')
+            sys.exit(1)
         except:
             print('Unable to connect to Google Calendar. Make sure you\'re connected to the internet.')
             sys.exit(1)
 
         ctx.obj = {}
         ctx.obj['service'] = service
+        ctx.obj['credentials'] = manager
+        ctx.obj['profile'] = profile
+        ctx.obj['pool_size'] = pool_size
+    elif profile != DEFAULT_PROFILE:
+        print(f'There is no profile named {profile}. Do "gcalendar authorize --profile {profile}" first.')
+        sys.exit(1)
     else:
         print('You haven\'t been authorized yet. Check github for more info.')
         return 0
@@ -600,14 +3608,26 @@ def cli(ctx):
 @cli.command()
 @click.argument('day', type=str)
 @click.argument('filename', type=str)
+@click.option('-u', 'until', type=str, help='if this is specified, then every event from day to the day specified by this option is saved as one schedule')
 @click.pass_context
-def save(ctx, day, filename):
+def save(ctx, day, filename, until):
     '''Save a schedule of events to a file'''
     dt = dt_from_day(day)
     if not dt:
         print('Invalid date. Must either be a day of the week or of the form YYYY-MM-DD.')
         return 1
 
+    new_dt = None
+    if until:
+        new_dt = dt_from_day(until)
+        if not new_dt:
+            print('Invalid date. Must either be a day of the week or of the form YYYY-MM-DD.')
+            return 1
+
+        if not dt < new_dt:
+            print('Invalid date range. Please make sure your range is in order.')
+            return 2
+
     if not filename.endswith('.json'):
         filename += '.json'
     #Check if filename already exists in the current path and ask the user if
@@ -622,15 +3642,23 @@ def save(ctx, day, filename):
             return 2
 
     schedule_path = pathlib.Path(FILE_DIRECTORY + '/schedules')
-    if not os.path.isdir(schedule_path):
-        schedule_path.mkdir()
+    schedule_path.mkdir(exist_ok=True)
 
-    events = get_events(ctx.obj['service'], dt)
+    if new_dt:
+        events = get_events_in_range(ctx.obj['service'], dt, new_dt)
+    else:
+        events = get_events(ctx.obj['service'], dt)
     if not events:
         print('No events found. Save canceled.')
         return 3
-    save_events(events, FILE_DIRECTORY + '\\schedules\\' + filename)
-    print(f'Saved events from {day} to {filename}.')
+
+    if new_dt:
+        days = (dateobj_from_dt(new_dt) - dateobj_from_dt(dt)).days + 1
+        save_events(events, FILE_DIRECTORY + '\\schedules\\' + filename, dt, days)
+        print(f'Saved events from {day} to {until} to {filename}.')
+    else:
+        save_events(events, FILE_DIRECTORY + '\\schedules\\' + filename)
+        print(f'Saved events from {day} to {filename}.')
     return 0
 
 @cli.command()
@@ -638,9 +3666,14 @@ def save(ctx, day, filename):
 @click.argument('day', type=str) 
 @click.option('-u', 'until', type=str, help='if this is specified, then events from filename will be uploaded from day to the day specified by this option')
 @click.option('-c', 'confirm', is_flag=True, help='asks to confirm before overwriting any events')
+@click.option('--plan', is_flag=True, help='shows the changes and API calls this would make without making them')
 @click.pass_context
-def upload(ctx, filename, day, until, confirm):
-    '''Upload events from a file to a specific date'''
+def upload(ctx, filename, day, until, confirm, plan):
+    '''Upload events from a file to a specific date
+
+    A schedule saved from several days is uploaded starting on day. With -u,
+    it is repeated back to back until the day specified.
+    '''
     dt = dt_from_day(day)
     if not dt:
         print('Invalid date. Must either be a day of the week or of the form YYYY-MM-DD.')
@@ -651,15 +3684,17 @@ def upload(ctx, filename, day, until, confirm):
     if not os.path.exists(FILE_DIRECTORY + '\\schedules\\' + filename):
         print(f'{filename} does not exist.')
         return 4
-    events = load_events(FILE_DIRECTORY + '\\schedules\\' + filename)
+    template = load_template(FILE_DIRECTORY + '\\schedules\\' + filename)
+    events = template['events']
     if not events:
         print(f'No events found in {filename}.')
         return 3
+    length = datetime.timedelta(days=template['days'] - 1)
 
     day_range = []
     if until:
         new_dt = dt_from_day(until)
-        if not dt:
+        if not new_dt:
             print('Invalid date. Must either be a day of the week or of the form YYYY-MM-DD.')
             return 1
 
@@ -667,24 +3702,49 @@ def upload(ctx, filename, day, until, confirm):
             print('Invalid date range. Please make sure your range is in order.')
             return 2
 
-        for e in get_day_range(dt, new_dt):
-            day_range.append(e)
+        #multi-day schedules are stamped once every template['days'] days, as
+        #long as the whole stamp fits before the day after until
+        for e in get_day_range(dt, new_dt)[::template['days']]:
+            if e + length <= new_dt:
+                day_range.append(e)
+        if not day_range:
+            print(f'{filename} is {template["days"]} days long and does not fit from {day} to {until}.')
+            return 2
     else:
         day_range.append(dt)
-    
+
+    if plan:
+        days = [(d, plan_upload(events, d, template=filename, origin=template['start'])) for d in day_range]
+        reads = {'list': 1} if confirm else {}
+        print_plan(days, reads)
+        return 0
+
+    #one read covers every stamp, and any event on one of its days counts,
+    #even one marked as free
+    grouped = {}
+    if confirm:
+        span = get_day_range(day_range[0], day_range[-1] + length)
+        grouped = group_by_day(get_events_in_range(ctx.obj['service'], span[0], span[-1]) or [], span)
+
+    mutations = []
     for d in day_range:
-        current_events = get_events(ctx.obj['service'], d)
+        stamp = [date_from_dt(d + datetime.timedelta(days=i)) for i in range(template['days'])]
+        if confirm and any(grouped[day] for day in stamp):
+            if length:
+                message = f'There are already events registered from {date_from_dt(d)} to {date_from_dt(d + length)}'
+            else:
+                message = f'There are already events registered for {date_from_dt(d)}'
+            confirmed = ask_for_confirmation(message + ', would you like to overwrite them?')
+            if confirmed:
+                pass
+            else:
+                continue
 
-        if current_events:
-            if confirm:
-                confirmed = ask_for_confirmation(f'There are already events registered for {date_from_dt(d)}, would you like to overwrite them?')
-                if confirmed:
-                    pass
-                else:
-                    continue
-            #delete_events(ctx.obj['service'], current_events)
+        mutations.extend(plan_upload(events, d, template=filename, origin=template['start']))
 
-        upload_events(ctx.obj['service'], events, d)
+    journal = Journal.create(f'upload {filename} {day}' + (f' -u {until}' if until else ''), mutations)
+    if not run_job(ctx.obj['service'], journal):
+        return 5
 
     if until:
         print(f'Uploaded events from {filename} from {day} to {until}')
@@ -696,8 +3756,13 @@ def upload(ctx, filename, day, until, confirm):
 @click.option('-f', '--filename', is_flag=True, help='Specifies that the' 
         + ' name given is a filename')
 @click.argument('name', type=str)
+@click.option('-u', 'until', type=str, help='if this is specified, then every event from name until the day specified here is listed')
+@click.option('--week', is_flag=True, help='lists the whole week of the day given')
+@click.option('--month', is_flag=True, help='lists the whole month of the day given')
+@calendar_options
+@account_options
 @click.pass_context
-def list(ctx, name, filename):
+def list(ctx, name, filename, until, week, month, calendars, all_calendars, accounts):
     '''List events from a file or day'''
     if filename:
         if not name.endswith('.json'):
@@ -719,7 +3784,65 @@ def list(ctx, name, filename):
         print('Invalid date. Must either be a day of the week or of the form YYYY-MM-DD.')
         return 1
 
-    events = get_events(ctx.obj['service'], dt)
+    day_range = None
+    if until:
+        new_dt = dt_from_day(until)
+        if not new_dt:
+            print('Invalid date. Must either be a day of the week or of the form YYYY-MM-DD.')
+            return 1
+        if not dt < new_dt:
+            print('Invalid date range. Please make sure your range is in order.')
+            return 2
+        day_range = get_day_range(dt, new_dt)
+    elif week:
+        day_range = get_days_of_week(dt)
+    elif month:
+        day_range = get_day_range(dt.replace(day=1), dt.replace(day=calendar.monthrange(dt.year, dt.month)[1]))
+
+    if accounts:
+        accounts = parse_accounts(accounts)
+        if not accounts:
+            return 1
+        first, last = (day_range[0], day_range[-1]) if day_range else (dt, dt)
+
+        def fetch(service):
+            calendar_ids = resolve_calendars(service, calendars, all_calendars)
+            if not calendar_ids:
+                return None
+            return get_events_in_range(service, first, last, calendar_ids) or []
+
+        results = run_for_accounts(ctx.obj, accounts, fetch)
+        if results is None:
+            return 1
+        if None in results.values():
+            print('Unknown calendar. Must either be the id or the name of a calendar in every account.')
+            return 1
+        labels = {id(e): account for account, events in results.items() for e in events}
+        events = [e for e in heapq.merge(*results.values(), key=event_start_key)]
+        if not events:
+            print('No events found.')
+            return 3
+        if day_range:
+            print_agenda(group_by_day(events, day_range), labels)
+        else:
+            print_events(events, labels)
+        return 0
+
+    calendar_ids = resolve_calendars(ctx.obj['service'], calendars, all_calendars)
+    if not calendar_ids:
+        print('Unknown calendar. Must either be the id or the name of a calendar.')
+        return 1
+
+    if day_range:
+        #one fetch for the whole range, split up into days afterwards
+        events = get_events_in_range(ctx.obj['service'], day_range[0], day_range[-1], calendar_ids)
+        if not events:
+            print('No events found.')
+            return 3
+        print_agenda(group_by_day(events, day_range))
+        return 0
+
+    events = get_events_from_calendars(ctx.obj['service'], dt, calendar_ids)
     if not events:
         print('No events found.')
         return 3
@@ -731,8 +3854,10 @@ def list(ctx, name, filename):
 @click.option('-u', 'until', help='If this is specified, then all events from day until the day specified here will be deleted')
 @click.option('-c', 'confirm', is_flag=True, help='asks to confirm before overwriting any events')
 @click.option('-f','filename', is_flag=True, help='if this is specified, then the schedule specified will be deleted')
+@click.option('--plan', is_flag=True, help='shows the changes and API calls this would make without making them')
+@calendar_options
 @click.pass_context
-def delete(ctx, day, until, confirm, filename):
+def delete(ctx, day, until, confirm, filename, plan, calendars, all_calendars):
     '''Delete events from a specific day'''
 
     if filename:
@@ -768,17 +3893,42 @@ def delete(ctx, day, until, confirm, filename):
     else:
         day_range.append(dt)
 
+    calendar_ids = resolve_calendars(ctx.obj['service'], calendars, all_calendars)
+    if not calendar_ids:
+        print('Unknown calendar. Must either be the id or the name of a calendar.')
+        return 1
+
+    if plan:
+        ranged = get_range_by_calendar(ctx.obj['service'], day_range[0], day_range[-1], calendar_ids)
+        grouped = {c: group_by_day(events, day_range) for c, events in ranged.items()}
+        days = []
+        for d in day_range:
+            day_mutations = []
+            for calendar_id in calendar_ids:
+                day_mutations.extend(plan_delete(grouped[calendar_id][date_from_dt(d)], calendar_id))
+            days.append((d, day_mutations))
+        reads = {'list': len(day_range) * len(calendar_ids)}
+        print_plan(days, reads, len(calendar_ids), [e for events in ranged.values() for e in events])
+        return 0
+
+    mutations = []
     for d in day_range:
-        current_events = get_events(ctx.obj['service'], d)
+        current_events = get_events_by_calendar(ctx.obj['service'], d, calendar_ids, cached=False)
 
-        if current_events:
+        if any(current_events.values()):
             if confirm:
                 confirmed = ask_for_confirmation(f'There are already events registered for {date_from_dt(d)}, would you like to overwrite them?')
                 if confirmed:
                     pass
                 else:
                     continue
-            delete_events(ctx.obj['service'], current_events)
+            for calendar_id, events in current_events.items():
+                if events:
+                    mutations.extend(plan_delete(events, calendar_id))
+
+    journal = Journal.create(f'delete {day}' + (f' -u {until}' if until else ''), mutations)
+    if not run_job(ctx.obj['service'], journal):
+        return 5
 
     if until:
         print(f'Deleted events from {day} to {until}')
@@ -789,8 +3939,9 @@ def delete(ctx, day, until, confirm, filename):
 @cli.command()
 @click.argument('day', type=str)
 @click.argument('newday', type=str)
+@click.option('-u', 'until', help='if this is specified, then all events from day until the day specified here will be moved, starting on newday')
 @click.pass_context
-def move(ctx, day, newday):
+def move(ctx, day, newday, until):
     '''Moves events from one day to another'''
     dt = dt_from_day(day)
     if not dt:
@@ -802,19 +3953,45 @@ def move(ctx, day, newday):
         print('Invalid date. Must either be a day of the week or of the form YYYY-MM-DD.')
         return 1
 
-    current_events = get_events(ctx.obj['service'], new_dt)
+    until_dt = dt
+    if until:
+        until_dt = dt_from_day(until)
+        if not until_dt:
+            print('Invalid date. Must either be a day of the week or of the form YYYY-MM-DD.')
+            return 1
+
+        if not dt < until_dt:
+            print('Invalid date range. Please make sure your range is in order.')
+            return 2
+
+    old_events = get_events_in_range(ctx.obj['service'], dt, until_dt)
+    if not old_events:
+        print(f'No events found for {day}. Move canceled.')
+        return 3
+
+    days = (dateobj_from_dt(new_dt) - dateobj_from_dt(dt)).days
+    new_until_dt = until_dt + datetime.timedelta(days=days)
+
+    #every event on the target days is overwritten, even one marked as free,
+    #but the events being moved are not in the way if the ranges overlap
+    moving = set(e['id'] for e in old_events)
+    current_events = [e for e in get_events_in_range(ctx.obj['service'], new_dt, new_until_dt) or []
+                      if e['id'] not in moving]
     if current_events:
         confirmed = ask_for_confirmation(f'There are already events registered for {newday}, would you like to overwrite them?')
-        if confirmed:
-            delete_events(ctx.obj['service'], current_events)
-        else:
+        if not confirmed:
             print('Move canceled.')
             return 0
+        failed = delete_events(ctx.obj['service'], current_events)
+        if failed:
+            print_failed(failed)
+            print('Move canceled.')
+            return 5
 
-    old_events = get_events(ctx.obj['service'], dt)
-    new_events = clone_events(old_events)
-    upload_events(ctx.obj['service'], new_events, new_dt)
-    delete_events(ctx.obj['service'], old_events)
+    failed = move_events(ctx.obj['service'], old_events, days)
+    if failed:
+        print(f'{len(failed)} event(s) could not be moved.')
+        return 5
 
     print(f'Moved events from {day} to {newday}.')
     return 0
@@ -824,8 +4001,10 @@ def move(ctx, day, newday):
 @click.argument('newday', type=str)
 @click.option('-u', 'until', is_flag=True, help='specifies to copy over days until newday')
 @click.option('-c', 'confirm', is_flag=True, help='asks to confirm before overwriting any events')
+@click.option('--plan', is_flag=True, help='shows the changes and API calls this would make without making them')
+@calendar_options
 @click.pass_context
-def copy(ctx, day, newday, until, confirm):
+def copy(ctx, day, newday, until, confirm, plan, calendars, all_calendars):
     '''Copies a schedule from a day to another day'''
     dt = dt_from_day(day)
     if not dt:
@@ -837,16 +4016,15 @@ def copy(ctx, day, newday, until, confirm):
         print('Invalid date. Must either be a day of the week or of the form YYYY-MM-DD.')
         return 1
 
-    raw_events = get_events(ctx.obj['service'], dt)
-    if not raw_events:
-        print(f'No events found for {day}. Copy canceled.')
-        return 3
-
-    events = clone_events(raw_events)
+    calendar_ids = resolve_calendars(ctx.obj['service'], calendars, all_calendars)
+    if not calendar_ids:
+        print('Unknown calendar. Must either be the id or the name of a calendar.')
+        return 1
 
     day_range = []
     if until:
-        if not dt < new_dt:
+        #today, tomorrow and yesterday have a time of day, so compare dates
+        if not dateobj_from_dt(dt) < dateobj_from_dt(new_dt):
             print('Invalid date range. Please make sure your range is in order.')
             return 2
 
@@ -857,23 +4035,195 @@ def copy(ctx, day, newday, until, confirm):
     else:
         day_range.append(new_dt)
 
-    for d in day_range:
-        current_events = get_events(ctx.obj['service'], d)
+    #one read covers the source day and every target day, and the events
+    #already on a target day decide whether it gets overwritten
+    first, last = min(dt, day_range[0]), max(dt, day_range[-1])
+    ranged = get_range_by_calendar(ctx.obj['service'], first, last, calendar_ids)
+    grouped = {c: group_by_day(e, [dt] + day_range) for c, e in ranged.items()}
+    raw_events = {c: grouped[c][date_from_dt(dt)] for c in calendar_ids}
+    if not any(raw_events.values()):
+        print(f'No events found for {day}. Copy canceled.')
+        return 3
 
-        if current_events:
-            if confirm:
+    events = {c: clone_events(e) for c, e in raw_events.items() if e}
+
+    mutations = []
+    days = []
+    for d in day_range:
+        current_events = {c: grouped[c][date_from_dt(d)] for c in calendar_ids}
+        if any(current_events.values()):
+            if confirm and not plan:
                 confirmed = ask_for_confirmation(f'There are already events registered for {date_from_dt(d)}, would you like to overwrite them?')
                 if confirmed:
                     pass
                 else:
                     continue
-            delete_events(ctx.obj['service'], current_events)
 
-        upload_events(ctx.obj['service'], events, d)
+        inserts = []
+        for calendar_id, new_events in events.items():
+            inserts.extend(plan_upload(new_events, d, calendar_id, f'copy {date_from_dt(dt)}'))
+
+        #events left over from an earlier copy have the same ids as the new
+        #ones, so they are kept instead of being deleted and inserted again
+        ids = set(m['body']['id'] for m in inserts)
+        day_mutations = []
+        for calendar_id, old_events in current_events.items():
+            old_events = [e for e in old_events or [] if e['id'] not in ids]
+            day_mutations.extend(plan_delete(old_events, calendar_id))
+        day_mutations.extend(inserts)
+        days.append((d, day_mutations))
+        mutations.extend(day_mutations)
+
+    if plan:
+        reads = {'list': len(calendar_ids)}
+        print_plan(days, reads, len(calendar_ids), [e for c in ranged.values() for e in c])
+        return 0
+
+    journal = Journal.create(f'copy {day} {newday}' + (' -u' if until else ''), mutations)
+    if not run_job(ctx.obj['service'], journal):
+        return 5
 
     print(f'Copied events from {day} to {newday}')
     return 0
 
+@cli.command()
+@click.argument('job', required=False)
+@click.pass_context
+def resume(ctx, job):
+    '''Finishes a bulk job that was cut short'''
+    journals = Journal.unfinished()
+    if not journals:
+        print('No unfinished jobs found.')
+        return 0
+
+    if not job:
+        if len(journals) > 1:
+            for journal in journals:
+                running = '  (running)' if journal.is_running() else ''
+                print(f'{journal.job_id}  {journal.description}  ({len(journal.pending())} change(s) left){running}')
+            print('Do "gcalendar resume (job)" to finish one of these jobs.')
+            return 0
+        job = journals[0].job_id
+
+    for journal in journals:
+        if journal.job_id == job:
+            break
+    else:
+        print(f'{job} does not exist.')
+        return 1
+
+    print(f'Resuming {journal.description} ({len(journal.pending())} change(s) left).')
+    if not run_job(ctx.obj['service'], journal):
+        return 5
+    print(f'Finished {journal.description}.')
+    return 0
+
+@cli.command()
+@click.argument('start', type=str)
+@click.argument('end', type=str)
+@click.argument('output', type=str)
+@click.option('--format', 'fmt', type=click.Choice(['jsonl', 'csv', 'ics']), 
+        help='the format to write, guessed from the extension of output if not given')
+@calendar_options
+@click.pass_context
+def export(ctx, start, end, output, fmt, calendars, all_calendars):
+    '''Exports events from a range of days to a JSON Lines, CSV or iCalendar file'''
+    s = dt_from_day(start)
+    e = dt_from_day(end)
+    if not s or not e:
+        print('Invalid date. Must either be a day of the week or of the form YYYY-MM-DD.')
+        return 1
+
+    if not s <= e:
+        print('Invalid date range. Please make sure your range is in order.')
+        return 2
+
+    if not fmt:
+        fmt = os.path.splitext(output)[1].lstrip('.').lower()
+        if fmt == 'json':
+            fmt = 'jsonl'
+        if fmt not in ['jsonl', 'csv', 'ics']:
+            print('Unknown format. Use --format to choose between jsonl, csv and ics.')
+            return 1
+
+    calendar_ids = resolve_calendars(ctx.obj['service'], calendars, all_calendars)
+    if not calendar_ids:
+        print('Unknown calendar. Must either be the id or the name of a calendar.')
+        return 1
+
+    items = iter_events_from_calendars(ctx.obj['service'], get_min_time(s), get_max_time(e), calendar_ids)
+    if output == '-':
+        count = export_events(items, sys.stdout, fmt)
+    else:
+        with open(output, 'w', newline='', encoding='utf-8') as f:
+            count = export_events(items, f, fmt)
+        print(f'Exported {count} event(s) to {output}.')
+    return 0
+
+@cli.command(name='import')
+@click.argument('filename', type=str)
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'ics']),
+        help='the format of the file, guessed from its extension if not given')
+@click.option('--calendar', 'calendar', default='primary', help='the id or name of the calendar to import to')
+@click.option('--rate', default=quota_per_second, show_default=f'GCALENDAR_QUOTA or {QUOTA_PER_SECOND}', type=click.FloatRange(min=0, min_open=True),
+        help='the most events to send per second')
+@click.pass_context
+def import_file(ctx, filename, fmt, calendar, rate):
+    '''Imports events from a CSV or iCalendar file'''
+    if not os.path.isfile(filename):
+        print(f'{filename} does not exist.')
+        return 4
+
+    if not fmt:
+        fmt = os.path.splitext(filename)[1].lstrip('.').lower()
+        if fmt == 'ical':
+            fmt = 'ics'
+        if fmt not in ['csv', 'ics']:
+            print('Unknown format. Use --format to choose between csv and ics.')
+            return 1
+
+    calendar_ids = resolve_calendars(ctx.obj['service'], (calendar,))
+    if not calendar_ids:
+        print('Unknown calendar. Must either be the id or the name of a calendar.')
+        return 1
+
+    template = os.path.basename(filename)
+    #send at most a second's worth of events at a time so the requests are
+    #spread out evenly instead of going out in bursts
+    chunk = max(1, min(BATCH_SIZE * BATCH_WORKERS, int(rate)))
+    imported = 0
+    failed = []
+    started = time.monotonic()
+    with open(filename, 'r', newline='', encoding='utf-8-sig') as f:
+        events = iter_csv_events(f) if fmt == 'csv' else iter_ics_events(f)
+        try:
+            while True:
+                part = [*itertools.islice(events, chunk)]
+                if not part:
+                    break
+                mutations = plan_import(part, template, calendar_ids[0], imported + len(failed))
+                part_failed = run_mutations(ctx.obj['service'], mutations)
+                failed.extend(part_failed)
+                imported += len(part) - len(part_failed)
+                print(f'Imported {imported} event(s), {len(failed)} failed.')
+
+                #stay under the rate limit
+                ahead = (imported + len(failed)) / rate - (time.monotonic() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+        except (KeyError, ValueError) as e:
+            print(f'Could not read {filename}: {e}')
+            return 1
+
+    for mutation, exception in failed:
+        body = mutation['body']
+        start = body['start'].get('dateTime', body['start'].get('date'))
+        print(f'Failed: {body.get("summary", "(No title)")} ({start}): {exception}')
+    print(f'Imported {imported} event(s) from {filename}.')
+    if failed:
+        return 5
+    return 0
+
 @cli.command()
 def list_schedules():
     '''Lists all of the schedules that are currently saved'''
@@ -896,25 +4246,32 @@ def spawn():
     webbrowser.open('https://calendar.google.com/calendar', new=0, autoraise=True)
 
 @cli.command()
-@click.option('-ci', '--client_id', default=None, help='Your client ID')
-@click.option('-cs', '--client_secret', default=None, help='Your client Secret')
-def authorize(client_id, client_secret):
+@click.option('-ci', '--client_id', required=True, help='The client ID of your GCP project')
+@click.option('-cs', '--client_secret', required=True, help='The client Secret of your GCP project')
+@click.option('--profile', default=DEFAULT_PROFILE, show_default=True,
+        help='a name for the account, so several accounts can be authorized')
+def authorize(client_id, client_secret, profile):
     '''Authorizes credentials for Google Api'''
+    if not is_profile_name(profile):
+        print_invalid_profile(profile)
+        return 1
 
-    #workaround for oauth2 cuz the developers used argparse for some reason
-    #first argument is deleted so argparse doesn't take "authorize" as an argument
-    del sys.argv[0]
-
-    tools.argparser.add_argument('-ci', '--client-id', type=str, required=True, help='The client ID of your GCP project')
-    tools.argparser.add_argument('-cs', '--client-secret', type=str, required=True,
-                             help='The client Secret of your GCP project')
-    
-    store = file.Storage(FILE_DIRECTORY + '\\token.json')
-    #creds = store.get()
-    #if not creds or creds.invalid:
-    args = argparse.ArgumentParser(parents=[tools.argparser]).parse_args()
-    flow = client.OAuth2WebServerFlow(args.client_id, args.client_secret, SCOPES)
-    tools.run_flow(flow, store, tools.argparser.parse_args())
+    client_config = {
+        'installed': {
+            'client_id': client_id,
+            'client_secret': client_secret,
+            'auth_uri': 'https://accounts.google.com/o/oauth2/auth',
+            'token_uri': 'https://oauth2.googleapis.com/token',
+            'redirect_uris': ['http://localhost'],
+        }
+    }
+    flow = InstalledAppFlow.from_client_config(client_config, SCOPES)
+    creds = flow.run_local_server(port=0)
+    if profile != DEFAULT_PROFILE:
+        os.makedirs(PROFILE_DIRECTORY, exist_ok=True)
+    token_file = profile_files(profile)[0]
+    with FileLock(token_file), atomic_write(token_file) as f:
+        f.write(creds.to_json())
 
     return 0
 
@@ -922,39 +4279,56 @@ def authorize(client_id, client_secret):
 @cli.command()
 @click.argument('color', type=str)
 @click.argument('day', type=str)
+@click.option('--rollups', is_flag=True, help='answers from the local copy made by sync instead of Google Calendar')
+@calendar_options
+@account_options
 @click.pass_context
-def sum(ctx, color, day):
+def sum(ctx, color, day, rollups, calendars, all_calendars, accounts):
     "Sums the total amount of time spent during events of a certain color"
     if color not in COLOR_MAP.keys():
         print("color is not valid. Must be either 'red', 'green', 'blue', 'orange', or 'lavender'")
         return 1
 
     dt = dt_from_day(day)
-    events = get_events(ctx.obj['service'], dt)
+    if accounts:
+        accounts = parse_accounts(accounts)
+        if not accounts:
+            return 1
+        return print_account_totals(ctx.obj, accounts, COLOR_MAP[color], dt, dt, rollups, calendars, all_calendars)
+
+    if rollups:
+        store, calendar_ids = stored_calendars(calendars, all_calendars, ctx.obj.get('profile'))
+        if not store:
+            return 6
+        print(format_duration(store.total(COLOR_MAP[color], dt, dt, calendar_ids)))
+        store.close()
+        return 0
+
+    calendar_ids = resolve_calendars(ctx.obj['service'], calendars, all_calendars)
+    if not calendar_ids:
+        print('Unknown calendar. Must either be the id or the name of a calendar.')
+        return 1
+
+    events = get_events_from_calendars(ctx.obj['service'], dt, calendar_ids)
     if not events:
         print('No events found.')
         return 3
-    td = datetime.timedelta()
-    for e in events:
-        event_color = e.get('colorId', '')
-        if event_color == COLOR_MAP[color]:
-            st, et = get_start_and_end(e)
-            if dateobj_from_dt(st) < dateobj_from_dt(dt):
-                td = td + (et - get_min_time(et))
-            elif dateobj_from_dt(dt) < dateobj_from_dt(et):
-                td = td + (get_max_time(st) - st)
-            else:
-                td = td + get_event_time(e)
-        
-    print(f'{int(td.total_seconds() // 3600)} hour(s) and {int((td.total_seconds() - (td.total_seconds()//3600)*3600) / 60)} minutes')
+    tree = IntervalTree(event_intervals(events))
+    td = tree.clipped_time(get_min_time(dt), get_min_time(dt) + ONE_DAY,
+                           lambda event: event.get('colorId', '') == COLOR_MAP[color])
+
+    print(format_duration(td))
 
 
 @cli.command()
 @click.argument('color', type=str)
 @click.argument('start', type=str)
 @click.argument('end', type=str)
+@click.option('--rollups', is_flag=True, help='answers from the local copy made by sync instead of Google Calendar')
+@calendar_options
+@account_options
 @click.pass_context
-def bigsum(ctx, color, start, end):
+def bigsum(ctx, color, start, end, rollups, calendars, all_calendars, accounts):
     if color not in COLOR_MAP.keys():
         print("color is not valid. Must be either 'red', 'green', 'blue', 'orange', or 'lavender'")
         return 1
@@ -969,25 +4343,406 @@ def bigsum(ctx, color, start, end):
     if not s < e:
         print('Invalid date range. Please make sure your range is in order.')
         return 2
+
+    if accounts:
+        accounts = parse_accounts(accounts)
+        if not accounts:
+            return 1
+        return print_account_totals(ctx.obj, accounts, COLOR_MAP[color], s, e, rollups, calendars, all_calendars)
+
+    if rollups:
+        store, calendar_ids = stored_calendars(calendars, all_calendars, ctx.obj.get('profile'))
+        if not store:
+            return 6
+        print(format_duration(store.total(COLOR_MAP[color], s, e, calendar_ids)))
+        store.close()
+        return 0
+
+    calendar_ids = resolve_calendars(ctx.obj['service'], calendars, all_calendars)
+    if not calendar_ids:
+        print('Unknown calendar. Must either be the id or the name of a calendar.')
+        return 1
+
+    print(format_duration(color_time(ctx.obj['service'], COLOR_MAP[color], s, e, calendar_ids)))
+
+
+@cli.command()
+@calendar_options
+@click.pass_context
+def sync(ctx, calendars, all_calendars):
+    '''Updates the local copy of calendars used by report and --rollups'''
+    calendar_ids = resolve_calendars(ctx.obj['service'], calendars, all_calendars)
+    if not calendar_ids:
+        print('Unknown calendar. Must either be the id or the name of a calendar.')
+        return 1
+
+    store = EventStore(profile_files(ctx.obj.get('profile'))[1])
+    try:
+        for summary, changed in sync_calendars(ctx.obj['service'], store, calendar_ids).items():
+            print(f'{summary}: {changed} change(s)')
+    finally:
+        store.close()
+    return 0
+
+@cli.command()
+@click.argument('start', type=str)
+@click.argument('end', type=str)
+@click.option('--by', 'period', type=click.Choice(['day', 'week', 'month']), default='week', show_default=True,
+        help='how to group the totals')
+@calendar_options
+@account_options
+@click.pass_context
+def report(ctx, start, end, period, calendars, all_calendars, accounts):
+    '''Shows the time spent in each color over a range of synced days'''
+    s = dt_from_day(start)
+    e = dt_from_day(end)
+
+    if not s or not e:
+        print('Invalid date. Must either be a day of the week or of the form YYYY-MM-DD.')
+        return 1
     
-    td = datetime.timedelta()
-    for dt in get_day_range(s, e):
-        events = get_events(ctx.obj['service'], dt)
-        if not events:
+    if not s < e:
+        print('Invalid date range. Please make sure your range is in order.')
+        return 2
+
+    if accounts:
+        accounts = parse_accounts(accounts)
+        if not accounts:
+            return 1
+    else:
+        accounts = [ctx.obj.get('profile', DEFAULT_PROFILE)]
+
+    #the totals of every account are added up
+    totals = {}
+    for account in accounts:
+        store, calendar_ids = stored_calendars(calendars, all_calendars, account)
+        if not store:
+            return 6
+        for p, color_id, td in store.report(s, e, calendar_ids, period):
+            totals[(p, color_id)] = totals.get((p, color_id), datetime.timedelta()) + td
+        store.close()
+    rows = [(p, color_id, td) for (p, color_id), td in sorted(totals.items())]
+    if not rows:
+        print('No events found.')
+        return 3
+
+    names = {v: k for k, v in COLOR_MAP.items()}
+    for p, color_id, td in rows:
+        print(f'{p:<10}  {names.get(color_id, "color " + color_id):<9}  {format_duration(td)}')
+    return 0
+
+@cli.command()
+@click.argument('text', type=str, required=False)
+@click.option('--color', type=str, help='only shows events of this color')
+@click.option('--from', 'start', type=str, help='only shows events from this day on')
+@click.option('--to', 'end', type=str, help='only shows events up to this day')
+@calendar_options
+@click.pass_context
+def search(ctx, text, color, start, end, calendars, all_calendars):
+    '''Searches the local copy for events
+
+    Every word of TEXT has to appear in the title, description or location
+    of an event. Every synced calendar is searched unless --calendar is
+    given.
+    '''
+    if color and color not in COLOR_MAP.keys():
+        print("color is not valid. Must be either 'red', 'green', 'blue', 'orange', or 'lavender'")
+        return 1
+
+    dts = []
+    for day in [start, end]:
+        dts.append(dt_from_day(day) if day else None)
+        if day and not dts[-1]:
+            print('Invalid date. Must either be a day of the week or of the form YYYY-MM-DD.')
+            return 1
+
+    store, calendar_ids = stored_calendars(calendars, all_calendars or not calendars, ctx.obj.get('profile'))
+    if not store:
+        return 6
+    results = store.search(text, COLOR_MAP[color] if color else None, calendar_ids, *dts)
+    store.close()
+    if not results:
+        print('No events found.')
+        return 3
+
+    for calendar_id, event in results:
+        if 'dateTime' in event['start']:
+            start_dt = get_start_and_end(event)[0]
+            when = f'{date_from_dt(start_dt)} {format_time(start_dt):>7}'
+        else:
+            when = f'{event["start"]["date"]} {"all day":>7}'
+        line = f'{when}  {event.get("summary", "(No title)")}'
+        if len(calendar_ids) > 1:
+            line += f'  ({calendar_id})'
+        print(line)
+    return 0
+
+@cli.command()
+@click.argument('start', type=str)
+@click.argument('end', type=str, required=False)
+@click.option('--min', 'minutes', default=30, show_default=True, help='the shortest free slot to show, in minutes')
+@click.option('--hours', type=str, help='only looks within these hours of each day, e.g. 9:00-17:00')
+@click.option('--weekdays', is_flag=True, help='leaves out Saturdays and Sundays')
+@click.option('--local', is_flag=True, help='answers from the local copy made by sync instead of Google Calendar')
+@calendar_options
+@account_options
+@click.pass_context
+def free(ctx, start, end, minutes, hours, weekdays, local, calendars, all_calendars, accounts):
+    '''Shows when you are free from one day to another
+
+    A slot is only free if it is free in every calendar (and every account
+    of --accounts).
+    '''
+    s = dt_from_day(start)
+    e = dt_from_day(end) if end else s
+    if not s or not e:
+        print('Invalid date. Must either be a day of the week or of the form YYYY-MM-DD.')
+        return 1
+
+    if e < s:
+        print('Invalid date range. Please make sure your range is in order.')
+        return 2
+
+    if hours:
+        hours = parse_hours(hours)
+        if not hours:
+            print('Invalid hours. Must be of the form 9:00-17:00.')
+            return 1
+
+    profiles = [ctx.obj.get('profile', DEFAULT_PROFILE)]
+    if accounts:
+        profiles = parse_accounts(accounts)
+        if not profiles:
+            return 1
+
+    intervals = []
+    if local:
+        for profile in profiles:
+            store, calendar_ids = stored_calendars(calendars, all_calendars, profile)
+            if not store:
+                return 6
+            intervals.extend(store.busy_intervals(s, e, calendar_ids))
+            store.close()
+    else:
+        def busy(service):
+            calendar_ids = resolve_calendars(service, calendars, all_calendars)
+            if not calendar_ids:
+                return (None, None)
+            return (calendar_ids, get_busy_intervals(service, s, e, calendar_ids))
+
+        results = run_for_accounts(ctx.obj, profiles, busy)
+        if results is None:
+            return 1
+        for calendar_ids, result in results.values():
+            if not calendar_ids:
+                print('Unknown calendar. Must either be the id or the name of a calendar.')
+                return 1
+            if result is None:
+                print('Could not get the busy times of every calendar.')
+                return 1
+            intervals.extend(result)
+
+    slots = free_slots(merge_intervals(intervals), s, e, datetime.timedelta(minutes=minutes), hours, weekdays)
+    if not slots:
+        print('No free time found.')
+        return 3
+    print_free_slots(slots)
+    return 0
+
+@cli.command()
+@click.argument('address', type=str)
+@click.option('--port', default=WATCH_PORT, show_default=True, help='the port to receive notifications on')
+@calendar_options
+@click.pass_context
+def watch(ctx, address, port, calendars, all_calendars):
+    '''Keeps the local copy up to date as calendars change
+
+    Google Calendar sends a notification to ADDRESS whenever a calendar
+    changes, and only then is it synced. ADDRESS has to be a public HTTPS
+    address that is forwarded to --port on this machine.
+    '''
+    if not ctx.obj:
+        return 1
+    service = ctx.obj['service']
+    calendar_ids = resolve_calendars(service, calendars, all_calendars)
+    if not calendar_ids:
+        print('Unknown calendar. Must either be the id or the name of a calendar.')
+        return 1
+
+    entries = {c['id']: c for c in get_calendar_entries(service, calendar_ids)}
+    token = base64.b32hexencode(os.urandom(20)).decode().lower()
+    store = EventStore(profile_files(ctx.obj.get('profile'))[1])
+    receiver = NotificationReceiver(port=port, token=token)
+    receiver.start()
+    channels = {}
+    #the failed attempts and the time of the next try of each calendar
+    retries = {}
+    renewals = {}
+
+    def retry_later(attempts, calendar_id, action, e):
+        count = attempts.get(calendar_id, (0, 0))[0] + 1
+        delay = min(2 ** count, WATCH_RETRY_MAX)
+        attempts[calendar_id] = (count, time.time() + delay)
+        name = entries[calendar_id].get('summary', calendar_id)
+        print(f'{datetime.datetime.now():%H:%M:%S} {name}: could not {action} ({e}), trying again in {delay} seconds')
+        sys.stdout.flush()
+
+    def renew_channels():
+        #reopen channels before they expire, and return the calendars that
+        #had no open channel, since their changes may have been missed
+        now = time.time()
+        reopened = set()
+        for calendar_id in entries:
+            old = channels.get(calendar_id)
+            if old and int(old['expiration']) / 1000 - now > WATCH_MARGIN:
+                continue
+            if renewals.get(calendar_id, (0, 0))[1] > now:
+                continue
+            try:
+                channel = watch_calendar(service, calendar_id, address, token)
+            except (HttpError, OSError) as e:
+                retry_later(renewals, calendar_id, 'open a channel', e)
+                continue
+            renewals.pop(calendar_id, None)
+            receiver.add_channel(channel['id'], calendar_id)
+            channels[calendar_id] = channel
+            if not old or int(old['expiration']) / 1000 <= now:
+                reopened.add(calendar_id)
+            if old:
+                receiver.remove_channel(old['id'])
+                try:
+                    stop_channel(service, old)
+                except (HttpError, OSError):
+                    pass #it expires on its own
+        return reopened
+
+    def sync(calendar_id):
+        entry = entries[calendar_id]
+        try:
+            changed = store.sync(service, entry)
+        except (HttpError, OSError) as e:
+            retry_later(retries, calendar_id, 'sync', e)
+            return
+        retries.pop(calendar_id, None)
+        print(f'{datetime.datetime.now():%H:%M:%S} {entry.get("summary", calendar_id)}: {changed} change(s)')
+        sys.stdout.flush()
+
+    try:
+        #open the channels first so no change made during the first sync is missed
+        renew_channels()
+        for calendar_id in entries:
+            sync(calendar_id)
+        print(f'Listening for changes on port {receiver.port}')
+        sys.stdout.flush()
+
+        while True:
+            reopened = renew_channels()
+            wakeups = [int(c['expiration']) / 1000 - WATCH_MARGIN for c in channels.values()]
+            wakeups.extend(at for attempts, at in [*retries.values(), *renewals.values()])
+            changed = set(receiver.changed(max(min(wakeups) - time.time(), 0)))
+            now = time.time()
+            changed.update(reopened)
+            changed.update(c for c, (attempts, at) in retries.items() if at <= now)
+            for calendar_id in changed:
+                sync(calendar_id)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for channel in channels.values():
+            try:
+                stop_channel(service, channel)
+            except HttpError:
+                pass
+        receiver.stop()
+        store.close()
+    return 0
+
+
+@cli.command()
+@click.option('--socket', 'socket_path', default=SOCKET_FILE, help='the path of the socket to listen on')
+@click.pass_context
+def daemon(ctx, socket_path):
+    '''Keeps a session running in the background for other commands'''
+    if not ctx.obj:
+        return 1
+    if not hasattr(socket, 'AF_UNIX'):
+        print('The daemon is not supported on this platform.')
+        return 1
+    sock = connect_to_daemon(socket_path)
+    if sock:
+        sock.close()
+        print('The daemon is already running.')
+        return 2
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+
+    enable_event_cache()
+    server = make_daemon_server(socket_path, ctx.obj)
+    os.chmod(socket_path, 0o600)
+    print(f'Listening on {socket_path}')
+    sys.stdout.flush()
+    streams = (sys.stdin, sys.stdout, sys.stderr)
+    sys.stdin, sys.stdout, sys.stderr = (_ThreadStream(stream) for stream in streams)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sys.stdin, sys.stdout, sys.stderr = streams
+        server.server_close()
+        os.remove(socket_path)
+        close_sessions(ctx.obj)
+    return 0
+
+@cli.command()
+@click.pass_context
+def shell(ctx):
+    '''Runs commands one after another in a single session'''
+    if not ctx.obj:
+        return 1
+
+    if readline:
+        readline.set_completer(complete_shell)
+        readline.set_completer_delims(' \t')
+        readline.parse_and_bind('tab: complete')
+        if os.path.isfile(HISTORY_FILE):
+            readline.read_history_file(HISTORY_FILE)
+
+    enable_event_cache()
+    print('Type a command without "gcalendar" in front of it, or "exit" to quit.')
+    while True:
+        try:
+            line = input('gcalendar> ').strip()
+        except EOFError:
+            print()
+            break
+        except KeyboardInterrupt:
+            print()
             continue
-        for e in events:
-            event_color = e.get('colorId', '')
-            if event_color == COLOR_MAP[color]:
-                st, et = get_start_and_end(e)
-                if dateobj_from_dt(st) < dateobj_from_dt(dt):
-                    td = td + (et - get_min_time(et))
-                elif dateobj_from_dt(dt) < dateobj_from_dt(et):
-                    td = td + (get_max_time(st) - st)
-                else:
-                    td = td + get_event_time(e)
-        
-    print(f'{int(td.total_seconds() // 3600)} hour(s) and {int((td.total_seconds() - (td.total_seconds()//3600)*3600) / 60)} minutes')
 
+        if not line:
+            continue
+        if line in ['exit', 'quit']:
+            break
+        try:
+            args = shlex.split(line)
+        except ValueError as e:
+            print(e)
+            continue
+        if args[0] in ['daemon', 'shell', 'watch']:
+            print(f'{args[0]} can\'t be run from the shell.')
+            continue
+        try:
+            run_command(args, ctx.obj)
+        except Exception as e:
+            #keep the session, like the daemon does
+            print(f'{type(e).__name__}: {e}')
+
+    if readline:
+        readline.write_history_file(HISTORY_FILE)
+    close_sessions(ctx.obj)
+    return 0
 
 '''@cli.command()
 @click.pass_context
@@ -1007,4 +4762,10 @@ def printev(ctx, dt1, dt2):
     print(get_multiple_events(ctx.obj['service'], dr))'''
 
 if __name__ == '__main__':
-    cli()
+    #the gcalendar command goes through gcalendar_client.main instead
+    code = None
+    if can_forward(sys.argv[1:]):
+        code = forward_to_daemon(sys.argv[1:])
+    if code is None:
+        code = run_command(sys.argv[1:], None)
+    sys.exit(code)
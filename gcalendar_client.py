@@ -0,0 +1,118 @@
+import json
+import os
+import pathlib
+import socket
+import sys
+
+#The entry point of the gcalendar command. Commands are sent to the daemon
+#(see gcalendar.daemon) when one is running, before gcalendar and the Google
+#libraries it needs are imported, since importing them takes most of the
+#time of a short command.
+
+FILE_DIRECTORY = str(pathlib.Path(__file__).parent)
+SOCKET_FILE = os.path.join(FILE_DIRECTORY, 'gcalendar.sock')
+
+#The profile that uses TOKEN_FILE and STORE_FILE
+DEFAULT_PROFILE = 'default'
+
+#Commands that always run in their own process instead of on the daemon
+LOCAL_COMMANDS = ['authorize', 'daemon', 'shell', 'spawn', 'watch']
+
+#Options of the gcalendar group that are followed by a value
+GROUP_OPTIONS = ['--pool-size', '--profile']
+
+def connect_to_daemon(socket_path=SOCKET_FILE):
+    '''Connects to the daemon if one is running
+
+    Parameters:
+        socket_path (str): the path of the daemon's socket
+
+    Returns:
+        socket.socket: a connected socket, or None if no daemon is running
+    '''
+    if not hasattr(socket, 'AF_UNIX') or not os.path.exists(socket_path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+def forward_to_daemon(args, socket_path=SOCKET_FILE):
+    '''Runs a command on the daemon if one is running
+
+    Parameters:
+        args (list): the command line arguments, without the program name
+        socket_path (str): the path of the daemon's socket
+
+    Returns:
+        int: the exit code of the command, or None if no daemon is running
+    '''
+    sock = connect_to_daemon(socket_path)
+    if not sock:
+        return None
+
+    with sock, sock.makefile('rwb') as f:
+        f.write((json.dumps({'args': args, 'cwd': os.getcwd()}) + '\n').encode())
+        f.flush()
+        for line in f:
+            message = json.loads(line)
+            sys.stdout.write(message.get('output', ''))
+            sys.stdout.flush()
+            if message.get('prompt'):
+                answer = sys.stdin.readline()
+                f.write((json.dumps({'answer': answer}) + '\n').encode())
+                f.flush()
+            if 'code' in message:
+                return message['code']
+    return 1
+
+def can_forward(args):
+    '''Returns whether or not a command can be run on the daemon
+
+    Only commands of the default profile are sent to the daemon. Local
+    commands, help and anything that isn't understood here are left to
+    gcalendar itself.
+
+    Parameters:
+        args (list): the command line arguments, without the program name
+
+    Returns:
+        bool: True if the command can be sent to the daemon
+    '''
+    profile = os.environ.get('GCALENDAR_PROFILE', DEFAULT_PROFILE)
+    i = 0
+    while i < len(args) and args[i].startswith('-'):
+        name, equals, value = args[i].partition('=')
+        if name not in GROUP_OPTIONS:
+            return False
+        if not equals:
+            i += 1
+            if i == len(args):
+                return False
+            value = args[i]
+        if name == '--profile':
+            profile = value
+        i += 1
+    return i < len(args) and args[i] not in LOCAL_COMMANDS and profile == DEFAULT_PROFILE
+
+def main(args=None):
+    '''Runs a gcalendar command and exits with its exit code
+
+    Parameters:
+        args (list): the command line arguments, without the program name
+    '''
+    if args is None:
+        args = sys.argv[1:]
+    if can_forward(args):
+        code = forward_to_daemon(args, SOCKET_FILE)
+        if code is not None:
+            sys.exit(code)
+
+    import gcalendar
+    sys.exit(gcalendar.run_command(args, None))
+
+if __name__ == '__main__':
+    main()
@@ -3,18 +3,20 @@ from setuptools import setup
 setup(
     name='gcalendar',
     version='1.0',
-    py_modules=['gcalendar'],
+    py_modules=['gcalendar', 'gcalendar_client'],
     description='A command line tool for Google Calendar using python',
     author='iCodeCoolStuff',
     license='MIT',
     install_requires=[
         'click', 
         'google-api-python-client', 
-        'oauth2client',
+        'google-auth',
+        'google-auth-httplib2',
+        'google-auth-oauthlib',
     ],
     entry_points={
         'console_scripts': [
-            'gcalendar=gcalendar:cli'
+            'gcalendar=gcalendar_client:main'
         ],
     },
 )
@@ -1,15 +1,46 @@
 import calendar
+import contextlib
+import csv
 import datetime
+import heapq
+import io
+import json
+import os
 import pprint
+import shutil
+import tempfile
 import unittest
+import urllib.error
+import urllib.parse
+import urllib.request
 import re
+import socket
+import sys
+import threading
 import time
 
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+
 from googleapiclient.discovery import build
-from httplib2 import Http
-from oauth2client import file, client, tools
 
 import gcalendar
+import gcalendar_client
+
+@contextlib.contextmanager
+def local_timezone(name):
+    tz = os.environ.get('TZ')
+    os.environ['TZ'] = name
+    time.tzset()
+    try:
+        yield
+    finally:
+        if tz is None:
+            del os.environ['TZ']
+        else:
+            os.environ['TZ'] = tz
+        time.tzset()
 
 class TestTimeFunctions(unittest.TestCase):
 
@@ -33,6 +64,13 @@ class TestTimeFunctions(unittest.TestCase):
         nowtd = datetime.timedelta(hours=5)
         self.assertEqual(gcalendar.gmt(now), now - nowtd)
 
+    @unittest.skipUnless(hasattr(time, 'tzset'), 'needs time.tzset')
+    def test_to_local(self):
+        with local_timezone('America/New_York'):
+            self.assertEqual(gcalendar.to_local('2020-12-01T14:00:00Z'), datetime.datetime(2020, 12, 1, 9))
+            self.assertEqual(gcalendar.to_local('2020-07-01T14:00:00Z'), datetime.datetime(2020, 7, 1, 10))
+            self.assertEqual(gcalendar.to_local('2020-07-01T14:00:00-07:00'), datetime.datetime(2020, 7, 1, 17))
+
     def test_dt_to_POSIX(self):
         dt = datetime.datetime.now() 
         self.assertEqual(gcalendar.dt_to_POSIX(dt), calendar.timegm(dt.timetuple()))
@@ -55,6 +93,13 @@ class TestTimeFunctions(unittest.TestCase):
         for i in range(len(week)):
             self.assertEqual(gcalendar.get_days_of_week(week[i]), week)
     
+    def test_get_days_of_week_every_day(self):
+        for dt in gcalendar.get_day_range(datetime.datetime(2019, 12, 25), datetime.datetime(2021, 1, 5)):
+            week = gcalendar.get_days_of_week(dt + datetime.timedelta(hours=15))
+            self.assertEqual(week[0].weekday(), 6)
+            self.assertIn(dt, week)
+            self.assertEqual(week, gcalendar.get_day_range(week[0], week[6]))
+
     def test_get_current_week(self):
         today = datetime.datetime.now()
         week = gcalendar.get_current_week()
@@ -70,12 +115,9 @@ class TestEventFunctions(unittest.TestCase):
 
     def setUp(self):
         #build service if doesn't already exist
-        store = file.Storage('token.json')
-        creds = store.get()
-        if not creds or creds.invalid:
-            flow = client.flow_from_clientsecrets('credentials.json', 'https://www.googleapis.com/auth/calendar')
-            creds = tools.run_flow(flow, store)
-        self.service = build('calendar', 'v3', http=creds.authorize(Http()))
+        manager = gcalendar.CredentialManager('token.json')
+        manager.refresh()
+        self.service = build('calendar', 'v3', http=gcalendar.PooledHttp(manager.credentials))
 
         #new events for a random date
         self.dt = datetime.datetime(2020, 1, 2)
@@ -126,6 +168,907 @@ class TestEventFunctions(unittest.TestCase):
     '''
     
 
+class TestCalendarFunctions(unittest.TestCase):
+
+    def test_event_start_key(self):
+        allday = {'start': {'date': '2020-01-02'}}
+        morning = {'start': {'dateTime': '2020-01-02T09:00:00-05:00'}}
+        evening = {'start': {'dateTime': '2020-01-02T18:30:00-05:00'}}
+        events = sorted([evening, morning, allday], key=gcalendar.event_start_key)
+        self.assertEqual(events, [allday, morning, evening])
+
+        #09:00 in Los Angeles is after 10:00 in New York
+        west = {'start': {'dateTime': '2020-01-02T09:00:00-08:00'}}
+        east = {'start': {'dateTime': '2020-01-02T10:00:00-05:00'}}
+        utc = {'start': {'dateTime': '2020-01-02T16:00:00Z'}}
+        merged = [*heapq.merge([west], [east, utc], key=gcalendar.event_start_key)]
+        self.assertEqual(merged, [east, utc, west])
+
+    def test_merge_intervals(self):
+        intervals = [(5, 7), (1, 3), (2, 4), (7, 8), (10, 11)]
+        self.assertEqual(gcalendar.merge_intervals(intervals), [(1, 4), (5, 8), (10, 11)])
+
+    def test_parse_hours(self):
+        hour = datetime.timedelta(hours=1)
+        self.assertEqual(gcalendar.parse_hours('9-17'), (9*hour, 17*hour))
+        self.assertEqual(gcalendar.parse_hours('8:30 - 24:00'), (8.5*hour, 24*hour))
+        self.assertIsNone(gcalendar.parse_hours('17-9'))
+        self.assertIsNone(gcalendar.parse_hours('9:75-17'))
+        self.assertIsNone(gcalendar.parse_hours('morning'))
+
+    def test_free_slots(self):
+        day = datetime.datetime(2020, 1, 3) #a Friday
+        hour = datetime.timedelta(hours=1)
+        busy = gcalendar.merge_intervals([
+            (day + 8*hour, day + 10*hour),
+            (day + 12*hour, day + 12.5*hour),
+            (day + 16.75*hour, day + 24*hour + 8*hour),
+        ])
+        self.assertEqual(gcalendar.free_slots(busy, day, day), [
+            (day, day + 8*hour), (day + 10*hour, day + 12*hour), (day + 12.5*hour, day + 16.75*hour)])
+
+        monday = day + 3*24*hour
+        slots = gcalendar.free_slots(busy, day, monday, hour, (9*hour, 17*hour), weekdays=True)
+        self.assertEqual(slots, [
+            (day + 10*hour, day + 12*hour), (day + 12.5*hour, day + 16.75*hour), (monday + 9*hour, monday + 17*hour)])
+
+        slots = gcalendar.free_slots(busy, day, day + 24*hour, 12*hour)
+        self.assertEqual(slots, [(day + 32*hour, day + 48*hour)])
+
+    def test_interval_tree(self):
+        intervals = [(0, 10, 'a'), (2, 4, 'b'), (5, 6, 'c'), (9, 12, 'd'), (20, 25, 'e')]
+        tree = gcalendar.IntervalTree(intervals)
+        for start, end in [(0, 1), (3, 5), (6, 9), (10, 20), (12, 20), (4, 5), (0, 30)]:
+            expected = sorted(i for i in intervals if i[0] < end and i[1] > start)
+            self.assertEqual(sorted(tree.overlapping(start, end)), expected)
+
+    def test_clipped_time(self):
+        day = datetime.datetime(2020, 1, 2)
+        hour = datetime.timedelta(hours=1)
+        intervals = [
+            (day - 2*hour, day + 3*hour, 'blue'),
+            (day + 20*hour, day + 30*hour, 'blue'),
+            (day + 5*hour, day + 6*hour, 'red'),
+        ]
+        tree = gcalendar.IntervalTree(intervals)
+        self.assertEqual(tree.clipped_time(day, day + 24*hour, lambda c: c == 'blue'), 7*hour)
+        self.assertEqual(tree.clipped_time(day + 24*hour, day + 48*hour), 6*hour)
+
+    def test_changed_fields(self):
+        event = {
+            'id': 'abc', 'summary': 'Standup', 'colorId': '7', 'updated': '2020-01-01T00:00:00Z',
+            'start': {'dateTime': '2020-01-02T09:00:00-05:00'}, 'end': {'dateTime': '2020-01-02T09:15:00-05:00'},
+        }
+        body = {
+            'id': 'abc', 'summary': 'Standup', 'colorId': '7', 'updated': '2019-12-01T00:00:00Z',
+            'start': {'dateTime': '2020-01-02T14:00:00Z'}, 'end': {'dateTime': '2020-01-02T14:15:00Z'},
+        }
+        self.assertEqual(gcalendar.changed_fields(event, body), {})
+
+        body = dict(body, summary='Daily standup', end={'dateTime': '2020-01-02T14:30:00Z'})
+        del body['colorId']
+        self.assertEqual(gcalendar.changed_fields(event, body),
+                {'summary': 'Daily standup', 'colorId': None, 'end': {'dateTime': '2020-01-02T14:30:00Z'}})
+
+    def test_shift_event(self):
+        event = {
+            'start': {'dateTime': '2020-01-31T09:00:00-05:00', 'timeZone': 'America/New_York'},
+            'end': {'dateTime': '2020-01-31T10:30:00-05:00', 'timeZone': 'America/New_York'},
+        }
+        self.assertEqual(gcalendar.shift_event(event, 2), {
+            'start': {'dateTime': '2020-02-02T09:00:00', 'timeZone': 'America/New_York'},
+            'end': {'dateTime': '2020-02-02T10:30:00', 'timeZone': 'America/New_York'},
+        })
+
+        #across the start of daylight saving time the time zone picks the offset
+        self.assertEqual(gcalendar.shift_event(event, 37)['start'],
+                {'dateTime': '2020-03-08T09:00:00', 'timeZone': 'America/New_York'})
+
+        fixed = {'start': {'dateTime': '2020-03-06T09:00:00-05:00'}, 'end': {'dateTime': '2020-03-06T10:00:00Z'}}
+        self.assertEqual(gcalendar.shift_event(fixed, 3), {
+            'start': {'dateTime': '2020-03-09T09:00:00-05:00'}, 'end': {'dateTime': '2020-03-09T10:00:00Z'}})
+
+        allday = {'start': {'date': '2020-02-28'}, 'end': {'date': '2020-02-29'}}
+        self.assertEqual(gcalendar.shift_event(allday, -1),
+                {'start': {'date': '2020-02-27'}, 'end': {'date': '2020-02-28'}})
+
+    def test_multi_day_template(self):
+        def event(local):
+            return {'start': {'dateTime': gcalendar.RFC_from_UTC(gcalendar.gmt(local))},
+                    'end': {'dateTime': gcalendar.RFC_from_UTC(gcalendar.gmt(local + datetime.timedelta(hours=1)))}}
+        monday = datetime.datetime(2020, 1, 6)
+        events = [event(monday + datetime.timedelta(hours=9)), event(monday + datetime.timedelta(days=2, hours=9))]
+
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, 'week.json')
+            gcalendar.save_events(events, filename, monday, 7)
+            template = gcalendar.load_template(filename)
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual((template['start'], template['days']), (monday, 7))
+
+        target = monday + datetime.timedelta(days=7)
+        mutations = gcalendar.plan_upload(template['events'], target, origin=template['start'])
+        starts = [gcalendar.from_gmt(gcalendar.utctimestamp_to_dt(m['body']['start']['dateTime'])) for m in mutations]
+        self.assertEqual(starts, [target + datetime.timedelta(hours=9), target + datetime.timedelta(days=2, hours=9)])
+
+    def test_event_id(self):
+        dt = datetime.datetime(2020, 1, 2)
+        eid = gcalendar.event_id('week', 0, dt)
+        self.assertEqual(eid, gcalendar.event_id('week', 0, dt))
+        self.assertNotEqual(eid, gcalendar.event_id('week', 1, dt))
+        self.assertNotEqual(eid, gcalendar.event_id('week', 0, dt + datetime.timedelta(days=1)))
+        self.assertNotEqual(eid, gcalendar.event_id('week', 0, dt, 'other'))
+        self.assertRegex(eid, r'^[0-9a-v]{5,1024}$')
+
+    def test_group_by_day(self):
+        events = [
+            {'id': 'a', 'start': {'dateTime': '2020-01-01T22:00:00'}, 'end': {'dateTime': '2020-01-02T02:00:00'}},
+            {'id': 'b', 'start': {'dateTime': '2020-01-02T09:00:00'}, 'end': {'dateTime': '2020-01-02T10:00:00'}},
+            {'id': 'c', 'start': {'date': '2020-01-03'}, 'end': {'date': '2020-01-04'}},
+        ]
+        days = gcalendar.get_day_range(datetime.datetime(2020, 1, 1), datetime.datetime(2020, 1, 4))
+        grouped = gcalendar.group_by_day(events, days)
+        ids = {d: [e['id'] for e in grouped[d]] for d in grouped}
+        self.assertEqual(ids, {'2020-01-01': ['a'], '2020-01-02': ['a', 'b'], '2020-01-03': ['c'], '2020-01-04': []})
+
+    def test_render_events(self):
+        events = [
+            {'summary': 'Holiday', 'start': {'date': '2020-01-03'}, 'end': {'date': '2020-01-04'}},
+            {'start': {'dateTime': '2020-01-03T00:05:00-05:00'}, 'end': {'dateTime': '2020-01-03T01:00:00-05:00'}},
+            {'summary': 'Lunch', 'start': {'dateTime': '2020-01-03T12:30:00-05:00'}, 'end': {'dateTime': '2020-01-03T13:00:00-05:00'}},
+        ]
+        self.assertEqual(gcalendar.get_start_and_end(events[0]), (datetime.datetime(2020, 1, 3), datetime.datetime(2020, 1, 4)))
+        self.assertEqual(gcalendar.render_events(events), ['all day Holiday', '12:05am (No title)', '12:30pm Lunch'])
+
+    def test_estimate_job(self):
+        mutations = [{'action': 'insert'}] * 120 + [{'action': 'delete'}] * 30
+        calls = gcalendar.estimate_job({'list': 10}, mutations)
+        self.assertEqual(calls['insert'], 120)
+        self.assertEqual(calls['delete'], 30)
+        self.assertEqual(calls['batch'], 3)
+        self.assertGreaterEqual(calls['seconds'], 160 / gcalendar.QUOTA_PER_SECOND)
+
+    def test_quota_per_second(self):
+        quota = os.environ.pop('GCALENDAR_QUOTA', None)
+        try:
+            self.assertEqual(gcalendar.quota_per_second(), gcalendar.QUOTA_PER_SECOND)
+            os.environ['GCALENDAR_QUOTA'] = '2.5'
+            self.assertEqual(gcalendar.quota_per_second(), 2.5)
+            for value in ['ten', '0', '-1', 'nan', 'inf']:
+                os.environ['GCALENDAR_QUOTA'] = value
+                with self.assertRaises(click.ClickException):
+                    gcalendar.quota_per_second()
+        finally:
+            os.environ.pop('GCALENDAR_QUOTA', None)
+            if quota is not None:
+                os.environ['GCALENDAR_QUOTA'] = quota
+
+class FakeRequest:
+
+    def __init__(self, result):
+        self.result = result
+
+    def execute(self):
+        return self.result
+
+class FakeService:
+    '''Answers the calendar list and event list requests the cache makes'''
+
+    def __init__(self):
+        self.lists = []
+
+    def calendarList(self):
+        return self
+
+    def events(self):
+        return self
+
+    def list(self, calendarId=None, pageToken=None, **kwargs):
+        if calendarId is None:
+            return FakeRequest({'items': [{'id': 'me@example.com', 'primary': True}]})
+        self.lists.append(calendarId)
+        return FakeRequest({'items': [{'id': 'a', 'start': {'date': '2020-01-02'}}]})
+
+class TestEventCache(unittest.TestCase):
+
+    def setUp(self):
+        gcalendar.EVENT_CACHE = None
+        gcalendar.enable_event_cache()
+        self.service = FakeService()
+        self.day = datetime.datetime(2020, 1, 2)
+
+    def tearDown(self):
+        gcalendar.EVENT_CACHE = None
+
+    def test_cached(self):
+        with ThreadPoolExecutor(8) as executor:
+            [*executor.map(lambda i: gcalendar.get_events(self.service, self.day), range(8))]
+        gcalendar.get_events(self.service, self.day)
+        self.assertLessEqual(len(self.service.lists), 8)
+        calls = len(self.service.lists)
+        gcalendar.get_events(self.service, self.day)
+        self.assertEqual(len(self.service.lists), calls)
+
+        #other accounts are cached separately
+        other = FakeService()
+        gcalendar.get_events(other, self.day)
+        self.assertEqual(other.lists, ['primary'])
+
+    def test_uncached(self):
+        gcalendar.get_events(self.service, self.day)
+        gcalendar.get_events_by_calendar(self.service, self.day, ['primary'], cached=False)
+        self.assertEqual(self.service.lists, ['primary', 'primary'])
+
+        #the fresh day replaces the cached one
+        gcalendar.get_events(self.service, self.day)
+        self.assertEqual(len(self.service.lists), 2)
+
+    def test_invalidate_primary(self):
+        gcalendar.resolve_calendars(self.service, ('me@example.com',))
+        gcalendar.get_events(self.service, self.day, 'me@example.com')
+        gcalendar.invalidate_event_cache(self.service, 'primary')
+        gcalendar.get_events(self.service, self.day, 'me@example.com')
+        self.assertEqual(self.service.lists, ['me@example.com', 'me@example.com'])
+
+        gcalendar.get_events(self.service, self.day)
+        self.assertEqual(len(self.service.lists), 2)
+
+class TestExportFunctions(unittest.TestCase):
+
+    def setUp(self):
+        self.events = [
+            ('primary', {'id': 'a', 'summary': 'Standup, daily', 'colorId': '7',
+                'start': {'dateTime': '2020-01-02T09:00:00-05:00'}, 'end': {'dateTime': '2020-01-02T09:15:00-05:00'}}),
+            ('primary', {'id': 'b', 'summary': 'Holiday',
+                'start': {'date': '2020-01-03'}, 'end': {'date': '2020-01-04'}}),
+        ]
+
+    def test_export_csv(self):
+        f = io.StringIO(newline='')
+        self.assertEqual(gcalendar.export_events(self.events, f, 'csv'), 2)
+        rows = [*csv.reader(io.StringIO(f.getvalue()))]
+        self.assertEqual(rows[0], gcalendar.CSV_FIELDS)
+        self.assertEqual(rows[1][:6], ['primary', 'a', 'Standup, daily', '2020-01-02T09:00:00-05:00', 
+                                       '2020-01-02T09:15:00-05:00', 'no'])
+        self.assertEqual(rows[2][5], 'yes')
+
+    def test_export_ics(self):
+        f = io.StringIO(newline='')
+        gcalendar.export_events(self.events, f, 'ics')
+        lines = f.getvalue().split('\r\n')
+        self.assertIn('DTSTART:20200102T140000Z', lines)
+        self.assertIn('DTSTART;VALUE=DATE:20200103', lines)
+        self.assertIn('SUMMARY:Standup\\, daily', lines)
+        self.assertEqual(lines[-2], 'END:VCALENDAR')
+        stamps = [line for line in lines if line.startswith('DTSTAMP:')]
+        self.assertEqual(len(stamps), lines.count('BEGIN:VEVENT'))
+        self.assertTrue(all(re.fullmatch(r'DTSTAMP:\d{8}T\d{6}Z', line) for line in stamps))
+
+    def test_ics_fold(self):
+        folded = gcalendar.ics_fold('DESCRIPTION:' + 'x' * 100)
+        lines = folded.split('\r\n')
+        self.assertTrue(all(len(line) <= 75 for line in lines))
+        self.assertEqual(''.join(line[1:] if i else line for i, line in enumerate(lines)), 'DESCRIPTION:' + 'x' * 100)
+
+    def test_import_ics(self):
+        f = io.StringIO(newline='')
+        gcalendar.export_events(self.events, f, 'ics')
+        f.seek(0)
+        events = [*gcalendar.iter_ics_events(f)]
+        self.assertEqual(len(events), 2)
+        self.assertEqual(events[0]['summary'], 'Standup, daily')
+        self.assertEqual(events[0]['colorId'], '7')
+        self.assertEqual(events[0]['start'], {'dateTime': '2020-01-02T14:00:00+00:00'})
+        self.assertEqual(events[1]['end'], {'date': '2020-01-04'})
+
+    def test_import_recurring_ics(self):
+        f = io.StringIO('\r\n'.join([
+            'BEGIN:VCALENDAR', 'BEGIN:VEVENT', 'UID:weekly@example.com', 'SUMMARY:Weekly',
+            'DTSTART;TZID=America/New_York:20200106T090000', 'DTEND;TZID=America/New_York:20200106T093000',
+            'RRULE:FREQ=WEEKLY;BYDAY=MO;COUNT=10', 'EXDATE;TZID=America/New_York:20200113T090000',
+            'END:VEVENT', 'BEGIN:VEVENT', 'SUMMARY:Daily', 'DTSTART:20200106T140000Z',
+            'RRULE:FREQ=DAILY', 'END:VEVENT', 'END:VCALENDAR', '']))
+        weekly, daily = gcalendar.iter_ics_events(f)
+        self.assertEqual(weekly['recurrence'], [
+            'RRULE:FREQ=WEEKLY;BYDAY=MO;COUNT=10', 'EXDATE;TZID=America/New_York:20200113T090000'])
+        self.assertEqual(weekly['start'], {'dateTime': '2020-01-06T09:00:00', 'timeZone': 'America/New_York'})
+        self.assertEqual(daily['recurrence'], ['RRULE:FREQ=DAILY'])
+        self.assertEqual(daily['end'], {'dateTime': '2020-01-06T14:00:00+00:00', 'timeZone': 'UTC'})
+
+    def test_import_csv(self):
+        f = io.StringIO(newline='')
+        gcalendar.export_events(self.events, f, 'csv')
+        f.seek(0)
+        events = [*gcalendar.iter_csv_events(f)]
+        self.assertEqual(events[0]['start'], {'dateTime': '2020-01-02T09:00:00-05:00'})
+        self.assertEqual(events[1]['start'], {'date': '2020-01-03'})
+
+        mutations = gcalendar.plan_import(events, 'events.csv')
+        self.assertEqual([m['action'] for m in mutations], ['insert', 'insert'])
+        self.assertEqual(mutations, gcalendar.plan_import(events, 'events.csv'))
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = gcalendar.JOURNAL_DIRECTORY
+        gcalendar.JOURNAL_DIRECTORY = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(gcalendar.JOURNAL_DIRECTORY)
+        gcalendar.JOURNAL_DIRECTORY = self.directory
+
+    def test_resume(self):
+        mutations = [{'action': 'delete', 'calendarId': 'primary', 'eventId': str(i)} for i in range(4)]
+        journal = gcalendar.Journal.create('delete today', mutations)
+        journal.mark_done([0, 2])
+
+        journals = gcalendar.Journal.unfinished()
+        self.assertEqual(len(journals), 1)
+        self.assertEqual(journals[0].description, 'delete today')
+        self.assertEqual(journals[0].pending(), [mutations[1], mutations[3]])
+
+        journals[0].finish()
+        self.assertEqual(gcalendar.Journal.unfinished(), [])
+
+class TestEventStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = gcalendar.EventStore(os.path.join(self.directory, 'events.db'))
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.directory)
+
+    def event(self, event_id, start, end, color='7'):
+        return {'id': event_id, 'colorId': color, 'start': {'dateTime': start}, 'end': {'dateTime': end}}
+
+    def test_rollups(self):
+        self.store.apply('me', self.event('a', '2020-01-02T09:00:00-05:00', '2020-01-02T10:00:00-05:00'))
+        self.store.apply('me', self.event('b', '2020-01-02T09:30:00-05:00', '2020-01-02T11:00:00-05:00'))
+        self.store.apply('me', self.event('c', '2020-01-03T23:00:00-05:00', '2020-01-04T01:00:00-05:00'))
+        self.store.apply('me', {'id': 'd', 'start': {'date': '2020-01-03'}, 'end': {'date': '2020-01-04'}})
+
+        day = datetime.datetime(2020, 1, 2)
+        hour = datetime.timedelta(hours=1)
+        self.assertEqual(self.store.total('7', day, day, ['me']), 2.5*hour)
+        self.assertEqual(self.store.total('7', day, day + 2*24*hour, ['me']), 4.5*hour)
+        self.assertEqual(self.store.report(day, day + 2*24*hour, ['me'], 'day'), [
+            ('2020-01-02', '7', 2.5*hour), ('2020-01-03', '7', hour), ('2020-01-04', '7', hour)])
+
+        self.store.apply('me', {'id': 'b', 'status': 'cancelled'})
+        self.assertEqual(self.store.total('7', day, day, ['me']), hour)
+
+    def test_rollups_match_color_time(self):
+        events = [
+            self.event('a', '2020-01-02T09:00:00-05:00', '2020-01-02T10:00:00-05:00'),
+            self.event('b', '2020-01-02T09:30:00-05:00', '2020-01-02T11:00:00-05:00'),
+            self.event('c', '2020-01-02T23:00:00-05:00', '2020-01-03T01:15:00-05:00'),
+            self.event('d', '2020-01-03T12:00:00-05:00', '2020-01-03T13:00:00-05:00', '2'),
+        ]
+        for event in events:
+            self.store.apply('me', event)
+
+        get_events_in_range = gcalendar.get_events_in_range
+        gcalendar.get_events_in_range = lambda service, dt1, dt2, calendar_ids: events
+        try:
+            for dt1, dt2 in [(datetime.datetime(2020, 1, 2), datetime.datetime(2020, 1, 2)),
+                             (datetime.datetime(2020, 1, 3), datetime.datetime(2020, 1, 3)),
+                             (datetime.datetime(2020, 1, 1), datetime.datetime(2020, 1, 4))]:
+                for color_id in ['7', '2']:
+                    self.assertEqual(self.store.total(color_id, dt1, dt2, ['me']),
+                                     gcalendar.color_time(None, color_id, dt1, dt2, ['me']))
+        finally:
+            gcalendar.get_events_in_range = get_events_in_range
+
+    def test_busy_intervals(self):
+        self.store.apply('me', self.event('a', '2020-01-02T09:00:00-05:00', '2020-01-02T10:00:00-05:00'))
+        self.store.apply('work', self.event('b', '2020-01-02T09:30:00-05:00', '2020-01-02T11:00:00-05:00'))
+        self.store.apply('work', dict(self.event('c', '2020-01-02T13:00:00-05:00', '2020-01-02T14:00:00-05:00'),
+                                      transparency='transparent'))
+        self.store.apply('me', {'id': 'd', 'start': {'date': '2020-01-04'}, 'end': {'date': '2020-01-05'}})
+
+        #stored in its own timezone, 07:00 to 08:00 in New York
+        self.store.apply('home', self.event('e', '2020-01-02T13:00:00+01:00', '2020-01-02T14:00:00+01:00'))
+
+        day = datetime.datetime(2020, 1, 2)
+        hour = datetime.timedelta(hours=1)
+        with local_timezone('America/New_York'):
+            self.assertEqual(self.store.busy_intervals(day, day, ['me', 'work']), [(day + 9*hour, day + 11*hour)])
+            self.assertEqual(self.store.busy_intervals(day, day + 48*hour, ['me']),
+                    [(day + 9*hour, day + 10*hour), (day + 48*hour, day + 72*hour)])
+            self.assertEqual(self.store.busy_intervals(day, day, ['home', 'me']),
+                    [(day + 7*hour, day + 8*hour), (day + 9*hour, day + 10*hour)])
+
+    def test_search(self):
+        self.store.apply('me', dict(self.event('a', '2020-01-02T09:00:00-05:00', '2020-01-02T09:15:00-05:00'),
+                                    summary='Daily standup'))
+        self.store.apply('me', dict(self.event('b', '2020-01-03T09:00:00-05:00', '2020-01-03T09:15:00-05:00', '2'),
+                                    summary='Standup', location='Room "4"'))
+        self.store.apply('work', dict(self.event('c', '2020-01-04T09:00:00-05:00', '2020-01-04T10:00:00-05:00'),
+                                      summary='Planning', description='after standup'))
+
+        def ids(**kwargs):
+            return [event['id'] for calendar_id, event in self.store.search(**kwargs)]
+        self.assertEqual(ids(text='standup'), ['a', 'b', 'c'])
+        self.assertEqual(ids(text='stand room'), ['b'])
+        self.assertEqual(ids(text='standup', color_id='7'), ['a', 'c'])
+        self.assertEqual(ids(text='standup', calendar_ids=['me'], dt1=datetime.datetime(2020, 1, 3)), ['b'])
+
+        self.store.apply('me', dict(self.event('b', '2020-01-03T09:00:00-05:00', '2020-01-03T09:15:00-05:00'),
+                                    summary='Retro'))
+        self.assertEqual(ids(text='standup'), ['a', 'c'])
+
+class TestNotificationReceiver(unittest.TestCase):
+
+    def setUp(self):
+        self.receiver = gcalendar.NotificationReceiver('127.0.0.1', 0, token='secret')
+        self.receiver.add_channel('channel', 'me@example.com')
+        self.receiver.start()
+
+    def tearDown(self):
+        self.receiver.stop()
+
+    def post(self, token, state):
+        request = urllib.request.Request(f'http://127.0.0.1:{self.receiver.port}/', data=b'', method='POST', headers={
+            'X-Goog-Channel-ID': 'channel', 'X-Goog-Channel-Token': token, 'X-Goog-Resource-State': state})
+        try:
+            return urllib.request.urlopen(request).status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    def test_notifications(self):
+        self.assertEqual(self.post('secret', 'sync'), 200)
+        self.assertEqual(self.receiver.changed(0), set())
+
+        self.assertEqual(self.post('wrong', 'exists'), 403)
+        self.assertEqual(self.receiver.changed(0), set())
+
+        self.assertEqual(self.post('secret', 'exists'), 200)
+        self.assertEqual(self.post('secret', 'exists'), 200)
+        self.assertEqual(self.receiver.changed(1), {'me@example.com'})
+        self.assertEqual(self.receiver.changed(0), set())
+
+class TestDaemon(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.directory, 'daemon.sock')
+        self.streams = (sys.stdin, sys.stdout, sys.stderr)
+        sys.stdin, sys.stdout, sys.stderr = (gcalendar._ThreadStream(stream) for stream in self.streams)
+        self.run_command = gcalendar.run_command
+        gcalendar.run_command = self.fake_command
+        self.server = gcalendar.make_daemon_server(self.socket_path, {})
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        gcalendar.run_command = self.run_command
+        sys.stdin, sys.stdout, sys.stderr = self.streams
+        shutil.rmtree(self.directory)
+
+    def fake_command(self, args, obj):
+        if args == ['confirm']:
+            return 0 if click.confirm('Sure?') else 5
+        print(os.getcwd())
+        return 3
+
+    def forward(self, args):
+        output = io.StringIO()
+        sys.stdout.set(output)
+        try:
+            return gcalendar.forward_to_daemon(args, self.socket_path), output.getvalue()
+        finally:
+            sys.stdout.set(None)
+
+    def test_run_command(self):
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            self.assertEqual(self.run_command(['--help'], {'service': None}), 0)
+            self.assertEqual(self.run_command(['--profile', 'work', 'list'], {'service': None}), 1)
+            self.assertEqual(self.run_command(['nothing'], {'service': None}), 2)
+        self.assertIn('Usage:', output.getvalue())
+
+    def test_forward(self):
+        self.assertEqual(self.forward(['print']), (3, os.getcwd() + '\n'))
+        self.assertIsNone(gcalendar.forward_to_daemon(['print'], os.path.join(self.directory, 'missing.sock')))
+
+    def test_can_forward(self):
+        profile = os.environ.pop('GCALENDAR_PROFILE', None)
+        try:
+            self.assertTrue(gcalendar_client.can_forward(['list', 'today']))
+            self.assertTrue(gcalendar_client.can_forward(['--pool-size', '4', '--profile=default', 'list']))
+            self.assertFalse(gcalendar_client.can_forward(['--profile', 'work', 'list']))
+            self.assertFalse(gcalendar_client.can_forward(['shell']))
+            self.assertFalse(gcalendar_client.can_forward(['--help']))
+            self.assertFalse(gcalendar_client.can_forward(['--profile']))
+            self.assertFalse(gcalendar_client.can_forward([]))
+            os.environ['GCALENDAR_PROFILE'] = 'work'
+            self.assertFalse(gcalendar_client.can_forward(['list', 'today']))
+        finally:
+            os.environ.pop('GCALENDAR_PROFILE', None)
+            if profile is not None:
+                os.environ['GCALENDAR_PROFILE'] = profile
+
+    def test_main_exit_code(self):
+        socket_file = gcalendar_client.SOCKET_FILE
+        output = io.StringIO()
+        sys.stdout.set(output)
+        try:
+            #the same exit code whether the daemon runs the command or not
+            for path in [self.socket_path, os.path.join(self.directory, 'missing.sock')]:
+                gcalendar_client.SOCKET_FILE = path
+                with self.assertRaises(SystemExit) as e:
+                    gcalendar_client.main(['print'])
+                self.assertEqual(e.exception.code, 3)
+        finally:
+            gcalendar_client.SOCKET_FILE = socket_file
+            sys.stdout.set(None)
+
+    def test_prompt_does_not_block(self):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock, sock.makefile('rwb') as f:
+            sock.connect(self.socket_path)
+            f.write((json.dumps({'args': ['confirm'], 'cwd': self.directory}) + '\n').encode())
+            f.flush()
+            message = json.loads(f.readline())
+            self.assertTrue(message['prompt'])
+            self.assertIn('Sure?', message['output'])
+
+            #another client runs while the first one waits at the prompt
+            self.assertEqual(self.forward(['print']), (3, os.getcwd() + '\n'))
+
+            f.write((json.dumps({'answer': 'y\n'}) + '\n').encode())
+            f.flush()
+            self.assertEqual(json.loads(f.readline())['code'], 0)
+
+class TestShell(unittest.TestCase):
+
+    def setUp(self):
+        self.run_command = gcalendar.run_command
+        self.readline = gcalendar.readline
+        self.cache = gcalendar.EVENT_CACHE
+        gcalendar.readline = None
+        gcalendar.run_command = self.fake_command
+        self.commands = []
+
+    def tearDown(self):
+        gcalendar.run_command = self.run_command
+        gcalendar.readline = self.readline
+        gcalendar.EVENT_CACHE = self.cache
+
+    def fake_command(self, args, obj):
+        self.commands.append(args)
+        if args == ['fail']:
+            raise RuntimeError('connection reset')
+        return 0
+
+    def test_error_keeps_session(self):
+        stdin = sys.stdin
+        sys.stdin = io.StringIO('fail\nlist today\nexit\n')
+        try:
+            with contextlib.redirect_stdout(io.StringIO()) as output:
+                self.assertEqual(self.run_command(['shell'], {'service': None}), 0)
+        finally:
+            sys.stdin = stdin
+        self.assertEqual(self.commands, [['fail'], ['list', 'today']])
+        self.assertIn('RuntimeError: connection reset', output.getvalue())
+
+class TestCommands(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.file_directory = gcalendar.FILE_DIRECTORY
+        gcalendar.FILE_DIRECTORY = os.path.join(self.directory, 'gcalendar')
+        os.mkdir(gcalendar.FILE_DIRECTORY)
+        self.functions = {}
+        self.patch('JOURNAL_DIRECTORY', os.path.join(self.directory, 'journals'))
+        self.patch('ask_for_confirmation', lambda message: self.prompts.append(message) or True)
+        self.patch('run_job', self.run_job)
+        self.prompts = []
+        self.jobs = []
+
+    def tearDown(self):
+        for name, function in self.functions.items():
+            setattr(gcalendar, name, function)
+        gcalendar.FILE_DIRECTORY = self.file_directory
+        shutil.rmtree(self.directory)
+
+    def patch(self, name, function):
+        self.functions.setdefault(name, getattr(gcalendar, name))
+        setattr(gcalendar, name, function)
+
+    def run_command(self, *args):
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            code = gcalendar.run_command([*args], {'service': None})
+        return code, output.getvalue()
+
+    def run_job(self, service, journal):
+        self.jobs.append(journal.mutations)
+        journal.lock.release()
+        return True
+
+    def event(self, event_id, day, transparent=False):
+        event = {'id': event_id, 'summary': event_id,
+                 'start': {'dateTime': f'{day}T09:00:00Z'}, 'end': {'dateTime': f'{day}T10:00:00Z'}}
+        if transparent:
+            event['transparency'] = 'transparent'
+        return event
+
+    def test_move_overwrites_free_events(self):
+        events = {'2020-01-02': [self.event('a', '2020-01-02')], '2020-01-03': [self.event('b', '2020-01-03', True)]}
+        self.patch('get_events_in_range', lambda service, dt1, dt2, calendar_ids=('primary',):
+                   events[gcalendar.date_from_dt(dt1)])
+        deleted = []
+        self.patch('delete_events', lambda service, events, calendar_id='primary': deleted.extend(events) or [])
+        self.patch('move_events', lambda service, events, days, calendar_id='primary': [])
+
+        code, output = self.run_command('move', '2020-01-02', '2020-01-03')
+        self.assertEqual(code, 0, output)
+        self.assertEqual(len(self.prompts), 1)
+        self.assertEqual([e['id'] for e in deleted], ['b'])
+
+    def test_upload_confirms_free_events(self):
+        gcalendar.save_events([self.event('a', '2020-01-02')], gcalendar.FILE_DIRECTORY + '\\schedules\\day.json')
+        self.patch('get_events_in_range', lambda service, dt1, dt2, calendar_ids=('primary',):
+                   [self.event('b', '2020-01-04', True)])
+
+        code, output = self.run_command('upload', 'day', '2020-01-03', '-u', '2020-01-05', '-c')
+        self.assertEqual(code, 0, output)
+        self.assertEqual(self.prompts, ['There are already events registered for 2020-01-04, would you like to overwrite them?'])
+        self.assertEqual(len(self.jobs[0]), 3)
+
+    def test_copy_until_same_day(self):
+        self.patch('resolve_calendars', lambda service, calendars, all_calendars: ['primary'])
+        code, output = self.run_command('copy', datetime.date.today().isoformat(), 'today', '-u')
+        self.assertEqual(code, 2, output)
+
+    def test_save_until_counts_days(self):
+        event = {'id': 'a', 'start': {'date': '2020-01-02'}, 'end': {'date': '2020-01-03'}}
+        self.patch('get_events_in_range', lambda service, dt1, dt2, calendar_ids=('primary',): [event])
+
+        #today has a time of day, but the schedule still covers every date
+        until = datetime.date.today() + datetime.timedelta(days=6)
+        code, output = self.run_command('save', 'today', 'week', '-u', until.isoformat())
+        self.assertEqual(code, 0, output)
+        template = gcalendar.load_template(gcalendar.FILE_DIRECTORY + '\\schedules\\week.json')
+        self.assertEqual(template['days'], 7)
+        self.assertEqual(template['start'], gcalendar.dt_from_date(datetime.date.today().isoformat()))
+
+class TestProfiles(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = gcalendar.PROFILE_DIRECTORY
+        gcalendar.PROFILE_DIRECTORY = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(gcalendar.PROFILE_DIRECTORY)
+        gcalendar.PROFILE_DIRECTORY = self.directory
+
+    def test_profile_files(self):
+        self.assertEqual(gcalendar.profile_files(), (gcalendar.TOKEN_FILE, gcalendar.STORE_FILE))
+        token_file, store_file = gcalendar.profile_files('work')
+        self.assertEqual(os.path.dirname(token_file), gcalendar.PROFILE_DIRECTORY)
+        self.assertNotEqual(store_file, gcalendar.STORE_FILE)
+        for name in ['../work', 'a/b', '', 'C:work', 'wörk']:
+            self.assertFalse(gcalendar.is_profile_name(name))
+            with self.assertRaises(ValueError):
+                gcalendar.profile_files(name or '.')
+        self.assertTrue(gcalendar.is_profile_name('Work_2-a'))
+
+    def test_parse_accounts(self):
+        with open(gcalendar.profile_files('work')[0], 'w') as f:
+            f.write('{}')
+        self.assertEqual(gcalendar.parse_accounts('work, work'), ['work'])
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertIsNone(gcalendar.parse_accounts('work,home'))
+            self.assertIsNone(gcalendar.parse_accounts('work,../work'))
+
+    def test_run_for_accounts(self):
+        accounts = ['a', 'b', 'c', 'd']
+        obj = {'service': 'a', 'profile': 'a', 'accounts': {name: name for name in accounts}}
+
+        def slow(service):
+            time.sleep(0.2)
+            return service.upper()
+
+        start = time.monotonic()
+        results = gcalendar.run_for_accounts(obj, accounts, slow)
+        self.assertLess(time.monotonic() - start, 0.6)
+        self.assertEqual(results, {'a': 'A', 'b': 'B', 'c': 'C', 'd': 'D'})
+
+    def test_run_for_accounts_connect(self):
+        class Manager:
+            stopped = False
+
+            def stop(self):
+                self.stopped = True
+
+        def connect(token_file, pool_size):
+            name = os.path.splitext(os.path.basename(token_file))[0]
+            if name == 'expired':
+                raise ValueError('invalid token')
+            if name == 'offline':
+                raise OSError('no connection')
+            return (name, Manager())
+
+        obj = {'service': 'a', 'profile': 'a'}
+        connect_function = gcalendar.connect
+        gcalendar.connect = connect
+        try:
+            with contextlib.redirect_stdout(io.StringIO()) as output:
+                self.assertIsNone(gcalendar.run_for_accounts(obj, ['a', 'offline', 'b', 'expired'], str.upper))
+            self.assertEqual(output.getvalue().splitlines(), [
+                'Unable to connect to offline: make sure you\'re connected to the internet.',
+                'Unable to connect to expired: its token is invalid. Please authorize it again.'])
+            self.assertEqual(gcalendar.run_for_accounts(obj, ['a', 'b'], str.upper), {'a': 'A', 'b': 'B'})
+        finally:
+            gcalendar.connect = connect_function
+
+        manager = obj['account_credentials']['b']
+        gcalendar.close_sessions(obj)
+        self.assertTrue(manager.stopped)
+
+class TestCredentialManager(unittest.TestCase):
+
+    def test_legacy_token(self):
+        expiry = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+        token = {
+            'access_token': 'abc',
+            'refresh_token': 'def',
+            'client_id': 'id',
+            'client_secret': 'secret',
+            'token_expiry': expiry.strftime('%Y-%m-%dT%H:%M:%SZ'),
+        }
+        with open('test_token.json', 'w') as f:
+            json.dump(token, f)
+
+        manager = gcalendar.CredentialManager('test_token.json')
+        self.assertEqual(manager.credentials.token, 'abc')
+        self.assertFalse(manager.needs_refresh())
+
+        manager.credentials.expiry = datetime.datetime.utcnow() + datetime.timedelta(minutes=1)
+        self.assertTrue(manager.needs_refresh())
+
+    def test_refresh_uses_stored_token(self):
+        token = {'token': 'old', 'refresh_token': 'def', 'client_id': 'id', 'client_secret': 'secret',
+                 'expiry': '2020-01-01T00:00:00Z'}
+        with open('test_token.json', 'w') as f:
+            json.dump(token, f)
+        manager = gcalendar.CredentialManager('test_token.json')
+        self.assertTrue(manager.needs_refresh())
+
+        #another process refreshed the token in the meantime
+        expiry = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+        with open('test_token.json', 'w') as f:
+            json.dump(dict(token, token='new', expiry=expiry.strftime('%Y-%m-%dT%H:%M:%SZ')), f)
+
+        def refresh(request):
+            self.fail('the token was refreshed again')
+        manager.credentials.refresh = refresh
+        manager.refresh()
+        self.assertEqual(manager.credentials.token, 'new')
+        self.assertFalse(manager.needs_refresh())
+
+    def test_refresh_scope(self):
+        token = {'token': 'old', 'refresh_token': 'def', 'client_id': 'id', 'client_secret': 'secret',
+                 'expiry': '2020-01-01T00:00:00Z'}
+        with open('test_token.json', 'w') as f:
+            json.dump(token, f)
+        manager = gcalendar.CredentialManager('test_token.json')
+
+        bodies = []
+        class Response:
+            status = 200
+            headers = {}
+            data = json.dumps({'access_token': 'new', 'expires_in': 3600}).encode()
+
+        def request(url, method='GET', body=None, headers=None, **kwargs):
+            bodies.append(urllib.parse.parse_qs(body if isinstance(body, str) else body.decode()))
+            return Response()
+
+        transport = gcalendar.Request
+        gcalendar.Request = lambda http: request
+        try:
+            manager.refresh()
+        finally:
+            gcalendar.Request = transport
+        self.assertEqual(manager.credentials.token, 'new')
+        self.assertEqual(bodies[0]['scope'], ['https://www.googleapis.com/auth/calendar'])
+
+    def tearDown(self):
+        for filename in ['test_token.json', 'test_token.json.lock']:
+            if os.path.exists(filename):
+                os.remove(filename)
+
+class TestPooledHttp(unittest.TestCase):
+
+    class Connection:
+        lock = threading.Lock()
+        active = 0
+        most_active = 0
+
+        def __init__(self, credentials, http=None):
+            self.requests = 0
+            self.closed = False
+
+        def request(self, uri, **kwargs):
+            cls = TestPooledHttp.Connection
+            with cls.lock:
+                cls.active += 1
+                cls.most_active = max(cls.most_active, cls.active)
+            time.sleep(0.02)
+            self.requests += 1
+            with cls.lock:
+                cls.active -= 1
+            return (uri, id(self))
+
+        def close(self):
+            self.closed = True
+
+    def setUp(self):
+        self.authorized_http = gcalendar.AuthorizedHttp
+        gcalendar.AuthorizedHttp = self.Connection
+        self.Connection.active = self.Connection.most_active = 0
+
+    def tearDown(self):
+        gcalendar.AuthorizedHttp = self.authorized_http
+
+    def test_reuse(self):
+        http = gcalendar.PooledHttp(None, size=3)
+        self.assertEqual(len({http.request('uri')[1] for _ in range(5)}), 1)
+        self.assertEqual(http._created, 1)
+
+    def test_concurrent(self):
+        http = gcalendar.PooledHttp(None, size=3)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = [*executor.map(http.request, [f'uri{i}' for i in range(40)])]
+        self.assertEqual([uri for uri, connection in results], [f'uri{i}' for i in range(40)])
+        self.assertEqual(len({connection for uri, connection in results}), 3)
+        self.assertEqual(http._created, 3)
+        self.assertLessEqual(self.Connection.most_active, 3)
+
+        #every connection was returned to the pool
+        connections = []
+        while not http._idle.empty():
+            connections.append(http._idle.get_nowait())
+        self.assertEqual(len(connections), 3)
+        self.assertEqual(sum(c.requests for c in connections), 40)
+        for c in connections:
+            http._idle.put(c)
+        http.close()
+        self.assertTrue(all(c.closed for c in connections))
+
+class TestLocalState(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'state.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_atomic_write(self):
+        with gcalendar.atomic_write(self.filename) as f:
+            f.write('old')
+        with self.assertRaises(RuntimeError):
+            with gcalendar.atomic_write(self.filename) as f:
+                f.write('new')
+                raise RuntimeError
+        with open(self.filename) as f:
+            self.assertEqual(f.read(), 'old')
+        self.assertEqual(os.listdir(self.directory), ['state.json'])
+
+    def test_file_lock(self):
+        with gcalendar.FileLock(self.filename) as lock:
+            self.assertTrue(lock.held)
+            self.assertFalse(gcalendar.FileLock(self.filename).acquire(blocking=False))
+        other = gcalendar.FileLock(self.filename)
+        self.assertTrue(other.acquire(blocking=False))
+        other.release(remove=True)
+        self.assertFalse(os.path.exists(other.path))
+
 class TestRegexFunctions(unittest.TestCase):
 
     def setUp(self):